@@ -62,6 +62,11 @@ class DeviceDiscovery(private val context: Context) {
                 listenForDiscovery()
             }
 
+            // 发送探测包, Windows 端会立即回复, 不必等待下一次广播
+            scope.launch {
+                sendProbe()
+            }
+
             // 定期清理过期设备
             scope.launch {
                 while (isActive) {
@@ -113,6 +118,16 @@ class DeviceDiscovery(private val context: Context) {
         }
     }
 
+    private fun sendProbe() {
+        try {
+            val probe = """{"type":"probe","deviceType":"android"}""".toByteArray()
+            val packet = DatagramPacket(probe, probe.size, InetAddress.getByName("255.255.255.255"), DISCOVERY_PORT)
+            socket?.send(packet)
+        } catch (e: Exception) {
+            Log.e("DeviceDiscovery", "发送探测失败", e)
+        }
+    }
+
     private fun cleanupExpiredDevices() {
         val now = System.currentTimeMillis()
         val expiredKeys = discoveredDevices.filter { (_, device) ->
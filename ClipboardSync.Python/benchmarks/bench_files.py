@@ -0,0 +1,265 @@
+"""
+文件通道基准测试 (可在 Linux 上运行)
+
+两部分:
+  - 断点续传校验: 在回环地址上启动文件通道 (FileTransferService), 客户端经过一个可注入故障的代理下载:
+      * 客户端中途放弃, 再次调用 download_file 从 .part 的最后一个完整块继续
+      * 代理在传输中途断开连接, download_file 自动重连并从断开前的完整块继续
+      * 代理篡改一块的内容, 校验失败后从该块重新请求
+      * 格式错误的请求 (不是对象、fileId 不是字符串、offset 不是整数) 得到 fileError 或断开, 服务器不出错
+    下载结果必须与原文件相同, 续传的起点必须是预期的块边界。任何不一致都以退出码 1 结束。
+  - 吞吐量: 直连下载不同大小的文件 (loop.sendfile 发送, 每块校验哈希), 统计 MB/s。
+
+用法: python benchmarks/bench_files.py [--sizes 16M,128M] [--chunk-size 1M] [--repeats 3]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from file_transfer import HEADER_LINE_LIMIT, FileTransferService, download_file
+from metrics import Metrics
+
+SIZE_UNITS = {"K": 1024, "M": 1024 * 1024}
+CHECK_SIZE_CHUNKS = 8
+PIPE_READ_SIZE = 64 * 1024
+
+
+def parse_size(text):
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def format_size(size):
+    for unit, factor in (("M", SIZE_UNITS["M"]), ("K", SIZE_UNITS["K"])):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{unit}"
+    return str(size)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FaultyProxy:
+    """转发到文件通道的代理; 按顺序对前几个连接注入故障
+
+    faults 中每项为 None (原样转发)、("drop", n) 在文件内容的第 n 字节处断开、
+    ("corrupt", n) 把文件内容的第 n 字节取反。文件内容从服务器回复的第一个换行之后算起。
+    """
+
+    def __init__(self, target_port, faults):
+        self.target_port = target_port
+        self.faults = list(faults)
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def handle(self, client_reader, client_writer):
+        fault = self.faults.pop(0) if self.faults else None
+        server_reader, server_writer = await asyncio.open_connection("127.0.0.1", self.target_port)
+        upstream = asyncio.ensure_future(self.pipe(client_reader, server_writer))
+        try:
+            await self.pipe_down(server_reader, client_writer, fault)
+        finally:
+            upstream.cancel()
+            server_writer.close()
+            client_writer.close()
+
+    @staticmethod
+    async def pipe(reader, writer):
+        try:
+            while True:
+                data = await reader.read(PIPE_READ_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+
+    @staticmethod
+    async def pipe_down(reader, writer, fault):
+        header_done = False
+        body = 0
+        try:
+            while True:
+                data = await reader.read(PIPE_READ_SIZE)
+                if not data:
+                    break
+                if not header_done:
+                    index = data.find(b"\n")
+                    if index < 0:
+                        writer.write(data)
+                        continue
+                    header_done = True
+                    writer.write(data[:index + 1])
+                    data = data[index + 1:]
+                if fault is not None and body <= fault[1] < body + len(data):
+                    position = fault[1] - body
+                    if fault[0] == "drop":
+                        writer.write(data[:position])
+                        await writer.drain()
+                        return
+                    data = data[:position] + bytes([data[position] ^ 0xFF]) + data[position + 1:]
+                body += len(data)
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+
+
+class Abort(Exception):
+    """客户端主动放弃下载"""
+
+
+async def check_resume(service, port, workdir, source, chunk_size):
+    """断点续传校验, 返回失败项列表"""
+    failures = []
+    expected = file_digest(source)
+    file_id = service.register(source)
+
+    async def verify(name, target, header, start):
+        if not os.path.exists(target) or file_digest(target) != expected:
+            failures.append(f"{name}: 下载结果与原文件不同")
+        elif header["offset"] != start:
+            failures.append(f"{name}: 续传起点为 {header['offset']}, 预期 {start}")
+        if os.path.exists(target + ".part"):
+            failures.append(f"{name}: 完成后仍有 .part 文件")
+
+    # 客户端中途放弃: 第 3 块校验并写入后放弃, 再次下载从第 3 块结束处继续
+    target = os.path.join(workdir, "abort.bin")
+
+    def abort_after_three(received, size):
+        if received >= 3 * chunk_size:
+            raise Abort()
+    try:
+        await download_file("127.0.0.1", port, file_id, target, device_id="bench", on_progress=abort_after_three)
+        failures.append("客户端放弃: 下载没有被中断")
+    except Abort:
+        pass
+    part_size = os.path.getsize(target + ".part") if os.path.exists(target + ".part") else 0
+    if part_size != 3 * chunk_size:
+        failures.append(f"客户端放弃: .part 为 {part_size} 字节, 预期 {3 * chunk_size}")
+    header = await download_file("127.0.0.1", port, file_id, target, device_id="bench")
+    await verify("客户端放弃后续传", target, header, 3 * chunk_size)
+
+    # 连接在第 5 块中间断开: 自动重连, 从第 5 块开头继续
+    for name, fault, start in (("连接中断", ("drop", 4 * chunk_size + chunk_size // 2), 4 * chunk_size),
+                               ("块校验失败", ("corrupt", 2 * chunk_size + 7), 2 * chunk_size)):
+        proxy = FaultyProxy(port, [fault])
+        await proxy.start()
+        target = os.path.join(workdir, f"{fault[0]}.bin")
+        try:
+            header = await download_file("127.0.0.1", proxy.port, file_id, target, device_id="bench")
+            await verify(name, target, header, start)
+        except Exception as e:
+            failures.append(f"{name}: 下载失败 {e!r}")
+        finally:
+            proxy.server.close()
+
+    # 格式错误的请求: 回复 fileError 或断开, 不应导致服务器出错
+    for request in ([1, 2], {"type": "fileRequest", "fileId": [1]}, {"type": "fileRequest", "fileId": file_id,
+                                                                      "offset": []},
+                    {"type": "fileAck", "fileId": {}, "offset": 1}):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=HEADER_LINE_LIMIT)
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+        try:
+            line = await asyncio.wait_for(reader.readline(), 5)
+        except asyncio.TimeoutError:
+            failures.append(f"格式错误的请求 {request!r} 没有得到回复")
+            continue
+        finally:
+            writer.close()
+        if line and json.loads(line).get("type") != "fileError":
+            failures.append(f"格式错误的请求 {request!r} 得到了 {line[:80]!r}")
+    return failures
+
+
+async def bench_throughput(port, service, workdir, sizes, repeats):
+    """直连下载的吞吐量: [(大小, MB/s)]"""
+    results = []
+    for size in sizes:
+        source = os.path.join(workdir, f"source-{size}.bin")
+        with open(source, "wb") as f:
+            f.write(os.urandom(size))
+        file_id = service.register(source)
+        elapsed = []
+        for repeat in range(repeats):
+            target = os.path.join(workdir, f"target-{size}-{repeat}.bin")
+            started = time.perf_counter()
+            await download_file("127.0.0.1", port, file_id, target)
+            elapsed.append(time.perf_counter() - started)
+            os.remove(target)
+        results.append((size, size / min(elapsed) / 1024 / 1024))
+        os.remove(source)
+    return results
+
+
+async def run(args):
+    errors = []
+
+    class Collect(logging.Handler):
+        def emit(self, record):
+            errors.append(record.getMessage())
+    logging.getLogger("asyncio").addHandler(Collect())
+
+    chunk_size = parse_size(args.chunk_size)
+    metrics = Metrics()
+    service = FileTransferService(log=lambda message: None, metrics=metrics, chunk_size=chunk_size)
+    server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    workdir = tempfile.mkdtemp(prefix="bench_files_")
+    try:
+        source = os.path.join(workdir, "source.bin")
+        with open(source, "wb") as f:
+            f.write(os.urandom(CHECK_SIZE_CHUNKS * chunk_size + chunk_size // 3))
+        print(f"断点续传校验 (块大小 {format_size(chunk_size)}) ...")
+        failures = await check_resume(service, port, workdir, source, chunk_size)
+        failures.extend(f"服务器出错: {error}" for error in errors)
+        for failure in failures:
+            print(f"  {failure}")
+        print("全部通过" if not failures else f"失败 {len(failures)} 项")
+
+        sizes = [parse_size(size) for size in args.sizes.split(",")]
+        print(f"\n直连下载吞吐量 (每种大小 {args.repeats} 次取最快):")
+        for size, speed in await bench_throughput(port, service, workdir, sizes, args.repeats):
+            print(f"  {format_size(size):>6}  {speed:>8.1f} MB/s")
+    finally:
+        server.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文件通道基准测试")
+    parser.add_argument("--sizes", default="16M,128M", help="吞吐量测试的文件大小, 逗号分隔")
+    parser.add_argument("--chunk-size", default="1M", help="块大小")
+    parser.add_argument("--repeats", type=int, default=3, help="每种大小的下载次数")
+    args = parser.parse_args()
+    failures = asyncio.run(run(args))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
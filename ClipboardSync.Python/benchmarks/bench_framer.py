@@ -0,0 +1,302 @@
+"""
+接收端消息切分基准测试 (可在 Linux 上运行)
+
+两部分:
+  - 随机切分校验: 把混合了 JSON 行 (含多字节字符)、二进制帧、分块传输、压缩内容、带会话序号的内容和
+    大图片 JSON 行 (会被边收边解码, 包括紧凑格式和转义了 "/" 的 Base64) 的字节流
+    按随机位置切开 (包括逐字节) 喂给 MessageReader, 结果必须与一次喂入完全相同;
+    另外检查超过大小上限的 JSON 行 / 帧 / 分块传输会被拒绝, 不是对象的 JSON 行会被丢弃。任何不一致都以退出码 1 结束。
+  - 吞吐量: 大 JSON 行、大二进制帧和大量小消息按 --read-size 分段到达时, 只切分 (StreamFramer)
+    和切分 + 解析 (MessageReader) 的速度, JSON 行再与最初的 "str 拼接 + split('\\n') + json.loads"
+    写法对比 (大内容下它是平方级的)。
+
+用法: python benchmarks/bench_framer.py [--iterations 200] [--sizes 64K,1M,16M] [--read-size 256K] [--seed 1]
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from compression import ZLIB, compress
+from protocol import (
+    CHUNK_HEADER, FRAME_CHUNK, MAX_OPEN_TRANSFERS, PROTOCOL_BINARY, MessageReader, MessageTooLarge,
+    OutgoingTransfer, StreamFramer, encode_frame, encode_json_line, encode_message, make_cancel,
+    make_clipboard_message
+)
+
+SIZE_UNITS = {"K": 1024, "M": 1024 * 1024}
+SAMPLE_TEXT = "剪贴板同步 clipboard 😀 Ünïcödé "
+# 逐字节喂入的开销很大, 只对较短的字节流做
+BYTEWISE_LIMIT = 64 * 1024
+
+
+def parse_size(text):
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def random_text(rng, size):
+    repeat = size // len(SAMPLE_TEXT) + 1
+    start = rng.randrange(len(SAMPLE_TEXT))
+    return (SAMPLE_TEXT * repeat)[start:start + size]
+
+
+def random_stream(rng):
+    """生成一段混合消息的字节流"""
+    parts = []
+    for index in range(rng.randint(1, 12)):
+        kind = rng.choice(("json", "json", "frame", "image", "chunked", "zlib", "control", "large_image", "session"))
+        timestamp = 1000 + index
+        if kind == "json":
+            message = make_clipboard_message("text/plain", random_text(rng, rng.randint(0, 3000)), timestamp)
+            parts.append(encode_json_line(message))
+        elif kind == "frame":
+            message = make_clipboard_message("text/plain", random_text(rng, rng.randint(0, 3000)), timestamp)
+            parts.append(encode_message(message, PROTOCOL_BINARY))
+        elif kind == "image":
+            message = make_clipboard_message("image/png", os.urandom(rng.randint(1, 5000)), timestamp)
+            parts.append(encode_message(message, rng.choice((0, PROTOCOL_BINARY))))
+        elif kind == "chunked":
+            message = make_clipboard_message("image/png", os.urandom(rng.randint(1, 20000)), timestamp)
+            transfer = OutgoingTransfer(index + 1, message, chunk_size=rng.choice((1024, 4096)))
+            parts.extend(transfer.encode_chunk(i) for i in range(transfer.chunk_count))
+        elif kind == "zlib":
+            text = random_text(rng, rng.randint(100, 5000))
+            message = make_clipboard_message("text/plain", compress(ZLIB, text.encode('utf-8')), timestamp)
+            message["contentEncoding"] = ZLIB
+            parts.append(encode_message(message, rng.choice((0, PROTOCOL_BINARY))))
+        elif kind == "large_image":
+            data = os.urandom(rng.randint(50000, 200000))
+            if rng.random() < 0.5:
+                parts.append(encode_json_line(make_clipboard_message("image/png", data, timestamp)))
+            else:
+                # Android 客户端的紧凑格式, 部分 JSON 库会把 "/" 转义为 "\/"
+                line = json.dumps({
+                    "type": "clipboard", "contentType": "image/png",
+                    "content": base64.b64encode(data).decode('ascii'), "timestamp": timestamp
+                }, separators=(",", ":"))
+                if rng.random() < 0.5:
+                    line = line.replace("/", "\\/")
+                parts.append(line.encode('utf-8') + b"\n")
+        elif kind == "session":
+            # 带会话序号的内容: 二进制帧前有 item 帧, 分块传输在第一块之前
+            message = make_clipboard_message("image/png", os.urandom(rng.randint(1, 20000)), timestamp)
+            message.update(seq=index + 1, replayed=rng.random() < 0.5)
+            if rng.random() < 0.5:
+                parts.append(encode_message(message, rng.choice((0, PROTOCOL_BINARY))))
+            else:
+                transfer = OutgoingTransfer(index + 1, message, chunk_size=4096)
+                parts.extend(transfer.encode_chunk(i) for i in range(transfer.chunk_count))
+        else:
+            parts.append(encode_message({"type": "ping", "text": random_text(rng, 20)}, PROTOCOL_BINARY))
+            # 空行和已结束传输的取消消息都应被忽略
+            parts.append(b"\n")
+            parts.append(encode_json_line(make_cancel(index + 1000)))
+    return b"".join(parts)
+
+
+def random_splits(rng, data):
+    """把字节流切成随机长度的片段"""
+    pieces = []
+    pos = 0
+    while pos < len(data):
+        step = rng.choice((1, 2, 3, 7, 17, 4096, rng.randint(1, len(data))))
+        pieces.append(data[pos:pos + step])
+        pos += step
+    return pieces
+
+
+def feed_all(pieces, max_message_size=None):
+    reader = MessageReader() if max_message_size is None else MessageReader(max_message_size=max_message_size)
+    messages = []
+    for piece in pieces:
+        messages.extend(reader.feed(piece))
+    return messages, reader.framer.pending_bytes
+
+
+def expect_too_large(pieces, max_message_size):
+    try:
+        feed_all(pieces, max_message_size)
+    except MessageTooLarge:
+        return True
+    return False
+
+
+def run_fuzz(iterations, rng):
+    """随机切分校验, 返回失败次数"""
+    failures = 0
+    for iteration in range(iterations):
+        data = random_stream(rng)
+        expected, leftover = feed_all([data])
+        if leftover:
+            print(f"  第 {iteration} 轮: 整段喂入后仍有 {leftover} 字节未解析")
+            failures += 1
+            continue
+        splits = [random_splits(rng, data)]
+        if len(data) <= BYTEWISE_LIMIT and iteration % 10 == 0:
+            splits.append([data[i:i + 1] for i in range(len(data))])
+        for pieces in splits:
+            messages, leftover = feed_all(pieces)
+            if messages != expected or leftover:
+                print(f"  第 {iteration} 轮: 切成 {len(pieces)} 段后结果不同")
+                failures += 1
+
+    # 大小上限: JSON 行在收到换行前、帧在收到帧头时、分块传输在第一块时就应被拒绝
+    limit = 4096
+    big_line = encode_json_line(make_clipboard_message("text/plain", "x" * (limit * 2)))
+    big_frame = encode_message(make_clipboard_message("image/png", b"x" * (limit * 2)), PROTOCOL_BINARY)
+    checks = {
+        "JSON 行": [big_line[:limit + 10]],
+        "JSON 行 (逐段)": [big_line[i:i + 100] for i in range(0, limit + 200, 100)],
+        "二进制帧": [big_frame[:64]],
+    }
+    for name, pieces in checks.items():
+        if not expect_too_large(pieces, limit):
+            print(f"  超过上限的{name}没有被拒绝")
+            failures += 1
+
+    transfer = OutgoingTransfer(1, make_clipboard_message("image/png", b"x" * (limit * 4)), chunk_size=1024)
+    chunks = [transfer.encode_chunk(i) for i in range(transfer.chunk_count)]
+    tail = encode_json_line({"type": "ping"})
+    messages, leftover = feed_all(chunks + [tail], limit)
+    if messages != [{"type": "ping"}] or leftover:
+        print("  超过上限的分块传输没有被丢弃")
+        failures += 1
+
+    # 声明长度之后继续发送的分块被拒绝 (整个传输丢弃), 不会无限累积
+    overflow = [encode_frame(FRAME_CHUNK, CHUNK_HEADER.pack(2, index, 100) + b"x" * (90 if index == 0 else 900))
+                for index in range(50)]
+    reader = MessageReader(max_message_size=1000)
+    for piece in overflow:
+        reader.feed(piece)
+    if reader.transfers:
+        print("  超过声明长度的分块传输没有被丢弃")
+        failures += 1
+
+    # 同时进行的传输数和合计大小都有上限
+    opened = [OutgoingTransfer(10 + i, make_clipboard_message("image/png", b"x" * 3000), chunk_size=1024)
+              for i in range(MAX_OPEN_TRANSFERS + 2)]
+    reader = MessageReader()
+    for transfer in opened:
+        reader.feed(transfer.encode_chunk(0))
+    if len(reader.transfers) != MAX_OPEN_TRANSFERS:
+        print(f"  同时进行的传输数没有被限制: {len(reader.transfers)}")
+        failures += 1
+    reader = MessageReader(max_message_size=5000)
+    for transfer in opened[:2]:
+        reader.feed(transfer.encode_chunk(0))
+    if len(reader.transfers) != 1:
+        print("  分块传输的合计大小没有被限制")
+        failures += 1
+
+    # 分块头不完整的分块帧和 transferId 不是整数的取消消息被忽略
+    broken = [encode_frame(FRAME_CHUNK, b"x" * 5), encode_json_line({"type": "cancel", "transferId": [1]}), tail]
+    messages, leftover = feed_all(broken)
+    if messages != [{"type": "ping"}] or leftover:
+        print("  分块头不完整的分块帧或格式错误的取消消息没有被忽略")
+        failures += 1
+
+    # contentType 或 content 类型不对的剪贴板消息丢弃
+    for bad in ({"contentType": 5, "content": "x"}, {"contentType": "image/png", "content": 5},
+                {"contentType": "text/plain", "content": [1], "contentEncoding": "zlib"}):
+        messages, leftover = feed_all([encode_json_line(dict(bad, type="clipboard")), tail])
+        if messages != [{"type": "ping"}] or leftover:
+            print(f"  格式错误的剪贴板消息 {bad} 没有被丢弃")
+            failures += 1
+
+    # 合法但不是对象的 JSON 行直接丢弃, 不影响后面的消息
+    for value in ([1, 2], 5, "x", None):
+        messages, leftover = feed_all([json.dumps(value).encode() + b"\n", tail])
+        if messages != [{"type": "ping"}] or leftover:
+            print(f"  不是对象的 JSON 行 {value!r} 没有被丢弃")
+            failures += 1
+    return failures
+
+
+def naive_parse(pieces):
+    """最初的写法: 解码后拼接到 str, 再反复 split"""
+    buffer = ""
+    count = 0
+    for piece in pieces:
+        buffer += piece.decode('utf-8', errors='replace')
+        while '\n' in buffer:
+            line, buffer = buffer.split('\n', 1)
+            json.loads(line)
+            count += 1
+    return count
+
+
+def split_only(pieces):
+    framer = StreamFramer()
+    count = 0
+    for piece in pieces:
+        count += len(framer.feed(piece))
+    return count
+
+
+def reader_parse(pieces):
+    reader = MessageReader()
+    count = 0
+    for piece in pieces:
+        count += len(reader.feed(piece))
+    return count
+
+
+def measure(parse, pieces, total_bytes):
+    started = time.perf_counter()
+    count = parse(pieces)
+    elapsed = time.perf_counter() - started
+    return count, total_bytes / elapsed / 1024 / 1024
+
+
+def run_throughput(sizes, read_size, naive_limit):
+    print(f"\n{'场景':<20}{'大小':>10}{'切分 MB/s':>14}{'切分+解析 MB/s':>18}{'旧写法 MB/s':>16}")
+    for size in sizes:
+        scenarios = {
+            "大 JSON 行": encode_json_line(make_clipboard_message("text/plain", "x" * size)),
+            "大二进制帧": encode_message(make_clipboard_message("image/png", b"x" * size), PROTOCOL_BINARY),
+        }
+        small = encode_json_line(make_clipboard_message("text/plain", SAMPLE_TEXT))
+        scenarios["小 JSON 行 x N"] = small * max(1, size // len(small))
+        for name, data in scenarios.items():
+            pieces = [data[i:i + read_size] for i in range(0, len(data), read_size)]
+            _, split_speed = measure(split_only, pieces, len(data))
+            _, reader_speed = measure(reader_parse, pieces, len(data))
+            naive = "-"
+            if not data.startswith(b"CS") and len(data) <= naive_limit:
+                _, naive_speed = measure(naive_parse, pieces, len(data))
+                naive = f"{naive_speed:.1f}"
+            print(f"{name:<20}{len(data):>10}{split_speed:>14.1f}{reader_speed:>18.1f}{naive:>16}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="接收端消息切分基准测试")
+    parser.add_argument("--iterations", type=int, default=200, help="随机切分校验的轮数")
+    parser.add_argument("--sizes", default="64K,1M,16M", help="吞吐量测试的内容大小, 支持 K/M 后缀")
+    parser.add_argument("--read-size", default="256K", help="每次到达的数据量")
+    parser.add_argument("--naive-limit", default="64M", help="对比旧写法的最大内容 (旧写法是平方级的)")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"随机切分校验 ({args.iterations} 轮, 种子 {args.seed}) ...")
+    failures = run_fuzz(args.iterations, rng)
+    print("全部通过" if not failures else f"失败 {failures} 项")
+
+    sizes = [parse_size(value) for value in args.sizes.split(",")]
+    run_throughput(sizes, parse_size(args.read_size), parse_size(args.naive_limit))
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+同步服务器负载基准测试 (可在 Linux 上运行)
+
+每个场景 (设备数 x 内容大小) 在独立的子进程中启动同步引擎 (模拟剪贴板, 不记录历史),
+本进程用 asyncio 模拟 N 个客户端通过回环地址连接 (默认 JSON 行协议, --binary 使用二进制帧)。
+每轮在服务器进程中复制一段新文本, 等所有客户端完整收到后再进行下一轮, 统计:
+  - 端到端延迟 (复制 → 客户端收到完整消息) 的 p50 / p90 / p99 / 最大值
+  - 吞吐量 (所有客户端收到的内容字节数 / 总耗时)
+  - 服务器进程 CPU 占用 (占单核百分比) 和峰值内存 (RSS)
+
+结果可用 --output 保存为 JSON, 之后用 --compare 与之对比, 超过 --threshold 的退化会被标出
+(并以退出码 1 结束), 便于发现性能回归。
+
+用法: python benchmarks/bench_load.py [--clients 1,10,100] [--sizes 10,1K,1M] [--repeats 20]
+                                       [--binary] [--output result.json] [--compare baseline.json]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from protocol import MessageReader, encode_json_line, make_hello
+
+SIZE_UNITS = {"K": 1024, "M": 1024 * 1024}
+RECEIVE_TIMEOUT = 120.0
+INDEX_WIDTH = 8
+READ_LIMIT = 1 << 30
+
+
+def parse_size(text):
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def format_size(size):
+    for unit, factor in (("M", SIZE_UNITS["M"]), ("K", SIZE_UNITS["K"])):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{unit}"
+    return str(size)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def make_text(index, size):
+    """每轮内容不同 (开头是轮次编号), 避免被剪贴板去重"""
+    prefix = f"{index:0{INDEX_WIDTH}d}"
+    return (prefix + "x" * max(0, size - len(prefix)))[:max(size, len(prefix))]
+
+
+def run_server(conn):
+    """服务器子进程: 按命令复制文本并汇报资源占用"""
+    from clipboard_backend import SimulatedClipboardBackend
+    from sync_engine import SyncEngine
+
+    backend = SimulatedClipboardBackend()
+    # 只测量同步路径, 不含合并连续变化的等待 (见 bench_monitor.py --burst)
+    engine = SyncEngine(clipboard=backend, log=lambda message: None, stats_port=None, quiet_window=0)
+    conn.send(engine.start())
+    while True:
+        command = conn.recv()
+        if command[0] == "copy":
+            text = make_text(command[1], command[2])
+            copied_at = time.monotonic()
+            backend.set_text(text)
+            conn.send(copied_at)
+        elif command[0] == "clients":
+            conn.send(len(engine.server.clients))
+        elif command[0] == "usage":
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            conn.send((usage.ru_utime + usage.ru_stime, usage.ru_maxrss))
+        elif command[0] == "stop":
+            engine.close()
+            conn.send(None)
+            return
+
+
+class BenchClient:
+    """模拟客户端: 记录每轮内容完整到达的时间 (time.monotonic, 与服务器进程可比)"""
+
+    def __init__(self, reader, writer, binary):
+        self.reader = reader
+        self.writer = writer
+        self.binary = binary
+        self.waiters = {}
+        self.task = asyncio.ensure_future(self.read_loop())
+
+    @classmethod
+    async def connect(cls, port, binary):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=READ_LIMIT)
+        if binary:
+            writer.write(encode_json_line(make_hello()))
+            await writer.drain()
+        return cls(reader, writer, binary)
+
+    def expect(self, index):
+        future = asyncio.get_event_loop().create_future()
+        self.waiters[index] = future
+        return future
+
+    def _received(self, message, received_at):
+        if message.get("type") != "clipboard":
+            return
+        index = int(message["content"][:INDEX_WIDTH])
+        future = self.waiters.pop(index, None)
+        if future is not None and not future.done():
+            future.set_result(received_at)
+
+    async def read_loop(self):
+        try:
+            if self.binary:
+                message_reader = MessageReader()
+                while True:
+                    data = await self.reader.read(1 << 20)
+                    if not data:
+                        break
+                    messages = message_reader.feed(data)
+                    received_at = time.monotonic()
+                    for message in messages:
+                        self._received(message, received_at)
+            else:
+                while True:
+                    # readuntil 增量查找换行, 大消息也不会反复扫描整个缓冲区
+                    line = await self.reader.readuntil(b"\n")
+                    received_at = time.monotonic()
+                    self._received(json.loads(line), received_at)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+
+    async def close(self):
+        self.task.cancel()
+        self.writer.close()
+
+
+async def request(conn, command):
+    """在线程池中收发命令, 不阻塞客户端的接收"""
+    loop = asyncio.get_event_loop()
+
+    def call():
+        conn.send(command)
+        return conn.recv()
+    return await loop.run_in_executor(None, call)
+
+
+async def run_scenario(client_count, size, repeats, binary):
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=run_server, args=(child,), daemon=True)
+    process.start()
+    port = parent.recv()
+
+    clients = [await BenchClient.connect(port, binary) for _ in range(client_count)]
+    while await request(parent, ("clients",)) < client_count:
+        await asyncio.sleep(0.05)
+    if binary:
+        # 等握手回复到达, 之后的内容都按二进制帧发送
+        await asyncio.sleep(0.2)
+
+    cpu_before, _ = await request(parent, ("usage",))
+    latencies = []
+    started = time.monotonic()
+    for index in range(repeats):
+        waiters = [client.expect(index) for client in clients]
+        copied_at = await request(parent, ("copy", index, size))
+        received = await asyncio.wait_for(asyncio.gather(*waiters), RECEIVE_TIMEOUT)
+        latencies.extend(received_at - copied_at for received_at in received)
+    elapsed = time.monotonic() - started
+    cpu_after, max_rss_kb = await request(parent, ("usage",))
+
+    for client in clients:
+        await client.close()
+    await request(parent, ("stop",))
+    process.join(5)
+
+    return {
+        "clients": client_count,
+        "size": size,
+        "protocol": "binary" if binary else "json",
+        "repeats": repeats,
+        "p50Ms": round(percentile(latencies, 50) * 1000, 3),
+        "p90Ms": round(percentile(latencies, 90) * 1000, 3),
+        "p99Ms": round(percentile(latencies, 99) * 1000, 3),
+        "maxMs": round(max(latencies) * 1000, 3),
+        "throughputMBps": round(size * client_count * repeats / elapsed / 1024 / 1024, 3),
+        "cpuPercent": round((cpu_after - cpu_before) / elapsed * 100, 1),
+        "peakRssMB": round(max_rss_kb / 1024, 1),
+    }
+
+
+def scenario_key(result):
+    return (result["clients"], result["size"], result["protocol"])
+
+
+def compare(results, baseline_path, threshold):
+    """与基线对比, 返回退化的场景数"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {scenario_key(item): item for item in json.load(f)["scenarios"]}
+
+    print(f"\n与基线 {baseline_path} 对比 (阈值 {threshold:.0%}):")
+    regressions = 0
+    for result in results:
+        base = baseline.get(scenario_key(result))
+        if base is None:
+            continue
+        changes = []
+        regressed = False
+        # 延迟越高越差, 吞吐量越低越差
+        for field, higher_is_worse in (("p50Ms", True), ("p99Ms", True), ("throughputMBps", False)):
+            if not base[field]:
+                continue
+            change = (result[field] - base[field]) / base[field]
+            worse = change > threshold if higher_is_worse else change < -threshold
+            regressed = regressed or worse
+            changes.append(f"{field} {change:+.0%}{' ⚠' if worse else ''}")
+        regressions += regressed
+        print(f"  {result['clients']:>4} 设备 {format_size(result['size']):>6}  " + "  ".join(changes))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同步服务器负载基准测试")
+    parser.add_argument("--clients", default="1,10,100", help="设备数列表, 逗号分隔")
+    parser.add_argument("--sizes", default="10,1K,100K,1M", help="内容大小列表, 支持 K/M 后缀 (如 50M)")
+    parser.add_argument("--repeats", type=int, default=20, help="每个场景的复制次数")
+    parser.add_argument("--binary", action="store_true", help="客户端握手使用二进制帧协议")
+    parser.add_argument("--output", help="把结果保存为 JSON")
+    parser.add_argument("--compare", help="与之前保存的 JSON 结果对比")
+    parser.add_argument("--threshold", type=float, default=0.2, help="判定为退化的相对变化")
+    args = parser.parse_args()
+
+    client_counts = [int(value) for value in args.clients.split(",")]
+    sizes = [parse_size(value) for value in args.sizes.split(",")]
+
+    print(f"{'设备':>6}{'大小':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+          f"{'MB/s':>10}{'CPU%':>8}{'RSS MB':>8}")
+    results = []
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    for client_count in client_counts:
+        for size in sizes:
+            result = loop.run_until_complete(run_scenario(client_count, size, args.repeats, args.binary))
+            results.append(result)
+            print(f"{client_count:>6}{format_size(size):>8}{result['p50Ms']:>10.2f}{result['p90Ms']:>10.2f}"
+                  f"{result['p99Ms']:>10.2f}{result['maxMs']:>10.2f}{result['throughputMBps']:>10.2f}"
+                  f"{result['cpuPercent']:>8.1f}{result['peakRssMB']:>8.1f}", flush=True)
+    loop.close()
+
+    if args.output:
+        report = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpuCount": os.cpu_count(),
+            "scenarios": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n结果已保存到 {args.output}")
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
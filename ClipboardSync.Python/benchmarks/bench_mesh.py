@@ -0,0 +1,179 @@
+"""
+多机中继网络基准测试 (可在 Linux 上运行)
+
+在本进程中启动 N 个同步引擎 (模拟剪贴板, 不记录历史), 按指定拓扑通过回环地址互相连接:
+  - line: 链状, 每个节点连接前一个
+  - ring: 环状, 在链状基础上首尾相连 (内容会从两个方向到达, 检验环路抑制)
+  - mesh: 全连接
+每轮在其中一个节点上复制新内容 (轮流选择, 最后几轮为图片), 等所有其他节点的剪贴板都变为
+该内容, 统计传播延迟 p50 / p90 / 最大值。结束后检查每个节点正好处理了其他节点产生的每条内容
+一次、没有把自己产生的内容写回剪贴板, 任何不符都以退出码 1 结束。
+
+用法: python benchmarks/bench_mesh.py [--nodes 4] [--topology ring] [--rounds 50] [--image-rounds 5]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PIL import Image
+
+from clipboard_backend import SimulatedClipboardBackend
+from sync_engine import SyncEngine
+
+CONNECT_TIMEOUT = 10.0
+ROUND_TIMEOUT = 10.0
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def topology_peers(index, ports, topology):
+    """第 index 个节点启动时要连接的已启动节点"""
+    if topology == "mesh":
+        return ports[:index]
+    return ports[index - 1:index]
+
+
+def start_nodes(count, topology):
+    engines = []
+    ports = []
+    for index in range(count):
+        peers = [f"127.0.0.1:{port}" for port in topology_peers(index, ports, topology)]
+        # 只测量传播延迟, 不含合并连续变化的等待
+        engine = SyncEngine(clipboard=SimulatedClipboardBackend(), log=lambda message: None,
+                            stats_port=None, peers=peers, node_id=f"node{index}", quiet_window=0)
+        ports.append(engine.start())
+        engines.append(engine)
+    if topology == "ring" and count > 2:
+        # 首尾相连: 第一个节点启动时最后一个节点还不存在, 由最后一个节点再连接第一个
+        engines[-1].server.add_peer(f"127.0.0.1:{ports[0]}")
+    return engines
+
+
+def expected_links(count, topology):
+    if topology == "mesh":
+        return count * (count - 1) // 2
+    if topology == "ring" and count > 2:
+        return count
+    return count - 1
+
+
+def wait_connected(engines, links):
+    """等所有中继连接完成握手 (每条连接两端各算一次)"""
+    deadline = time.monotonic() + CONNECT_TIMEOUT
+    while time.monotonic() < deadline:
+        joined = sum(1 for engine in engines for client in list(engine.server.clients) if client.peer_id)
+        if joined >= links * 2:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_image(index):
+    """每轮不同的渐变图片"""
+    image = Image.linear_gradient("L").resize((640, 480)).convert("RGB")
+    return Image.eval(image, lambda value: (value + index * 37) % 256)
+
+
+def run_round(engines, origin, content, writes_before):
+    """在 origin 节点复制 content, 返回每个其他节点收到的延迟 (秒); 超时的节点为 None"""
+    source = engines[origin].clipboard
+    started = time.perf_counter()
+    if isinstance(content, str):
+        source.set_text(content)
+    else:
+        source.set_image(content)
+
+    pending = {index for index in range(len(engines)) if index != origin}
+    latencies = {}
+    deadline = time.monotonic() + ROUND_TIMEOUT
+    while pending and time.monotonic() < deadline:
+        for index in list(pending):
+            backend = engines[index].clipboard
+            if isinstance(content, str):
+                arrived = backend.contents.get("text/plain") == content
+            else:
+                arrived = backend.write_count > writes_before[index]
+            if arrived:
+                latencies[index] = time.perf_counter() - started
+                pending.discard(index)
+        time.sleep(0.0005)
+    for index in pending:
+        latencies[index] = None
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多机中继网络基准测试")
+    parser.add_argument("--nodes", type=int, default=4, help="节点数")
+    parser.add_argument("--topology", default="ring", choices=["line", "ring", "mesh"], help="连接拓扑")
+    parser.add_argument("--rounds", type=int, default=50, help="文本轮数")
+    parser.add_argument("--image-rounds", type=int, default=5, help="图片轮数")
+    args = parser.parse_args()
+
+    engines = start_nodes(args.nodes, args.topology)
+    failures = 0
+    try:
+        links = expected_links(args.nodes, args.topology)
+        if not wait_connected(engines, links):
+            print(f"中继连接没有在 {CONNECT_TIMEOUT} 秒内全部建立")
+            return 1
+        print(f"{args.nodes} 个节点, {args.topology} 拓扑, {links} 条中继连接")
+
+        text_latencies = []
+        image_latencies = []
+        originated = [0] * args.nodes
+        for round_index in range(args.rounds + args.image_rounds):
+            origin = round_index % args.nodes
+            is_image = round_index >= args.rounds
+            content = test_image(round_index) if is_image else f"mesh round {round_index} 剪贴板"
+            writes_before = [engine.clipboard.write_count for engine in engines]
+            latencies = run_round(engines, origin, content, writes_before)
+            originated[origin] += 1
+            missing = [index for index, value in latencies.items() if value is None]
+            if missing:
+                print(f"  第 {round_index} 轮: 节点 {missing} 没有收到")
+                failures += 1
+            (image_latencies if is_image else text_latencies).extend(
+                value for value in latencies.values() if value is not None
+            )
+            # 监听器会把连续的变化合并, 每轮之间留出间隔
+            time.sleep(0.02)
+
+        # 等残留的转发结束后核对计数
+        time.sleep(0.5)
+        total = sum(originated)
+        duplicates = 0
+        for index, engine in enumerate(engines):
+            counters = engine.server.get_stats()["counters"]
+            duplicates += counters.get("relayDuplicates", 0)
+            expected = total - originated[index]
+            received = counters.get("relayReceived", 0)
+            writes = engine.clipboard.write_count
+            if received != expected or writes != expected:
+                print(f"  节点 {index}: 应处理 {expected} 条, 实际处理 {received} 条, 写入剪贴板 {writes} 次")
+                failures += 1
+
+        for name, values in (("文本", text_latencies), ("图片", image_latencies)):
+            if values:
+                print(f"{name}传播延迟 (ms): p50 {percentile(values, 50) * 1000:.2f}  "
+                      f"p90 {percentile(values, 90) * 1000:.2f}  最大 {max(values) * 1000:.2f}")
+        print(f"被丢弃的重复到达: {duplicates}")
+        print("全部通过" if not failures else f"失败 {failures} 项")
+    finally:
+        for engine in engines:
+            engine.close()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+剪贴板监听基准测试 (可在 Linux 上运行)
+
+用模拟剪贴板驱动 ClipboardMonitor, 统计从"复制"到回调的延迟以及实际读取次数。
+--burst N 时每次变化由 N 次间隔 --burst-interval 毫秒的连续复制组成 (模拟快速复制或程序反复改写),
+延迟从最后一次复制算起, 同时统计回调次数: 合并生效时每次变化只回调一次, 且是最终内容。
+
+用法: python benchmarks/bench_monitor.py [--changes 200] [--idle 2.0] [--quiet-window 50]
+                                          [--burst 5] [--burst-interval 5]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from clipboard_backend import QUIET_WINDOW, ClipboardMonitor, SimulatedClipboardBackend
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="剪贴板监听延迟基准测试")
+    parser.add_argument("--changes", type=int, default=200, help="模拟的剪贴板变化次数")
+    parser.add_argument("--idle", type=float, default=2.0, help="空闲观察时长 (秒)")
+    parser.add_argument("--quiet-window", type=float, default=QUIET_WINDOW * 1000, help="合并窗口 (毫秒), 0 表示不合并")
+    parser.add_argument("--burst", type=int, default=1, help="每次变化包含的连续复制次数")
+    parser.add_argument("--burst-interval", type=float, default=5.0, help="连续复制之间的间隔 (毫秒)")
+    args = parser.parse_args()
+
+    backend = SimulatedClipboardBackend()
+    received = threading.Event()
+    latencies = []
+    copied_at = [0.0]
+    expected = [None]
+    callbacks = [0]
+    stale = [0]
+
+    def on_text(text):
+        callbacks[0] += 1
+        if text != expected[0]:
+            stale[0] += 1
+            return
+        latencies.append(time.perf_counter() - copied_at[0])
+        received.set()
+
+    monitor = ClipboardMonitor(backend, on_image=lambda data: None, on_text=on_text, log=lambda msg: None,
+                               quiet_window=args.quiet_window / 1000)
+    monitor.start()
+
+    # 空闲期间不应读取剪贴板
+    time.sleep(args.idle)
+    idle_reads = backend.read_count
+
+    reads_before = backend.read_count
+    callbacks[0] = 0
+    for i in range(args.changes):
+        received.clear()
+        expected[0] = f"benchmark text {i}"
+        for step in range(args.burst - 1):
+            backend.set_text(f"benchmark text {i} step {step}")
+            time.sleep(args.burst_interval / 1000)
+        copied_at[0] = time.perf_counter()
+        backend.set_text(expected[0])
+        received.wait(5.0)
+    change_reads = backend.read_count - reads_before
+
+    monitor.stop()
+
+    print(f"变化次数:       {args.changes}")
+    print(f"空闲 {args.idle:.1f}s 读取次数: {idle_reads}")
+    print(f"变化期间读取次数: {change_reads} (每次变化 {change_reads / max(1, args.changes):.1f} 次)")
+    if args.burst > 1:
+        print(f"每次变化连续复制: {args.burst} 次, 间隔 {args.burst_interval:.1f} ms")
+        print(f"回调次数:       {callbacks[0]} (其中中间状态 {stale[0]} 次)")
+    print(f"延迟 p50:       {percentile(latencies, 50) * 1000:.3f} ms")
+    print(f"延迟 p99:       {percentile(latencies, 99) * 1000:.3f} ms")
+    print(f"延迟 max:       {max(latencies) * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+加密通道基准测试 (可在 Linux 上运行)
+
+同步服务器运行在独立的子进程中 (只启动网络层), 本进程用 asyncio 模拟客户端通过回环地址连接
+(二进制帧协议), 对比明文和各 AEAD 算法:
+  - 握手延迟: 连接 → 收到握手回复并派生出密钥, 分明文、完整握手 (X25519) 和凭票据恢复会话
+  - 大图片: 服务器每轮发送一张新图片 (不可压缩的随机数据, 按 PNG 内容类型走分块传输),
+    统计发送 → 所有客户端完整收到并解密的延迟、吞吐量, 以及服务器进程每 MB 的 CPU 时间
+  - 记录加解密本身的吞吐量 (本进程内, 不经过网络)
+
+用法: python benchmarks/bench_secure.py [--sizes 1M,8M,32M] [--clients 1] [--repeats 10]
+                                         [--handshakes 200] [--modes plain,aes-256-gcm,chacha20-poly1305]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from protocol import MessageReader, encode_json_line, make_hello
+from secure_channel import (
+    MAX_RECORD_SIZE, ClientHandshake, Pairing, PairingStore, RecordOpener, RecordSealer, TicketStore,
+    accept_offer, available_ciphers
+)
+
+SIZE_UNITS = {"K": 1024, "M": 1024 * 1024}
+INDEX_WIDTH = 8
+RECEIVE_TIMEOUT = 120.0
+READ_LIMIT = 1 << 30
+PLAIN = "plain"
+
+
+def parse_size(text):
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def format_size(size):
+    for unit, factor in (("M", SIZE_UNITS["M"]), ("K", SIZE_UNITS["K"])):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{unit}"
+    return str(size)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_server(conn, max_size):
+    """服务器子进程: 按命令发送图片并汇报资源占用"""
+    from sync_server import SyncServer
+
+    pairings = PairingStore()
+    pairing = pairings.create("bench")
+    server = SyncServer(log=lambda message: None, pairings=pairings)
+    blob = os.urandom(max_size)
+    conn.send((server.start(), pairing.code))
+    while True:
+        command = conn.recv()
+        if command[0] == "image":
+            _, index, size = command
+            content = f"{index:0{INDEX_WIDTH}d}".encode() + blob[INDEX_WIDTH:size]
+            sent_at = time.monotonic()
+            server.broadcast({"type": "clipboard", "contentType": "image/png", "content": content,
+                              "timestamp": int(time.time() * 1000)})
+            conn.send(sent_at)
+        elif command[0] == "clients":
+            conn.send(sum(1 for client in list(server.clients) if client.protocol_version))
+        elif command[0] == "usage":
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            conn.send(usage.ru_utime + usage.ru_stime)
+        elif command[0] == "stop":
+            server.stop()
+            conn.send(None)
+            return
+
+
+async def handshake(port, pairing=None, cipher=None, ticket=None):
+    """建立连接并完成握手, 返回 (reader, writer, SecureSession 或 None, 握手回复之后已收到的数据)"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=READ_LIMIT)
+    hello = make_hello()
+    hello["protocolVersions"] = [1]
+    client_handshake = None
+    if pairing is not None:
+        client_handshake = ClientHandshake(pairing, ticket, [cipher] if cipher else None)
+        hello["secure"] = client_handshake.offer()
+    writer.write(encode_json_line(hello))
+    await writer.drain()
+    buffer = b""
+    while b"\n" not in buffer:
+        data = await reader.read(65536)
+        if not data:
+            raise ConnectionError("服务器关闭了连接")
+        buffer += data
+    line, _, rest = buffer.partition(b"\n")
+    reply = json.loads(line)
+    session = client_handshake.finish(reply.get("secure")) if client_handshake else None
+    return reader, writer, session, rest
+
+
+class BenchClient:
+    """模拟客户端: 解密 (加密模式) 并解析收到的数据, 记录每轮图片完整到达的时间"""
+
+    def __init__(self, reader, writer, session, rest):
+        self.reader = reader
+        self.writer = writer
+        self.opener = session.opener if session else None
+        self.message_reader = MessageReader()
+        self.waiters = {}
+        self.task = asyncio.ensure_future(self.read_loop(rest))
+
+    def expect(self, index):
+        future = asyncio.get_event_loop().create_future()
+        self.waiters[index] = future
+        return future
+
+    async def read_loop(self, data):
+        try:
+            while True:
+                if data:
+                    plain = self.opener.open(data) if self.opener else data
+                    received_at = time.monotonic()
+                    for message in self.message_reader.feed(plain):
+                        if message.get("type") != "clipboard":
+                            continue
+                        future = self.waiters.pop(int(message["content"][:INDEX_WIDTH]), None)
+                        if future is not None and not future.done():
+                            future.set_result(received_at)
+                data = await self.reader.read(1 << 20)
+                if not data:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    async def close(self):
+        self.task.cancel()
+        self.writer.close()
+
+
+async def request(conn, command):
+    """在线程池中收发命令, 不阻塞客户端的接收"""
+    loop = asyncio.get_event_loop()
+
+    def call():
+        conn.send(command)
+        return conn.recv()
+    return await loop.run_in_executor(None, call)
+
+
+async def bench_handshakes(port, pairing, count):
+    """各种握手方式的延迟 (秒): {名称: [延迟]}"""
+    results = {"明文": [], "完整握手": [], "恢复会话": []}
+    ticket = None
+    for _ in range(count):
+        for name in results:
+            started = time.perf_counter()
+            if name == "明文":
+                _, writer, _, _ = await handshake(port)
+            else:
+                _, writer, session, _ = await handshake(port, pairing, ticket=ticket if name == "恢复会话" else None)
+                ticket = session.ticket
+            results[name].append(time.perf_counter() - started)
+            writer.close()
+    return results
+
+
+def bench_handshake_cpu(count):
+    """不经过网络, 双方握手计算本身的耗时 (秒): {名称: 每次耗时}"""
+    pairings = PairingStore()
+    pairing = pairings.create()
+    tickets = TicketStore()
+    results = {}
+    ticket = None
+    for name in ("完整握手", "恢复会话"):
+        started = time.perf_counter()
+        for _ in range(count):
+            client = ClientHandshake(pairing, ticket if name == "恢复会话" else None)
+            session = accept_offer(client.offer(), pairings, tickets)
+            ticket = client.finish(session.reply).ticket
+        results[name] = (time.perf_counter() - started) / count
+    return results
+
+
+def bench_records(size=32 * 1024 * 1024):
+    """记录加解密的吞吐量 (MB/s): [(算法, 记录大小, 加密, 解密)]"""
+    data = os.urandom(size)
+    results = []
+    for cipher in available_ciphers():
+        for record_size in (16 * 1024, 64 * 1024, MAX_RECORD_SIZE):
+            key = os.urandom(32)
+            sealer = RecordSealer(cipher, key, record_size)
+            opener = RecordOpener(cipher, key, record_size)
+            started = time.perf_counter()
+            wire = b"".join(sealer.seal(data))
+            sealed = time.perf_counter() - started
+            started = time.perf_counter()
+            plain = opener.open(wire)
+            opened = time.perf_counter() - started
+            assert plain == data
+            results.append((cipher, record_size, size / sealed / 1024 / 1024, size / opened / 1024 / 1024))
+    return results
+
+
+async def run_mode(port, parent, pairing, mode, sizes, client_count, repeats, first_index):
+    """一种模式 (明文或某个算法) 下各图片大小的结果"""
+    clients = []
+    for _ in range(client_count):
+        if mode == PLAIN:
+            connection = await handshake(port)
+        else:
+            connection = await handshake(port, pairing, mode)
+        clients.append(BenchClient(*connection))
+    while await request(parent, ("clients",)) < client_count:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.1)
+
+    results = []
+    index = first_index
+    for size in sizes:
+        latencies = []
+        cpu_before = await request(parent, ("usage",))
+        started = time.monotonic()
+        for _ in range(repeats):
+            waiters = [client.expect(index) for client in clients]
+            sent_at = await request(parent, ("image", index, size))
+            received = await asyncio.wait_for(asyncio.gather(*waiters), RECEIVE_TIMEOUT)
+            latencies.extend(received_at - sent_at for received_at in received)
+            index += 1
+        elapsed = time.monotonic() - started
+        cpu = await request(parent, ("usage",)) - cpu_before
+        total_mb = size * client_count * repeats / 1024 / 1024
+        results.append({
+            "mode": mode,
+            "size": size,
+            "p50Ms": percentile(latencies, 50) * 1000,
+            "p90Ms": percentile(latencies, 90) * 1000,
+            "throughputMBps": total_mb / elapsed,
+            "serverCpuMsPerMB": cpu * 1000 / total_mb,
+        })
+    for client in clients:
+        await client.close()
+    await asyncio.sleep(0.1)
+    return results, index
+
+
+async def run(args):
+    sizes = [parse_size(size) for size in args.sizes.split(",")]
+    modes = [mode.strip() for mode in args.modes.split(",")]
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=run_server, args=(child, max(sizes)), daemon=True)
+    process.start()
+    port, code = parent.recv()
+    pairing = Pairing.parse(code)
+
+    try:
+        print(f"握手延迟 (回环, {args.handshakes} 次):")
+        for name, values in (await bench_handshakes(port, pairing, args.handshakes)).items():
+            print(f"  {name:<8} p50 {percentile(values, 50) * 1000:.3f} ms  p90 {percentile(values, 90) * 1000:.3f} ms")
+        print("握手计算 (双方合计, 不含网络):")
+        for name, seconds in bench_handshake_cpu(args.handshakes).items():
+            print(f"  {name:<8} {seconds * 1e6:.0f} us")
+
+        print(f"\n大图片 ({args.clients} 个客户端, 每种大小 {args.repeats} 轮):")
+        print(f"  {'模式':<18} {'大小':>6} {'p50 ms':>9} {'p90 ms':>9} {'MB/s':>9} {'服务器 CPU ms/MB':>16}")
+        baseline = {}
+        index = 0
+        for mode in modes:
+            results, index = await run_mode(port, parent, pairing, mode, sizes, args.clients, args.repeats, index)
+            for result in results:
+                if mode == PLAIN:
+                    baseline[result["size"]] = result
+                base = baseline.get(result["size"])
+                overhead = f"  ({(result['p50Ms'] / base['p50Ms'] - 1) * 100:+.0f}% p50)" \
+                    if base and mode != PLAIN else ""
+                print(f"  {mode:<18} {format_size(result['size']):>6} {result['p50Ms']:>9.2f} "
+                      f"{result['p90Ms']:>9.2f} {result['throughputMBps']:>9.1f} "
+                      f"{result['serverCpuMsPerMB']:>16.2f}{overhead}")
+
+        print("\n记录加解密吞吐量 (MB/s, 单线程):")
+        for cipher, record_size, seal, open_ in bench_records():
+            print(f"  {cipher:<18} 记录 {record_size // 1024:>4} KB  加密 {seal:>8.0f}  解密 {open_:>8.0f}")
+    finally:
+        await request(parent, ("stop",))
+        process.join(5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="加密通道基准测试")
+    parser.add_argument("--sizes", default="1M,8M,32M", help="图片大小, 逗号分隔")
+    parser.add_argument("--clients", type=int, default=1, help="客户端数")
+    parser.add_argument("--repeats", type=int, default=10, help="每种大小的轮数")
+    parser.add_argument("--handshakes", type=int, default=200, help="握手次数")
+    parser.add_argument("--modes", default=",".join((PLAIN,) + available_ciphers()),
+                        help="要对比的模式 (plain 或算法名), 逗号分隔")
+    args = parser.parse_args()
+    if not available_ciphers():
+        print("未安装 cryptography, 无法测试加密通道")
+        return 1
+    asyncio.run(run(args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
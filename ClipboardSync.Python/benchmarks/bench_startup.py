@@ -0,0 +1,59 @@
+"""
+启动时间基准测试 (可在 Linux 上运行)
+
+在新的解释器进程中测量: 空解释器、导入同步引擎、启动引擎直到端口可连接,
+以及导入图形界面模块 (需要 tkinter) 的耗时, 每项重复多次取中位数。
+
+用法: python benchmarks/bench_startup.py [--runs 10]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+SCENARIOS = [
+    ("空解释器", "pass"),
+    ("导入同步引擎", "import sync_engine"),
+    ("启动引擎 (无界面)", """
+import socket
+from clipboard_backend import SimulatedClipboardBackend
+from sync_engine import SyncEngine
+engine = SyncEngine(clipboard=SimulatedClipboardBackend(), log=lambda message: None)
+port = engine.start()
+socket.create_connection(("127.0.0.1", port)).close()
+engine.close()
+"""),
+    ("导入图形界面模块", "import clipboard_sync, tkinter.scrolledtext"),
+]
+
+
+def run_once(code):
+    """在新进程中执行代码, 返回墙钟耗时 (秒); 失败返回 None"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code], cwd=APP_DIR,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - start
+    return elapsed if result.returncode == 0 else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动时间基准测试")
+    parser.add_argument("--runs", type=int, default=10, help="每项重复次数")
+    args = parser.parse_args()
+
+    for name, code in SCENARIOS:
+        timings = [run_once(code) for _ in range(args.runs)]
+        if None in timings:
+            print(f"{name:<16} 运行失败 (缺少依赖?)")
+            continue
+        timings.sort()
+        median = timings[len(timings) // 2]
+        print(f"{name:<16} 中位数 {median * 1000:7.1f} ms   最小 {timings[0] * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
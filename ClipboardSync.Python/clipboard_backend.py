@@ -0,0 +1,790 @@
+"""
+剪贴板后端 - 读写系统剪贴板并通知内容变化
+
+Windows 端通过 AddClipboardFormatListener 接收 WM_CLIPBOARDUPDATE 通知,
+无法创建监听窗口时退化为轮询 GetClipboardSequenceNumber (不占用剪贴板锁)。
+SimulatedClipboardBackend 是纯内存实现, 用于在 Linux 上驱动和测试监听逻辑。
+
+写入通过 set_contents({内容类型: 数据}) 一次放入多种格式 (文本、HTML、RTF、位图、PNG 原始数据),
+后端记住自己写入后的序列号, 监听器据此不把收到的内容再发回去。
+除文本和图片外, get_formats() 读取 HTML、RTF 和文件列表 (text/uri-list)。
+"""
+
+import hashlib
+import html
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+
+from image_encoding import BMP, PNG, ClipboardImage, decode_image, image_to_bmp
+from manifest import EXTRA_FORMATS, HTML, RTF, TEXT, URI_LIST, ClipboardChange
+
+CF_HTML_HEADER = (
+    "Version:0.9\r\nStartHTML:{0:010d}\r\nEndHTML:{1:010d}\r\n"
+    "StartFragment:{2:010d}\r\nEndFragment:{3:010d}\r\n"
+)
+CF_HTML_PREFIX = "<html><body>\r\n<!--StartFragment-->"
+CF_HTML_SUFFIX = "<!--EndFragment-->\r\n</body></html>"
+CF_HTML_OFFSET = re.compile(rb"^(StartHTML|EndHTML|StartFragment|EndFragment):(-?\d+)", re.MULTILINE)
+HTML_TAG = re.compile(r"<[^>]*>")
+# 剪贴板连续变化时, 等安静这么久 (秒) 才读取; 持续变化时最多等 MAX_COALESCE_DELAY 秒
+QUIET_WINDOW = 0.05
+MAX_COALESCE_DELAY = 0.5
+# 停止监听时最多等监听线程退出这么久 (秒)
+STOP_TIMEOUT = 2.0
+
+
+def build_cf_html(fragment):
+    """把 HTML 片段包装为 Windows 的 "HTML Format" (带字节偏移的 UTF-8 文本)"""
+    header_size = len(CF_HTML_HEADER.format(0, 0, 0, 0))
+    prefix = CF_HTML_PREFIX.encode('utf-8')
+    body = fragment.encode('utf-8')
+    start_fragment = header_size + len(prefix)
+    end_fragment = start_fragment + len(body)
+    end_html = end_fragment + len(CF_HTML_SUFFIX)
+    header = CF_HTML_HEADER.format(header_size, end_html, start_fragment, end_fragment)
+    return header.encode('ascii') + prefix + body + CF_HTML_SUFFIX.encode('utf-8')
+
+
+def parse_cf_html(data):
+    """从 "HTML Format" 数据中取出复制的 HTML 片段, 无法解析时返回 None"""
+    offsets = {name.decode(): int(value) for name, value in CF_HTML_OFFSET.findall(data[:512])}
+    start, end = offsets.get("StartFragment", -1), offsets.get("EndFragment", -1)
+    if start < 0 or end < start:
+        start, end = offsets.get("StartHTML", -1), offsets.get("EndHTML", -1)
+    if start < 0 or end < start:
+        return None
+    return data[start:end].decode('utf-8', errors='replace')
+
+
+def html_to_text(fragment):
+    """HTML 片段的纯文本 (写入 HTML 时同时提供, 供不支持 HTML 的程序粘贴)"""
+    return html.unescape(HTML_TAG.sub("", fragment))
+
+
+def image_clipboard_contents(content_type, data):
+    """收到的图片要写入剪贴板的各种格式: 位图 (所有程序都能粘贴), PNG 另外保留原始数据 (保留透明度)"""
+    contents = {BMP: image_to_bmp(decode_image(data))}
+    if content_type == PNG:
+        contents[PNG] = bytes(data)
+    return contents
+
+
+def image_fingerprint(image):
+    """计算图片指纹 (模式, 尺寸, 原始像素摘要)
+
+    直接对像素缓冲区做哈希, 比每次编码 PNG 再比较字节快得多, 且只占几十字节。
+    """
+    digest = hashlib.blake2b(image.tobytes(), digest_size=16).digest()
+    return (image.mode, image.size, digest)
+
+
+class ClipboardBackend:
+    """剪贴板后端基类
+
+    子类实现 sequence_number()、读取方法和 _write_contents(); 每次剪贴板内容变化序列号都会改变,
+    监听器只在序列号变化后才真正读取剪贴板。
+    """
+
+    # 为 True 时后端会主动调用 _notify_change(), 否则 wait_for_change 按 poll_interval 轮询序列号
+    has_change_notification = False
+    poll_interval = 0.1
+
+    def __init__(self):
+        self._changed = threading.Condition()
+        self._interrupted = False
+        # 本程序最近一次写入后的序列号
+        self._write_lock = threading.Lock()
+        self._own_sequence = None
+
+    def sequence_number(self):
+        """返回当前剪贴板序列号"""
+        raise NotImplementedError
+
+    def get_image(self):
+        """返回剪贴板中的图片 (PIL.Image), 没有则返回 None"""
+        raise NotImplementedError
+
+    def get_text(self):
+        """返回剪贴板中的文本, 没有则返回 None"""
+        raise NotImplementedError
+
+    def get_formats(self):
+        """返回剪贴板中的 HTML / RTF / 文件列表 ({内容类型: 文本}), 不支持的后端返回空字典"""
+        return {}
+
+    def set_text(self, text):
+        """设置剪贴板文本, 成功返回 True"""
+        return self.set_contents({TEXT: text})
+
+    def set_contents(self, contents):
+        """清空剪贴板并一次写入多种格式, contents 为 {内容类型: 数据}; 至少写入一种时返回 True
+
+        文本为 str, 其余为 bytes; 后端不支持的格式被忽略。
+        """
+        with self._write_lock:
+            if not self._write_contents(contents):
+                return False
+            self._own_sequence = self.sequence_number()
+            return True
+
+    def is_own_write(self):
+        """当前剪贴板内容是否是本程序最近一次写入的 (写入进行中时等待写入完成)"""
+        with self._write_lock:
+            return self._own_sequence is not None and self.sequence_number() == self._own_sequence
+
+    def _write_contents(self, contents):
+        raise NotImplementedError
+
+    def close(self):
+        """释放后端资源"""
+        self.interrupt()
+
+    def wait_for_change(self, last_sequence, timeout=None):
+        """阻塞直到序列号不同于 last_sequence、超时或被 interrupt(), 返回当前序列号"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            while True:
+                sequence = self.sequence_number()
+                if sequence != last_sequence:
+                    return sequence
+                if self._interrupted:
+                    self._interrupted = False
+                    return sequence
+
+                wait_time = None if deadline is None else deadline - time.monotonic()
+                if wait_time is not None and wait_time <= 0:
+                    return sequence
+                if not self.has_change_notification:
+                    wait_time = self.poll_interval if wait_time is None else min(wait_time, self.poll_interval)
+                self._changed.wait(wait_time)
+
+    def interrupt(self):
+        """唤醒正在 wait_for_change 的线程 (用于停止监听)"""
+        with self._changed:
+            self._interrupted = True
+            self._changed.notify_all()
+
+    def _notify_change(self):
+        with self._changed:
+            self._changed.notify_all()
+
+
+class SimulatedClipboardBackend(ClipboardBackend):
+    """内存模拟剪贴板, 用于测试和基准测试
+
+    set_text() / set_image() / copy_contents() 模拟用户复制; 同步程序通过 set_contents() 写入,
+    写入的各种格式保存在 contents 中, 图片从位图或 PNG 解码后供读取。
+    """
+
+    has_change_notification = True
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._image = None
+        self._text = None
+        self.contents = {}
+        # 统计实际读取和写入次数, 便于验证"只有变化才读取"
+        self.read_count = 0
+        self.write_count = 0
+
+    def sequence_number(self):
+        return self._sequence
+
+    def get_image(self):
+        with self._lock:
+            self.read_count += 1
+            return self._image
+
+    def get_text(self):
+        with self._lock:
+            self.read_count += 1
+            return self._text
+
+    def get_formats(self):
+        with self._lock:
+            self.read_count += 1
+            return {name: value for name, value in self.contents.items() if name in EXTRA_FORMATS}
+
+    def set_text(self, text):
+        """模拟用户复制了一段文本"""
+        self._replace(text=text, contents={TEXT: text})
+        return True
+
+    def set_image(self, image):
+        """模拟用户复制了一张图片"""
+        self._replace(image=image)
+        return True
+
+    def copy_contents(self, contents, image=None):
+        """模拟用户复制了多种格式 (如网页中的一段文字: 纯文本 + HTML)"""
+        self._replace(text=contents.get(TEXT), image=image, contents=contents)
+        return True
+
+    def _write_contents(self, contents):
+        image = None
+        for content_type in (PNG, BMP):
+            if content_type in contents:
+                image = decode_image(contents[content_type])
+                break
+        self._replace(text=contents.get(TEXT), image=image, contents=contents)
+        self.write_count += 1
+        return True
+
+    def _replace(self, text=None, image=None, contents=None):
+        with self._lock:
+            self._text = text
+            self._image = image
+            self.contents = dict(contents or {})
+            self._sequence += 1
+        self._notify_change()
+
+
+if sys.platform == "win32":
+    # 使用 ctypes 访问 Windows 剪贴板 API (更好的 PyInstaller 兼容性)
+    import ctypes
+    from ctypes import wintypes
+
+    # Windows 剪贴板常量
+    CF_TEXT = 1
+    CF_DIB = 8
+    CF_UNICODETEXT = 13
+    CF_HDROP = 15
+    BMP_FILE_HEADER_SIZE = 14
+    GMEM_MOVEABLE = 0x0002
+    WM_CLOSE = 0x0010
+    WM_CLIPBOARDUPDATE = 0x031D
+    HWND_MESSAGE = -3
+
+    # Windows API 函数
+    user32 = ctypes.windll.user32
+    kernel32 = ctypes.windll.kernel32
+
+    OpenClipboard = user32.OpenClipboard
+    OpenClipboard.argtypes = [wintypes.HWND]
+    OpenClipboard.restype = wintypes.BOOL
+
+    CloseClipboard = user32.CloseClipboard
+    CloseClipboard.argtypes = []
+    CloseClipboard.restype = wintypes.BOOL
+
+    GetClipboardData = user32.GetClipboardData
+    GetClipboardData.argtypes = [wintypes.UINT]
+    GetClipboardData.restype = wintypes.HANDLE
+
+    SetClipboardData = user32.SetClipboardData
+    SetClipboardData.argtypes = [wintypes.UINT, wintypes.HANDLE]
+    SetClipboardData.restype = wintypes.HANDLE
+
+    EmptyClipboard = user32.EmptyClipboard
+    EmptyClipboard.argtypes = []
+    EmptyClipboard.restype = wintypes.BOOL
+
+    RegisterClipboardFormatW = user32.RegisterClipboardFormatW
+    RegisterClipboardFormatW.argtypes = [wintypes.LPCWSTR]
+    RegisterClipboardFormatW.restype = wintypes.UINT
+
+    GetClipboardSequenceNumber = user32.GetClipboardSequenceNumber
+    GetClipboardSequenceNumber.argtypes = []
+    GetClipboardSequenceNumber.restype = wintypes.DWORD
+
+    AddClipboardFormatListener = user32.AddClipboardFormatListener
+    AddClipboardFormatListener.argtypes = [wintypes.HWND]
+    AddClipboardFormatListener.restype = wintypes.BOOL
+
+    RemoveClipboardFormatListener = user32.RemoveClipboardFormatListener
+    RemoveClipboardFormatListener.argtypes = [wintypes.HWND]
+    RemoveClipboardFormatListener.restype = wintypes.BOOL
+
+    WNDPROC = ctypes.WINFUNCTYPE(wintypes.LPARAM, wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM)
+
+    class WNDCLASSW(ctypes.Structure):
+        _fields_ = [
+            ("style", wintypes.UINT),
+            ("lpfnWndProc", WNDPROC),
+            ("cbClsExtra", ctypes.c_int),
+            ("cbWndExtra", ctypes.c_int),
+            ("hInstance", wintypes.HINSTANCE),
+            ("hIcon", wintypes.HICON),
+            ("hCursor", wintypes.HANDLE),
+            ("hbrBackground", wintypes.HBRUSH),
+            ("lpszMenuName", wintypes.LPCWSTR),
+            ("lpszClassName", wintypes.LPCWSTR),
+        ]
+
+    RegisterClassW = user32.RegisterClassW
+    RegisterClassW.argtypes = [ctypes.POINTER(WNDCLASSW)]
+    RegisterClassW.restype = wintypes.ATOM
+
+    UnregisterClassW = user32.UnregisterClassW
+    UnregisterClassW.argtypes = [wintypes.LPCWSTR, wintypes.HINSTANCE]
+    UnregisterClassW.restype = wintypes.BOOL
+
+    CreateWindowExW = user32.CreateWindowExW
+    CreateWindowExW.argtypes = [
+        wintypes.DWORD, wintypes.LPCWSTR, wintypes.LPCWSTR, wintypes.DWORD,
+        ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+        wintypes.HWND, wintypes.HMENU, wintypes.HINSTANCE, wintypes.LPVOID,
+    ]
+    CreateWindowExW.restype = wintypes.HWND
+
+    DestroyWindow = user32.DestroyWindow
+    DestroyWindow.argtypes = [wintypes.HWND]
+    DestroyWindow.restype = wintypes.BOOL
+
+    DefWindowProcW = user32.DefWindowProcW
+    DefWindowProcW.argtypes = [wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM]
+    DefWindowProcW.restype = wintypes.LPARAM
+
+    GetMessageW = user32.GetMessageW
+    GetMessageW.argtypes = [ctypes.POINTER(wintypes.MSG), wintypes.HWND, wintypes.UINT, wintypes.UINT]
+    GetMessageW.restype = wintypes.BOOL
+
+    TranslateMessage = user32.TranslateMessage
+    TranslateMessage.argtypes = [ctypes.POINTER(wintypes.MSG)]
+    TranslateMessage.restype = wintypes.BOOL
+
+    DispatchMessageW = user32.DispatchMessageW
+    DispatchMessageW.argtypes = [ctypes.POINTER(wintypes.MSG)]
+    DispatchMessageW.restype = wintypes.LPARAM
+
+    PostMessageW = user32.PostMessageW
+    PostMessageW.argtypes = [wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM]
+    PostMessageW.restype = wintypes.BOOL
+
+    PostQuitMessage = user32.PostQuitMessage
+    PostQuitMessage.argtypes = [ctypes.c_int]
+    PostQuitMessage.restype = None
+
+    GetModuleHandleW = kernel32.GetModuleHandleW
+    GetModuleHandleW.argtypes = [wintypes.LPCWSTR]
+    GetModuleHandleW.restype = wintypes.HMODULE
+
+    GlobalLock = kernel32.GlobalLock
+    GlobalLock.argtypes = [wintypes.HGLOBAL]
+    GlobalLock.restype = wintypes.LPVOID
+
+    GlobalUnlock = kernel32.GlobalUnlock
+    GlobalUnlock.argtypes = [wintypes.HGLOBAL]
+    GlobalUnlock.restype = wintypes.BOOL
+
+    GlobalAlloc = kernel32.GlobalAlloc
+    GlobalAlloc.argtypes = [wintypes.UINT, ctypes.c_size_t]
+    GlobalAlloc.restype = wintypes.HGLOBAL
+
+    GlobalSize = kernel32.GlobalSize
+    GlobalSize.argtypes = [wintypes.HGLOBAL]
+    GlobalSize.restype = ctypes.c_size_t
+
+    GlobalFree = kernel32.GlobalFree
+    GlobalFree.argtypes = [wintypes.HGLOBAL]
+    GlobalFree.restype = wintypes.HGLOBAL
+
+    shell32 = ctypes.windll.shell32
+
+    DragQueryFileW = shell32.DragQueryFileW
+    DragQueryFileW.argtypes = [wintypes.HANDLE, wintypes.UINT, wintypes.LPWSTR, wintypes.UINT]
+    DragQueryFileW.restype = wintypes.UINT
+
+    # 浏览器、Office 等程序识别的 PNG 剪贴板格式 (保留透明度)
+    CF_PNG = RegisterClipboardFormatW("PNG")
+    CF_HTML = RegisterClipboardFormatW("HTML Format")
+    CF_RTF = RegisterClipboardFormatW("Rich Text Format")
+
+    def get_clipboard_text():
+        """从剪贴板获取文本"""
+        try:
+            if not OpenClipboard(None):
+                return None
+
+            h_data = GetClipboardData(CF_UNICODETEXT)
+            if not h_data:
+                CloseClipboard()
+                return None
+
+            p_data = GlobalLock(h_data)
+            if not p_data:
+                CloseClipboard()
+                return None
+
+            try:
+                text = ctypes.wstring_at(p_data)
+                return text
+            finally:
+                GlobalUnlock(h_data)
+                CloseClipboard()
+        except:
+            try:
+                CloseClipboard()
+            except:
+                pass
+            return None
+
+    def read_global_bytes(h_data):
+        """读取剪贴板数据句柄中的全部字节"""
+        if not h_data:
+            return None
+        p_data = GlobalLock(h_data)
+        if not p_data:
+            return None
+        try:
+            return ctypes.string_at(p_data, GlobalSize(h_data))
+        finally:
+            GlobalUnlock(h_data)
+
+    def query_drop_files(h_drop):
+        """CF_HDROP 中的文件路径列表"""
+        paths = []
+        for index in range(DragQueryFileW(h_drop, 0xFFFFFFFF, None, 0)):
+            length = DragQueryFileW(h_drop, index, None, 0)
+            buffer = ctypes.create_unicode_buffer(length + 1)
+            DragQueryFileW(h_drop, index, buffer, length + 1)
+            paths.append(buffer.value)
+        return paths
+
+    def get_clipboard_formats():
+        """读取 HTML 片段、RTF 和复制的文件列表"""
+        formats = {}
+        try:
+            if not OpenClipboard(None):
+                return formats
+            try:
+                data = read_global_bytes(GetClipboardData(CF_HTML)) if CF_HTML else None
+                fragment = parse_cf_html(data) if data else None
+                if fragment:
+                    formats[HTML] = fragment
+                data = read_global_bytes(GetClipboardData(CF_RTF)) if CF_RTF else None
+                if data:
+                    # RTF 是 7 位文本, 个别程序会写入 ANSI 字节, latin-1 可以原样往返
+                    formats[RTF] = data.rstrip(b"\0").decode('latin-1')
+                h_drop = GetClipboardData(CF_HDROP)
+                if h_drop:
+                    paths = query_drop_files(h_drop)
+                    if paths:
+                        formats[URI_LIST] = "\r\n".join(Path(path).as_uri() for path in paths)
+            finally:
+                CloseClipboard()
+        except:
+            pass
+        return formats
+
+    def clipboard_format_data(content_type, data):
+        """把内容类型映射为 Windows 剪贴板格式和要写入的字节, 不支持的类型返回 (None, None)
+
+        文件列表只在本机有意义, 不写入剪贴板。
+        """
+        if content_type == TEXT:
+            return CF_UNICODETEXT, (data + '\0').encode('utf-16le')
+        if content_type == HTML and CF_HTML:
+            return CF_HTML, build_cf_html(data) + b"\0"
+        if content_type == RTF and CF_RTF:
+            return CF_RTF, data.encode('latin-1', errors='replace') + b"\0"
+        if content_type == BMP:
+            # CF_DIB 是去掉文件头的 BMP
+            return CF_DIB, data[BMP_FILE_HEADER_SIZE:]
+        if content_type == PNG and CF_PNG:
+            return CF_PNG, data
+        return None, None
+
+    def global_alloc_copy(data):
+        """分配可移动全局内存并复制数据, 失败返回 None"""
+        h_data = GlobalAlloc(GMEM_MOVEABLE, len(data))
+        if not h_data:
+            return None
+        p_data = GlobalLock(h_data)
+        if not p_data:
+            GlobalFree(h_data)
+            return None
+        ctypes.memmove(p_data, data, len(data))
+        GlobalUnlock(h_data)
+        return h_data
+
+    def set_clipboard_contents(contents):
+        """清空剪贴板并写入多种格式, 至少写入一种时返回 True"""
+        try:
+            if not OpenClipboard(None):
+                return False
+
+            try:
+                EmptyClipboard()
+                written = 0
+                for content_type, data in contents.items():
+                    format_id, format_data = clipboard_format_data(content_type, data)
+                    if format_id is None:
+                        continue
+                    h_data = global_alloc_copy(format_data)
+                    if not h_data:
+                        continue
+                    # 成功后内存归系统所有, 失败时需要自己释放
+                    if SetClipboardData(format_id, h_data):
+                        written += 1
+                    else:
+                        GlobalFree(h_data)
+                return written > 0
+            finally:
+                CloseClipboard()
+        except:
+            return False
+
+    def set_clipboard_text(text):
+        """设置剪贴板文本"""
+        return set_clipboard_contents({TEXT: text})
+
+    class WindowsClipboardBackend(ClipboardBackend):
+        """Windows 剪贴板后端
+
+        在后台线程中创建一个仅消息窗口并注册剪贴板格式监听,
+        收到 WM_CLIPBOARDUPDATE 时唤醒等待者; 注册失败时按序列号轮询。
+        """
+
+        LISTENER_CLASS_NAME = "ClipboardSyncListener"
+
+        def __init__(self):
+            super().__init__()
+            self._hwnd = None
+            # 每个实例注册自己的窗口类, 窗口类绑定的是本实例的 _window_proc
+            self._class_name = f"{self.LISTENER_CLASS_NAME}-{id(self):x}"
+            self._wndproc = WNDPROC(self._window_proc)
+            self._listener_ready = threading.Event()
+            self._listener_thread = threading.Thread(target=self._listener_loop, daemon=True)
+            self._listener_thread.start()
+            self._listener_ready.wait(2.0)
+
+        def sequence_number(self):
+            return GetClipboardSequenceNumber()
+
+        def get_image(self):
+            # Pillow 在第一次读取图片时才导入, 缩短启动时间
+            from PIL import Image, ImageGrab
+            image = ImageGrab.grabclipboard()
+            # 复制文件时 grabclipboard 返回文件名列表, 这里只关心图片
+            if isinstance(image, Image.Image):
+                return image
+            return None
+
+        def get_text(self):
+            return get_clipboard_text()
+
+        def get_formats(self):
+            return get_clipboard_formats()
+
+        def _write_contents(self, contents):
+            return set_clipboard_contents(contents)
+
+        def close(self):
+            if self._hwnd:
+                PostMessageW(self._hwnd, WM_CLOSE, 0, 0)
+            super().close()
+
+        def _window_proc(self, hwnd, msg, wparam, lparam):
+            if msg == WM_CLIPBOARDUPDATE:
+                self._notify_change()
+                return 0
+            if msg == WM_CLOSE:
+                PostQuitMessage(0)
+                return 0
+            return DefWindowProcW(hwnd, msg, wparam, lparam)
+
+        def _listener_loop(self):
+            """创建监听窗口并运行消息循环"""
+            hwnd = None
+            registered = False
+            h_instance = None
+            try:
+                h_instance = GetModuleHandleW(None)
+                window_class = WNDCLASSW()
+                window_class.lpfnWndProc = self._wndproc
+                window_class.hInstance = h_instance
+                window_class.lpszClassName = self._class_name
+                registered = bool(RegisterClassW(ctypes.byref(window_class)))
+                if not registered:
+                    return
+
+                hwnd = CreateWindowExW(
+                    0, self._class_name, self.LISTENER_CLASS_NAME, 0,
+                    0, 0, 0, 0, HWND_MESSAGE, None, h_instance, None
+                )
+                if not hwnd or not AddClipboardFormatListener(hwnd):
+                    return
+
+                self._hwnd = hwnd
+                self.has_change_notification = True
+                self._listener_ready.set()
+
+                msg = wintypes.MSG()
+                while GetMessageW(ctypes.byref(msg), None, 0, 0) > 0:
+                    TranslateMessage(ctypes.byref(msg))
+                    DispatchMessageW(ctypes.byref(msg))
+            except Exception as e:
+                print(f"剪贴板监听窗口创建失败, 改用序列号轮询: {e}")
+            finally:
+                self.has_change_notification = False
+                self._listener_ready.set()
+                if hwnd:
+                    RemoveClipboardFormatListener(hwnd)
+                    DestroyWindow(hwnd)
+                if registered:
+                    UnregisterClassW(self._class_name, h_instance)
+                self._hwnd = None
+
+
+def create_clipboard_backend():
+    """创建当前平台的剪贴板后端"""
+    if sys.platform == "win32":
+        return WindowsClipboardBackend()
+    return SimulatedClipboardBackend()
+
+
+class ClipboardMonitor:
+    """剪贴板监听器
+
+    阻塞在后端的 wait_for_change 上, 只有序列号变化时才读取剪贴板。
+    指定 on_change 时每次变化回调 on_change(ClipboardChange), 包含文本、图片以及 HTML / RTF / 文件列表;
+    否则检测到新图片或新文本时分别回调 on_image(ClipboardImage) / on_text(text)。
+    图片在这里不编码, 由发送路径按各客户端需要的格式编码。
+
+    连续的变化 (快速复制多次、程序反复改写剪贴板、一次复制分几步写入各格式) 会被合并:
+    等剪贴板安静 quiet_window 秒后才读取, 只发送最终状态, 中间状态既不读取也不发送。
+    quiet_window 为 0 时每次变化都立即读取。
+    """
+
+    def __init__(self, backend, on_image=None, on_text=None, log=print, idle_timeout=1.0, metrics=None,
+                 on_change=None, quiet_window=QUIET_WINDOW, max_delay=MAX_COALESCE_DELAY):
+        self.backend = backend
+        self.on_image = on_image
+        self.on_text = on_text
+        self.on_change = on_change
+        self.log = log
+        self.idle_timeout = idle_timeout
+        self.quiet_window = quiet_window
+        self.max_delay = max_delay
+        # 可选的 Metrics, 记录读取剪贴板的耗时 (detect 阶段)
+        self.metrics = metrics
+
+        self.is_running = False
+        self.last_clipboard_image = None
+        self.last_clipboard_text = None
+        self.last_formats = None
+        self._thread = None
+
+    def start(self):
+        """在后台线程中启动监听; 上一个监听线程还没有退出时不再启动, 返回 False"""
+        if self._thread is not None and self._thread.is_alive():
+            if self.is_running:
+                return True
+            self._thread.join(STOP_TIMEOUT)
+            if self._thread.is_alive():
+                self.log("上一个剪贴板监听线程尚未退出, 无法重新启动")
+                return False
+        self.is_running = True
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """停止监听, 唤醒阻塞中的线程并等待它退出 (最多 STOP_TIMEOUT 秒)"""
+        self.is_running = False
+        self.backend.interrupt()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(STOP_TIMEOUT)
+
+    def run(self):
+        """监听剪贴板变化"""
+        self.log("剪贴板监听已启动")
+
+        # 初始为 None, 启动后先读取一次当前剪贴板
+        sequence = None
+        while self.is_running:
+            new_sequence = self.backend.wait_for_change(sequence, self.idle_timeout)
+            if not self.is_running:
+                break
+            if new_sequence == sequence:
+                continue
+            new_sequence = self.wait_quiet(new_sequence)
+            if not self.is_running:
+                break
+
+            # 先记录序列号再读取, 读取期间发生的变化会在下一轮被发现
+            sequence = new_sequence
+            try:
+                # 本程序写入的内容 (收到的文本 / 图片) 只更新记录, 不再发回
+                self.check_clipboard(dispatch=not self.backend.is_own_write())
+            except Exception as e:
+                pass
+
+    def wait_quiet(self, sequence):
+        """等剪贴板安静 quiet_window 秒 (从第一次变化起最多 max_delay 秒), 返回最新的序列号"""
+        if self.quiet_window <= 0:
+            return sequence
+        deadline = time.monotonic() + self.max_delay
+        while self.is_running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            latest = self.backend.wait_for_change(sequence, min(self.quiet_window, remaining))
+            if latest == sequence:
+                break
+            sequence = latest
+            if self.metrics:
+                self.metrics.increment("changesCoalesced")
+        return sequence
+
+    def check_clipboard(self, dispatch=True):
+        """读取剪贴板并分发新内容 (dispatch 为 False 时只更新记录)"""
+        started = time.perf_counter()
+        # 尝试获取剪贴板中的图片
+        image = self.backend.get_image()
+        text = None if image is not None else self.backend.get_text()
+        # HTML / RTF / 文件列表只在需要整次变化时读取
+        formats = self.backend.get_formats() if self.on_change else {}
+        if self.metrics:
+            self.metrics.observe_since("detect", started)
+
+        formats_key = tuple(sorted((name, hash(value)) for name, value in formats.items()))
+        new_formats = bool(formats) and formats_key != self.last_formats
+        self.last_formats = formats_key
+
+        if image is not None:
+            # 检查是否是新图片 (只比较像素指纹, 不重复编码)
+            fingerprint = image_fingerprint(image)
+            if fingerprint == self.last_clipboard_image and not new_formats:
+                return
+            self.last_clipboard_image = fingerprint
+            self.last_clipboard_text = None  # 清空文本记录
+            if not dispatch:
+                return
+            self.log(f"检测到新图片 ({image.size[0]}x{image.size[1]})")
+
+            # 发送到所有连接的设备
+            self._dispatch(None, ClipboardImage(image, fingerprint), formats)
+        else:
+            # 检查是否是新文本
+            has_text = bool(text and len(text.strip()) > 0)
+            new_text = has_text and text != self.last_clipboard_text
+            if not new_text and not new_formats:
+                return
+            if new_text:
+                self.last_clipboard_text = text
+                self.last_clipboard_image = None  # 清空图片记录
+            if not dispatch:
+                return
+            if new_text:
+                self.log(f"检测到新文本 ({len(text)} 字符)")
+            else:
+                self.log(f"检测到新内容 ({', '.join(formats)})")
+
+            # 发送到所有连接的设备
+            self._dispatch(text if has_text else None, None, formats)
+
+    def _dispatch(self, text, image, formats):
+        if self.on_change:
+            self.on_change(ClipboardChange(text, image, formats, int(time.time() * 1000)))
+        elif image is not None:
+            self.on_image(image)
+        elif text is not None:
+            self.on_text(text)
@@ -1,69 +1,24 @@
 """
 剪贴板同步工具 - Windows 端
 使用 Python 实现,监听剪贴板并同步图片到 Android 设备
+
+同步逻辑在 sync_engine.py 中; 不需要窗口时可运行 sync_daemon.py 或加 --headless 参数。
+Pillow、pystray 和 tkinter 都在用到时才导入, 缩短启动时间; 无界面模式不需要 Tk。
 """
 
-import tkinter as tk
-from tkinter import ttk, scrolledtext
+import sys
 import threading
-import socket
-import json
-import base64
-import time
-from datetime import datetime
-from io import BytesIO
-from PIL import ImageGrab, Image, ImageTk, ImageDraw
-import pystray
-from pystray import MenuItem as item
-
-# 使用 ctypes 访问 Windows 剪贴板 API (更好的 PyInstaller 兼容性)
-import ctypes
-from ctypes import wintypes
-
-# Windows 剪贴板常量
-CF_TEXT = 1
-CF_UNICODETEXT = 13
-GMEM_MOVEABLE = 0x0002
-
-# Windows API 函数
-user32 = ctypes.windll.user32
-kernel32 = ctypes.windll.kernel32
-
-OpenClipboard = user32.OpenClipboard
-OpenClipboard.argtypes = [wintypes.HWND]
-OpenClipboard.restype = wintypes.BOOL
-
-CloseClipboard = user32.CloseClipboard
-CloseClipboard.argtypes = []
-CloseClipboard.restype = wintypes.BOOL
 
-GetClipboardData = user32.GetClipboardData
-GetClipboardData.argtypes = [wintypes.UINT]
-GetClipboardData.restype = wintypes.HANDLE
+from log_sink import LogSink, format_record
+from metrics import format_stats
+from sync_engine import SyncEngine, open_default_history, open_default_pairings
+from sync_server import OVERFLOW_DROP_OLDEST, get_local_ip
 
-SetClipboardData = user32.SetClipboardData
-SetClipboardData.argtypes = [wintypes.UINT, wintypes.HANDLE]
-SetClipboardData.restype = wintypes.HANDLE
-
-EmptyClipboard = user32.EmptyClipboard
-EmptyClipboard.argtypes = []
-EmptyClipboard.restype = wintypes.BOOL
-
-GlobalLock = kernel32.GlobalLock
-GlobalLock.argtypes = [wintypes.HGLOBAL]
-GlobalLock.restype = wintypes.LPVOID
-
-GlobalUnlock = kernel32.GlobalUnlock
-GlobalUnlock.argtypes = [wintypes.HGLOBAL]
-GlobalUnlock.restype = wintypes.BOOL
-
-GlobalAlloc = kernel32.GlobalAlloc
-GlobalAlloc.argtypes = [wintypes.UINT, ctypes.c_size_t]
-GlobalAlloc.restype = wintypes.HGLOBAL
-
-GlobalSize = kernel32.GlobalSize
-GlobalSize.argtypes = [wintypes.HGLOBAL]
-GlobalSize.restype = ctypes.c_size_t
+# 日志区每隔 LOG_FLUSH_INTERVAL_MS 毫秒批量刷新一次, 最多保留 LOG_MAX_LINES 行
+LOG_FLUSH_INTERVAL_MS = 200
+LOG_MAX_LINES = 500
+# 统计窗口的刷新间隔
+STATS_REFRESH_MS = 1000
 
 
 class ModernUI:
@@ -83,93 +38,8 @@ class ModernUI:
     MONO_FONT = ("Consolas", 9)
 
 
-def get_clipboard_text():
-    """从剪贴板获取文本"""
-    try:
-        if not OpenClipboard(None):
-            return None
-        
-        h_data = GetClipboardData(CF_UNICODETEXT)
-        if not h_data:
-            CloseClipboard()
-            return None
-        
-        p_data = GlobalLock(h_data)
-        if not p_data:
-            CloseClipboard()
-            return None
-        
-        try:
-            text = ctypes.wstring_at(p_data)
-            return text
-        finally:
-            GlobalUnlock(h_data)
-            CloseClipboard()
-    except:
-        try:
-            CloseClipboard()
-        except:
-            pass
-        return None
-
-
-def set_clipboard_text(text):
-    """设置剪贴板文本"""
-    try:
-        if not OpenClipboard(None):
-            return False
-        
-        EmptyClipboard()
-        
-        # 分配全局内存
-        text_bytes = (text + '\0').encode('utf-16le')
-        h_data = GlobalAlloc(GMEM_MOVEABLE, len(text_bytes))
-        if not h_data:
-            CloseClipboard()
-            return False
-        
-        # 锁定内存并复制数据
-        p_data = GlobalLock(h_data)
-        if not p_data:
-            CloseClipboard()
-            return False
-        
-        ctypes.memmove(p_data, text_bytes, len(text_bytes))
-        GlobalUnlock(h_data)
-        
-        # 设置剪贴板数据
-        if not SetClipboardData(CF_UNICODETEXT, h_data):
-            CloseClipboard()
-            return False
-        
-        CloseClipboard()
-        return True
-    except:
-        try:
-            CloseClipboard()
-        except:
-            pass
-        return False
-
-
-def is_clipboard_text_available():
-    """检查剪贴板是否有文本"""
-    try:
-        if not OpenClipboard(None):
-            return False
-        h_data = GetClipboardData(CF_UNICODETEXT)
-        CloseClipboard()
-        return h_data is not None and h_data != 0
-    except:
-        try:
-            CloseClipboard()
-        except:
-            pass
-        return False
-
-
 class ClipboardSyncApp:
-    def __init__(self, root):
+    def __init__(self, root, clipboard=None, history=None):
         self.root = root
         self.root.title("剪贴板同步工具")
         self.root.geometry("700x600")
@@ -177,13 +47,26 @@ class ClipboardSyncApp:
         self.root.resizable(False, False)
         
         self.is_running = False
-        self.server_socket = None
-        self.clients = []
-        self.port = 5150
-        self.clipboard_monitor_thread = None
-        self.last_clipboard_image = None
-        self.last_clipboard_text = None
+        self.client_count = 0
+        self.shown_client_count = 0
+
+        # 日志先写入有界缓冲, 由 Tk 线程定时批量显示; 任意线程都可以调用 add_log
+        self.log_sink = LogSink(capacity=LOG_MAX_LINES)
+
+        # 同步引擎: 剪贴板监听、网络层 (asyncio, 独立于 tkinter) 和剪贴板历史
+        self.engine = SyncEngine(
+            clipboard=clipboard,
+            history=history or open_default_history(),
+            pairings=open_default_pairings(),
+            log=self.log_sink,
+            on_clients_changed=self.update_client_count,
+            send_queue_size=8,
+            overflow_policy=OVERFLOW_DROP_OLDEST
+        )
         
+        # 统计窗口 (打开时才刷新)
+        self.stats_window = None
+
         # 系统托盘
         self.tray_icon = None
         self.is_minimized_to_tray = False
@@ -192,6 +75,7 @@ class ClipboardSyncApp:
         self.create_app_icon()
         
         self.setup_ui()
+        self.root.after(LOG_FLUSH_INTERVAL_MS, self.flush_ui_updates)
         
         # 绑定窗口事件
         self.root.protocol('WM_DELETE_WINDOW', self.on_closing)
@@ -199,6 +83,8 @@ class ClipboardSyncApp:
     def create_app_icon(self):
         """创建应用图标"""
         try:
+            from PIL import Image, ImageTk, ImageDraw
+
             # 创建 64x64 的图标
             icon_size = 64
             icon = Image.new('RGBA', (icon_size, icon_size), (0, 0, 0, 0))
@@ -229,6 +115,7 @@ class ClipboardSyncApp:
         
     def setup_ui(self):
         """设置用户界面"""
+        import tkinter as tk
         # 主容器
         main_container = tk.Frame(self.root, bg=ModernUI.BG_COLOR)
         main_container.pack(fill="both", expand=True, padx=20, pady=20)
@@ -254,6 +141,20 @@ class ClipboardSyncApp:
             fg=ModernUI.SECONDARY_TEXT
         )
         version_label.pack(side="left", padx=10)
+
+        stats_button = tk.Button(
+            title_frame,
+            text="📊 统计",
+            command=self.show_stats_window,
+            font=ModernUI.BODY_FONT,
+            bg=ModernUI.BG_COLOR,
+            fg=ModernUI.PRIMARY_COLOR,
+            activebackground=ModernUI.BORDER_COLOR,
+            relief="flat",
+            cursor="hand2",
+            borderwidth=0
+        )
+        stats_button.pack(side="right")
         
         # 状态卡片
         self.create_status_card(main_container)
@@ -266,6 +167,7 @@ class ClipboardSyncApp:
         
     def create_status_card(self, parent):
         """创建状态信息卡片"""
+        import tkinter as tk
         card_frame = tk.Frame(
             parent,
             bg=ModernUI.CARD_BG,
@@ -331,6 +233,7 @@ class ClipboardSyncApp:
         
     def create_control_buttons(self, parent):
         """创建控制按钮"""
+        import tkinter as tk
         button_frame = tk.Frame(parent, bg=ModernUI.BG_COLOR)
         button_frame.pack(fill="x", pady=(0, 15))
         
@@ -373,6 +276,8 @@ class ClipboardSyncApp:
         
     def create_log_area(self, parent):
         """创建日志显示区域"""
+        import tkinter as tk
+        from tkinter import scrolledtext
         log_frame = tk.Frame(
             parent,
             bg=ModernUI.CARD_BG,
@@ -406,38 +311,80 @@ class ClipboardSyncApp:
         )
         self.log_text.pack(fill="both", expand=True, padx=15, pady=(0, 15))
         
+    def show_stats_window(self):
+        """打开统计窗口: 各阶段耗时分布、计数器和各设备的队列与流量"""
+        import tkinter as tk
+        from tkinter import scrolledtext
+
+        if self.stats_window is not None:
+            self.stats_window.lift()
+            return
+
+        self.stats_window = tk.Toplevel(self.root)
+        self.stats_window.title("运行统计")
+        self.stats_window.geometry("760x420")
+        self.stats_window.configure(bg=ModernUI.BG_COLOR)
+        self.stats_window.protocol('WM_DELETE_WINDOW', self.close_stats_window)
+
+        self.stats_text = scrolledtext.ScrolledText(
+            self.stats_window,
+            font=ModernUI.MONO_FONT,
+            bg="#FAFAFA",
+            fg=ModernUI.TEXT_COLOR,
+            relief="flat",
+            borderwidth=0,
+            wrap="none"
+        )
+        self.stats_text.pack(fill="both", expand=True, padx=15, pady=15)
+        self.refresh_stats()
+
+    def refresh_stats(self):
+        if self.stats_window is None:
+            return
+        self.stats_text.delete("1.0", "end")
+        self.stats_text.insert("1.0", format_stats(self.engine.get_stats()))
+        self.stats_window.after(STATS_REFRESH_MS, self.refresh_stats)
+
+    def close_stats_window(self):
+        self.stats_window.destroy()
+        self.stats_window = None
+
     def add_log(self, message):
-        """添加日志"""
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        log_message = f"[{timestamp}] {message}\n"
-        self.log_text.insert("1.0", log_message)
-        print(log_message.strip())
-        
-    def get_local_ip(self):
-        """获取本机IP地址"""
+        """添加日志 (可从任意线程调用, 不直接操作控件)"""
+        self.log_sink(message)
+
+    def flush_ui_updates(self):
+        """在 Tk 线程中批量显示新日志和连接数, 日志区超出 LOG_MAX_LINES 行的部分被裁掉"""
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            ip = s.getsockname()[0]
-            s.close()
-            return ip
-        except:
-            return "127.0.0.1"
-            
+            # 最小化到托盘时不刷新, 新日志留在有界缓冲中
+            if not self.is_minimized_to_tray:
+                records = self.log_sink.drain()
+                if records:
+                    lines = "".join(format_record(record) + "\n" for record in reversed(records))
+                    self.log_text.insert("1.0", lines)
+                    self.log_text.delete(f"{LOG_MAX_LINES + 1}.0", "end")
+                if self.client_count != self.shown_client_count:
+                    self.shown_client_count = self.client_count
+                    self.client_label.config(text=f"📱 已连接设备: {self.client_count}")
+        finally:
+            self.root.after(LOG_FLUSH_INTERVAL_MS, self.flush_ui_updates)
+        
     def start_service(self):
         """启动服务"""
         self.is_running = True
         self.start_button.config(state="disabled", bg=ModernUI.SECONDARY_TEXT)
         self.stop_button.config(state="normal", bg=ModernUI.ERROR_COLOR)
         
-        # 启动 Socket 服务器
-        threading.Thread(target=self.start_socket_server, daemon=True).start()
-        
-        # 启动剪贴板监听
-        threading.Thread(target=self.monitor_clipboard, daemon=True).start()
-        
-        # 启动设备发现广播
-        threading.Thread(target=self.start_discovery_broadcast, daemon=True).start()
+        # 启动 Socket 服务器、设备发现广播和剪贴板监听
+        try:
+            port = self.engine.start()
+            self.ip_label.config(text=f"🌐 IP地址: {get_local_ip()}:{port}")
+        except OSError as e:
+            self.add_log(f"服务器启动失败: {e}")
+            self.is_running = False
+            self.start_button.config(state="normal", bg=ModernUI.SUCCESS_COLOR)
+            self.stop_button.config(state="disabled", bg=ModernUI.SECONDARY_TEXT)
+            return
         
         self.status_label.config(text="状态: 运行中", fg=ModernUI.SUCCESS_COLOR)
         self.status_indicator.config(fg=ModernUI.SUCCESS_COLOR)
@@ -449,289 +396,23 @@ class ClipboardSyncApp:
         self.start_button.config(state="normal", bg=ModernUI.SUCCESS_COLOR)
         self.stop_button.config(state="disabled", bg=ModernUI.SECONDARY_TEXT)
         
-        # 关闭所有客户端连接
-        for client in self.clients[:]:
-            try:
-                client.close()
-            except:
-                pass
-        self.clients.clear()
-        
-        # 关闭服务器
-        if self.server_socket:
-            try:
-                self.server_socket.close()
-            except:
-                pass
-            self.server_socket = None
+        # 停止剪贴板监听, 关闭服务器和所有客户端连接
+        self.engine.stop()
             
         self.status_label.config(text="状态: 已停止", fg=ModernUI.SECONDARY_TEXT)
         self.status_indicator.config(fg=ModernUI.SECONDARY_TEXT)
+        self.client_count = self.shown_client_count = 0
         self.client_label.config(text="📱 已连接设备: 0")
         self.add_log("⛔ 服务已停止")
         
-    def start_socket_server(self):
-        """启动 TCP Socket 服务器"""
-        try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            
-            # 尝试绑定端口
-            for port in range(5150, 5170):
-                try:
-                    self.server_socket.bind(("0.0.0.0", port))
-                    self.port = port
-                    break
-                except:
-                    continue
-                    
-            self.server_socket.listen(5)
-            
-            local_ip = self.get_local_ip()
-            self.ip_label.config(text=f"🌐 IP地址: {local_ip}:{self.port}")
-            self.add_log(f"🚀 Socket 服务器已启动，端口: {self.port}")
-            
-            # 接受客户端连接
-            while self.is_running:
-                try:
-                    self.server_socket.settimeout(1.0)
-                    client_socket, address = self.server_socket.accept()
-                    self.clients.append(client_socket)
-                    self.client_label.config(text=f"📱 已连接设备: {len(self.clients)}")
-                    self.add_log(f"✅ 设备已连接: {address[0]}:{address[1]}")
-                    
-                    # 为每个客户端启动处理线程
-                    threading.Thread(
-                        target=self.handle_client, 
-                        args=(client_socket, address),
-                        daemon=True
-                    ).start()
-                except socket.timeout:
-                    continue
-                except:
-                    break
-                    
-        except Exception as e:
-            self.add_log(f"服务器启动失败: {e}")
-            
-    def handle_client(self, client_socket, address):
-        """处理客户端连接"""
-        buffer = ""
-        try:
-            while self.is_running and client_socket in self.clients:
-                # 接收客户端消息
-                try:
-                    client_socket.settimeout(1.0)
-                    data = client_socket.recv(4096)
-                    if not data:
-                        break
-                    
-                    # 解析接收到的数据
-                    buffer += data.decode('utf-8')
-                    while '\n' in buffer:
-                        line, buffer = buffer.split('\n', 1)
-                        if line.strip():
-                            try:
-                                message = json.loads(line)
-                                self.handle_received_message(message, address)
-                            except json.JSONDecodeError:
-                                pass
-                                
-                except socket.timeout:
-                    continue
-                except Exception as e:
-                    break
-        except:
-            pass
-        finally:
-            if client_socket in self.clients:
-                self.clients.remove(client_socket)
-                self.client_label.config(text=f"已连接设备: {len(self.clients)}")
-                self.add_log(f"设备已断开: {address[0]}:{address[1]}")
-            try:
-                client_socket.close()
-            except:
-                pass
-    
-    def handle_received_message(self, message, address):
-        """处理接收到的消息"""
-        try:
-            msg_type = message.get("type")
-            content_type = message.get("contentType")
-            content = message.get("content")
-            
-            if msg_type == "clipboard" and content_type == "text/plain":
-                # 接收到文本,写入系统剪贴板
-                self.set_clipboard_text(content)
-                preview = content[:30] + "..." if len(content) > 30 else content
-                self.add_log(f"收到来自 {address[0]} 的文本: {preview}")
-        except Exception as e:
-            self.add_log(f"处理消息失败: {e}")
-    
-    def set_clipboard_text(self, text):
-        """设置系统剪贴板文本"""
-        try:
-            if set_clipboard_text(text):
-                # 更新最后的文本,避免重复发送
-                self.last_clipboard_text = text
-            else:
-                self.add_log(f"设置剪贴板失败")
-        except Exception as e:
-            self.add_log(f"设置剪贴板失败: {e}")
-                
-    def monitor_clipboard(self):
-        """监听剪贴板变化"""
-        self.add_log("剪贴板监听已启动")
-        
-        while self.is_running:
-            try:
-                # 尝试获取剪贴板中的图片
-                image = ImageGrab.grabclipboard()
-                
-                if image and isinstance(image, Image.Image):
-                    # 转换为字节数据
-                    buffer = BytesIO()
-                    image.save(buffer, format="PNG")
-                    image_data = buffer.getvalue()
-                    
-                    # 检查是否是新图片
-                    if image_data != self.last_clipboard_image:
-                        self.last_clipboard_image = image_data
-                        self.last_clipboard_text = None  # 清空文本记录
-                        self.add_log(f"检测到新图片 ({len(image_data) // 1024} KB)")
-                        
-                        # 发送到所有连接的设备
-                        self.send_image_to_clients(image_data)
-                else:
-                    # 尝试获取剪贴板中的文本
-                    if is_clipboard_text_available():
-                        text = get_clipboard_text()
-                        
-                        # 检查是否是新文本
-                        if text and text != self.last_clipboard_text and len(text.strip()) > 0:
-                            self.last_clipboard_text = text
-                            self.last_clipboard_image = None  # 清空图片记录
-                            self.add_log(f"检测到新文本 ({len(text)} 字符)")
-                            
-                            # 发送到所有连接的设备
-                            self.send_text_to_clients(text)
-                        
-            except Exception as e:
-                pass
-                
-            time.sleep(0.5)  # 每0.5秒检查一次
-            
-    def send_image_to_clients(self, image_data):
-        """发送图片到所有客户端"""
-        if not self.clients:
-            self.add_log("没有已连接的设备")
-            return
-            
-        # 构造消息
-        message = {
-            "type": "clipboard",
-            "contentType": "image/png",
-            "content": base64.b64encode(image_data).decode('utf-8'),
-            "timestamp": int(time.time() * 1000)
-        }
-        
-        json_data = json.dumps(message) + "\n"
-        data_bytes = json_data.encode('utf-8')
-        
-        # 发送到所有客户端
-        disconnected = []
-        for client in self.clients:
-            try:
-                client.sendall(data_bytes)
-            except:
-                disconnected.append(client)
-                
-        # 移除断开的客户端
-        for client in disconnected:
-            if client in self.clients:
-                self.clients.remove(client)
-                try:
-                    client.close()
-                except:
-                    pass
-                    
-        self.client_label.config(text=f"已连接设备: {len(self.clients)}")
-        
-        sent_count = len(self.clients)
-        self.add_log(f"已发送图片到 {sent_count} 个设备")
-    
-    def send_text_to_clients(self, text):
-        """发送文本到所有客户端"""
-        if not self.clients:
-            self.add_log("没有已连接的设备")
-            return
-            
-        # 构造消息
-        message = {
-            "type": "clipboard",
-            "contentType": "text/plain",
-            "content": text,
-            "timestamp": int(time.time() * 1000)
-        }
-        
-        json_data = json.dumps(message, ensure_ascii=False) + "\n"
-        data_bytes = json_data.encode('utf-8')
-        
-        # 发送到所有客户端
-        disconnected = []
-        for client in self.clients:
-            try:
-                client.sendall(data_bytes)
-            except:
-                disconnected.append(client)
-                
-        # 移除断开的客户端
-        for client in disconnected:
-            if client in self.clients:
-                self.clients.remove(client)
-                try:
-                    client.close()
-                except:
-                    pass
-                    
-        self.client_label.config(text=f"已连接设备: {len(self.clients)}")
-        
-        sent_count = len(self.clients)
-        preview = text[:30] + "..." if len(text) > 30 else text
-        self.add_log(f"已发送文本到 {sent_count} 个设备: {preview}")
-        
-    def start_discovery_broadcast(self):
-        """启动设备发现广播"""
-        try:
-            broadcast_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            broadcast_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            
-            computer_name = socket.gethostname()
-            local_ip = self.get_local_ip()
-            
-            self.add_log("设备发现广播已启动")
-            
-            while self.is_running:
-                try:
-                    discovery_message = {
-                        "deviceType": "windows",
-                        "deviceName": computer_name,
-                        "ipAddress": local_ip,
-                        "port": self.port,
-                        "timestamp": int(time.time() * 1000)
-                    }
-                    
-                    message_bytes = json.dumps(discovery_message).encode('utf-8')
-                    broadcast_socket.sendto(message_bytes, ("255.255.255.255", 5149))
-                    
-                except Exception as e:
-                    pass
-                    
-                time.sleep(5)  # 每5秒广播一次
-                
-        except Exception as e:
-            self.add_log(f"设备发现启动失败: {e}")
-    
+    def update_client_count(self, count):
+        """更新已连接设备数 (在事件循环线程中调用, 由 flush_ui_updates 显示)"""
+        self.client_count = count
+
+    def get_client_stats(self):
+        """各客户端的发送队列深度和延迟"""
+        return self.engine.get_client_stats()
+
     def on_closing(self):
         """窗口关闭事件"""
         # 最小化到托盘而不是关闭
@@ -743,7 +424,10 @@ class ClipboardSyncApp:
         self.is_minimized_to_tray = True
         
         if self.tray_icon is None and self.tray_icon_image:
-            # 创建托盘图标
+            # 创建托盘图标 (pystray 只在第一次最小化到托盘时导入)
+            import pystray
+            from pystray import MenuItem as item
+
             menu = pystray.Menu(
                 item('显示', self.show_window, default=True),
                 item('启动服务', self.start_service_from_tray, visible=lambda item: not self.is_running),
@@ -789,10 +473,17 @@ class ClipboardSyncApp:
             self.tray_icon.stop()
         if self.is_running:
             self.stop_service()
+        self.engine.close()
         self.root.quit()
 
 
 def main():
+    if "--headless" in sys.argv[1:]:
+        # 无界面模式: 不创建窗口和托盘图标
+        from sync_daemon import main as run_headless
+        sys.exit(run_headless([arg for arg in sys.argv[1:] if arg != "--headless"]))
+
+    import tkinter as tk
     root = tk.Tk()
     app = ClipboardSyncApp(root)
     root.mainloop()
@@ -0,0 +1,127 @@
+"""
+负载压缩 - 按连接协商的 zlib / zstd 压缩
+
+zstd 需要可选依赖 zstandard, 未安装时只支持 zlib。只有超过 COMPRESSION_THRESHOLD
+的文本才会压缩; 压缩率和耗时记录在 CompressionStats 中。
+"""
+
+import threading
+import time
+import zlib
+from io import BytesIO
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZLIB = "zlib"
+ZSTD = "zstd"
+
+# 小于该大小的文本直接发送, 压缩收益抵不上开销
+COMPRESSION_THRESHOLD = 32 * 1024
+# 解压后的上限, 防止压缩炸弹
+MAX_DECOMPRESSED_SIZE = 256 * 1024 * 1024
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+_DECOMPRESS_ERRORS = (zlib.error,) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+class CompressionError(ValueError):
+    """无法解压的数据"""
+
+
+def available_codecs():
+    """本机支持的压缩算法, 按优先级排列"""
+    if zstandard is not None:
+        return (ZSTD, ZLIB)
+    return (ZLIB,)
+
+
+def negotiate_compression(client_codecs):
+    """选出双方都支持的最优压缩算法, 没有则返回 None (对方声明的不是列表时视为不压缩)"""
+    if not isinstance(client_codecs, list):
+        return None
+    for codec in available_codecs():
+        if codec in client_codecs:
+            return codec
+    return None
+
+
+def compress(codec, data):
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if codec == ZLIB:
+        return zlib.compress(data, ZLIB_LEVEL)
+    raise CompressionError(f"不支持的压缩算法: {codec}")
+
+
+def decompress(codec, data, max_size=MAX_DECOMPRESSED_SIZE):
+    """解压数据, 结果超过 max_size 时抛出 CompressionError"""
+    try:
+        if codec == ZLIB:
+            decompressor = zlib.decompressobj()
+            result = decompressor.decompress(data, max_size + 1)
+            if not decompressor.eof and len(result) <= max_size:
+                raise CompressionError("压缩数据不完整")
+        elif codec == ZSTD and zstandard is not None:
+            with zstandard.ZstdDecompressor().stream_reader(BytesIO(data)) as reader:
+                result = reader.read(max_size + 1)
+        else:
+            raise CompressionError(f"不支持的压缩算法: {codec}")
+    except _DECOMPRESS_ERRORS as e:
+        raise CompressionError(f"解压失败: {e}")
+    if len(result) > max_size:
+        raise CompressionError("解压后数据过大")
+    return result
+
+
+class CompressionStats:
+    """压缩 / 解压的累计字节数、压缩率和耗时 (线程安全)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def record(self, direction, codec, raw_bytes, compressed_bytes, seconds):
+        """direction 为 "sent" 或 "received" """
+        with self._lock:
+            entry = self._totals.setdefault((direction, codec), {
+                "count": 0, "rawBytes": 0, "compressedBytes": 0, "totalMs": 0.0, "lastMs": 0.0,
+            })
+            entry["count"] += 1
+            entry["rawBytes"] += raw_bytes
+            entry["compressedBytes"] += compressed_bytes
+            entry["totalMs"] += seconds * 1000
+            entry["lastMs"] = seconds * 1000
+
+    def snapshot(self):
+        with self._lock:
+            result = []
+            for (direction, codec), entry in self._totals.items():
+                ratio = entry["compressedBytes"] / entry["rawBytes"] if entry["rawBytes"] else 1.0
+                result.append(dict(
+                    entry, direction=direction, codec=codec, ratio=round(ratio, 3),
+                    totalMs=round(entry["totalMs"], 1), lastMs=round(entry["lastMs"], 1),
+                ))
+            return result
+
+
+def timed_compress(codec, data, stats=None):
+    """压缩并记录耗时与压缩率"""
+    start = time.perf_counter()
+    result = compress(codec, data)
+    if stats is not None:
+        stats.record("sent", codec, len(data), len(result), time.perf_counter() - start)
+    return result
+
+
+def timed_decompress(codec, data, stats=None):
+    """解压并记录耗时与压缩率"""
+    start = time.perf_counter()
+    result = decompress(codec, data)
+    if stats is not None:
+        stats.record("received", codec, len(result), len(data), time.perf_counter() - start)
+    return result
@@ -0,0 +1,86 @@
+"""
+投递确认 - 跟踪未确认的剪贴板内容, 估算往返时间和时钟偏差
+
+客户端在握手中声明 "acks": true 后, 每收到一条剪贴板内容 (完整内容或 clipboardRef)
+回复 {"type": "ack", "hash": ..., "receivedAt": 毫秒, "appliedAt": 毫秒} (客户端时钟)。
+服务器记录发送完成时间 t1 和收到确认的时间 t4 (服务器时钟), 与客户端的 t2 / t3 一起
+按 NTP 的方法计算往返时间和时钟偏差, 再换算出从复制到客户端写入剪贴板的真实延迟。
+
+握手中带 "deviceId" 的客户端, 未确认的内容在断线后仍然保留, 重连时重新发送。
+"""
+
+import time
+from collections import OrderedDict, deque
+
+# 每个设备最多保留的未确认内容数
+PENDING_LIMIT = 32
+# 估算时钟偏差时参考的最近样本数
+CLOCK_WINDOW = 8
+
+
+def now_ms():
+    return time.time() * 1000
+
+
+class PendingItem:
+    """一条等待确认的内容"""
+
+    def __init__(self, digest, content_type, timestamp):
+        self.digest = digest
+        self.content_type = content_type
+        # 内容产生的时间 (服务器时钟, 毫秒)
+        self.timestamp = timestamp
+        # 发送完成的时间, 还在队列中时为 None (由发送协程在写出后设置)
+        self.sent_at = None
+
+
+class DeliveryTracker:
+    """一个设备的未确认内容 (按发送顺序, 只在事件循环线程中使用)"""
+
+    def __init__(self, limit=PENDING_LIMIT):
+        self.limit = limit
+        self.pending = OrderedDict()
+
+    def add(self, item):
+        self.pending[item.digest] = item
+        self.pending.move_to_end(item.digest)
+        while len(self.pending) > self.limit:
+            self.pending.popitem(last=False)
+
+    def discard(self, digest):
+        """内容被丢弃或被新内容取代, 不再需要确认"""
+        self.pending.pop(digest, None)
+
+    def ack(self, digest):
+        """收到确认, 返回对应的 PendingItem (未知或重复的确认返回 None)"""
+        return self.pending.pop(digest, None)
+
+    def unacked(self):
+        return list(self.pending.values())
+
+    def __len__(self):
+        return len(self.pending)
+
+
+class ClockEstimator:
+    """NTP 式估算: 取最近若干样本中往返时间最短的一个作为时钟偏差"""
+
+    def __init__(self, window=CLOCK_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.rtt = None
+        self.offset = None
+
+    def add_sample(self, sent_at, received_at, applied_at, acked_at):
+        """sent_at / acked_at 为服务器时钟, received_at / applied_at 为客户端时钟; 返回 (rtt, offset)
+
+        offset 为客户端时钟减去服务器时钟。
+        """
+        rtt = max(0.0, (acked_at - sent_at) - (applied_at - received_at))
+        offset = ((received_at - sent_at) + (applied_at - acked_at)) / 2
+        self.samples.append((rtt, offset))
+        self.rtt = rtt
+        self.offset = min(self.samples)[1]
+        return rtt, self.offset
+
+    def to_server_time(self, client_time):
+        return client_time - (self.offset or 0.0)
@@ -0,0 +1,301 @@
+"""
+设备发现 - 在所有网卡上通告本机地址, 并立即回复探测包
+
+服务器监听 UDP 5149:
+  - 定期 (以及启动、网卡变化时立即) 从每个网卡地址发送广播, ipAddress 为发出该广播的网卡地址,
+    旧版 Android 客户端收到的总是与自己同一网段的地址;
+  - 收到 {"type": "probe"} 时立即单播回复, ipAddress 为通往探测方的那个本机地址,
+    新设备不必等待下一次广播。
+通告中的 "addresses" 列出全部可用地址, "port" 为实际绑定的端口。
+
+网卡地址的枚举结果会被缓存, 只有网卡列表或默认路由的地址变化时才重新枚举 (在线程池中执行)。
+同一来源的探测每 PROBE_REPLY_INTERVAL 秒最多回复一次, 伪造来源的探测包无法阻塞事件循环或被用来放大流量。
+"""
+
+import asyncio
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+DISCOVERY_PORT = 5149
+# 定期广播的间隔和检查网卡变化的间隔 (秒)
+DISCOVERY_INTERVAL = 5
+INTERFACE_CHECK_INTERVAL = 1
+BROADCAST_ADDRESS = "255.255.255.255"
+PROBE_LIMIT = 4096
+# 同一来源两次探测回复的最小间隔 (秒), 以及最多记录的来源数
+PROBE_REPLY_INTERVAL = 1.0
+PROBE_SOURCE_LIMIT = 256
+
+# Linux 上按网卡读取地址和子网掩码的 ioctl
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891B
+
+
+def route_address(target="8.8.8.8"):
+    """通往 target 的本机地址 (UDP connect 不发送数据包); 没有路由时返回 None"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect((target, 80))
+        address = s.getsockname()[0]
+        return None if address == "0.0.0.0" else address
+    except OSError:
+        return None
+    finally:
+        s.close()
+
+
+def _linux_interfaces():
+    """Linux: [(地址, 子网广播地址)]"""
+    import fcntl
+    interfaces = []
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for _, name in socket.if_nameindex():
+            request = struct.pack("256s", name.encode()[:15])
+            try:
+                address = fcntl.ioctl(s.fileno(), SIOCGIFADDR, request)[20:24]
+                netmask = fcntl.ioctl(s.fileno(), SIOCGIFNETMASK, request)[20:24]
+            except OSError:
+                continue
+            broadcast = bytes(a | (~m & 0xFF) for a, m in zip(address, netmask))
+            interfaces.append((socket.inet_ntoa(address), socket.inet_ntoa(broadcast)))
+    finally:
+        s.close()
+    return interfaces
+
+
+def enumerate_addresses():
+    """枚举本机可用的 IPv4 地址, 返回 [(地址, 广播地址)], 默认路由的地址排在最前
+
+    排除回环地址, 链路本地地址 (169.254.x.x) 排在最后。拿不到子网掩码的平台 (Windows)
+    广播地址为 255.255.255.255, 从绑定到该地址的套接字发出时只走对应的网卡。
+    """
+    candidates = []
+    if sys.platform.startswith("linux"):
+        try:
+            candidates.extend(_linux_interfaces())
+        except (ImportError, OSError):
+            pass
+    try:
+        for info in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET):
+            candidates.append((info[4][0], BROADCAST_ADDRESS))
+    except OSError:
+        pass
+    routed = route_address()
+    if routed:
+        candidates.insert(0, (routed, BROADCAST_ADDRESS))
+
+    interfaces = {}
+    for address, broadcast in candidates:
+        if address.startswith("127.") or address == "0.0.0.0":
+            continue
+        # 同一地址优先使用已知的子网广播地址
+        if address not in interfaces or interfaces[address] == BROADCAST_ADDRESS:
+            interfaces[address] = broadcast
+    ordered = sorted(interfaces, key=lambda address: (address != routed, address.startswith("169.254.")))
+    return [(address, interfaces[address]) for address in ordered]
+
+
+def interface_fingerprint():
+    """网卡列表和默认路由地址, 用于廉价地判断是否需要重新枚举"""
+    try:
+        names = tuple(socket.if_nameindex())
+    except (AttributeError, OSError):
+        names = None
+    return names, route_address()
+
+
+class InterfaceAddresses:
+    """本机地址的缓存 (线程安全), 网卡变化时才重新枚举"""
+
+    def __init__(self):
+        self.interfaces = []
+        self._fingerprint = None
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """检查网卡是否变化, 变化时重新枚举; 返回地址是否改变"""
+        fingerprint = interface_fingerprint()
+        with self._lock:
+            if not force and fingerprint == self._fingerprint:
+                return False
+            self._fingerprint = fingerprint
+            interfaces = enumerate_addresses()
+            changed = interfaces != self.interfaces
+            self.interfaces = interfaces
+            return changed
+
+    def addresses(self):
+        if self._fingerprint is None:
+            self.refresh()
+        return [address for address, _ in self.interfaces]
+
+
+local_addresses = InterfaceAddresses()
+
+
+def get_local_ip():
+    """获取本机IP地址 (默认路由的地址, 离线时为第一个可用地址)"""
+    addresses = local_addresses.addresses()
+    return addresses[0] if addresses else "127.0.0.1"
+
+
+class DiscoveryProtocol(asyncio.DatagramProtocol):
+    """监听端口上的探测包"""
+
+    def __init__(self, service):
+        self.service = service
+
+    def datagram_received(self, data, addr):
+        if len(data) > PROBE_LIMIT:
+            return
+        try:
+            message = json.loads(data)
+        except ValueError:
+            return
+        if isinstance(message, dict) and message.get("type") == "probe":
+            self.service.answer_probe(addr)
+
+
+class DiscoveryService:
+    """设备发现: 监听探测包, 在每个网卡上定期广播; get_port() 返回当前服务端口"""
+
+    def __init__(self, get_port, log=print, metrics=None, addresses=local_addresses):
+        self.get_port = get_port
+        self.log = log
+        self.metrics = metrics
+        self.addresses = addresses
+        self.device_name = socket.gethostname()
+        self.loop = None
+        self.transport = None
+        # 网卡地址 -> 绑定到该地址的广播套接字
+        self.senders = {}
+        # 探测来源地址 -> 最后一次回复的时间
+        self.probe_replies = OrderedDict()
+        # 探测触发的重新枚举: 同一时间最多一次, 间隔不小于 INTERFACE_CHECK_INTERVAL
+        self.refreshing = False
+        self.last_forced_refresh = 0
+
+    def announcement(self, address):
+        return {
+            "type": "announce",
+            "deviceType": "windows",
+            "deviceName": self.device_name,
+            "ipAddress": address,
+            "addresses": self.addresses.addresses(),
+            "port": self.get_port(),
+            "timestamp": int(time.time() * 1000)
+        }
+
+    async def run(self, loop):
+        """运行直到被取消"""
+        self.loop = loop
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            sock.bind(("0.0.0.0", DISCOVERY_PORT))
+            self.transport, _ = await loop.create_datagram_endpoint(lambda: DiscoveryProtocol(self), sock=sock)
+        except OSError as e:
+            # 端口被占用时仍然可以广播, 只是不能回复探测
+            self.log(f"设备发现端口 {DISCOVERY_PORT} 不可用, 只发送广播: {e}")
+
+        self.log("设备发现广播已启动")
+        last_announce = 0
+        try:
+            while True:
+                changed = await loop.run_in_executor(None, self.addresses.refresh)
+                if changed:
+                    self.log(f"网络地址: {', '.join(self.addresses.addresses()) or '无'}")
+                if changed or time.monotonic() - last_announce >= DISCOVERY_INTERVAL:
+                    self.announce(rebind=changed)
+                    last_announce = time.monotonic()
+                await asyncio.sleep(INTERFACE_CHECK_INTERVAL)
+        finally:
+            self.close()
+
+    def announce(self, rebind=False):
+        """从每个网卡地址发送一次广播"""
+        if rebind or not self.senders:
+            self._bind_senders()
+        for address, broadcast in self.addresses.interfaces:
+            sender = self.senders.get(address)
+            if sender is None:
+                continue
+            payload = json.dumps(self.announcement(address)).encode('utf-8')
+            for target in {broadcast, BROADCAST_ADDRESS}:
+                try:
+                    sender.sendto(payload, (target, DISCOVERY_PORT))
+                except OSError:
+                    pass
+        if self.metrics:
+            self.metrics.increment("discoveryAnnouncements")
+
+    def answer_probe(self, addr):
+        """立即单播回复探测方, ipAddress 为通往它的本机地址; 同一来源回复过于频繁时丢弃"""
+        now = time.monotonic()
+        last = self.probe_replies.get(addr[0])
+        if last is not None and now - last < PROBE_REPLY_INTERVAL:
+            if self.metrics:
+                self.metrics.increment("discoveryProbesDropped")
+            return
+        self.probe_replies[addr[0]] = now
+        self.probe_replies.move_to_end(addr[0])
+        while len(self.probe_replies) > PROBE_SOURCE_LIMIT:
+            self.probe_replies.popitem(last=False)
+
+        address = route_address(addr[0])
+        if address and not address.startswith("127.") and address not in self.addresses.addresses():
+            # 探测来自缓存中没有的网卡, 说明网卡已变化; 本次先按路由地址回复
+            self._refresh_in_background(now)
+        payload = json.dumps(self.announcement(address or get_local_ip())).encode('utf-8')
+        try:
+            self.transport.sendto(payload, addr)
+        except OSError:
+            return
+        if self.metrics:
+            self.metrics.increment("discoveryProbes")
+
+    def _refresh_in_background(self, now):
+        """在线程池中强制重新枚举网卡, 地址变化时重新绑定并广播"""
+        if self.refreshing or self.loop is None or now - self.last_forced_refresh < INTERFACE_CHECK_INTERVAL:
+            return
+        self.refreshing = True
+        self.last_forced_refresh = now
+        self.loop.run_in_executor(None, self.addresses.refresh, True).add_done_callback(self._refresh_done)
+
+    def _refresh_done(self, future):
+        self.refreshing = False
+        if future.cancelled() or future.exception() is not None or not future.result():
+            return
+        self.log(f"网络地址: {', '.join(self.addresses.addresses()) or '无'}")
+        self.announce(rebind=True)
+
+    def _bind_senders(self):
+        self._close_senders()
+        for address, _ in self.addresses.interfaces:
+            sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sender.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                sender.setblocking(False)
+                sender.bind((address, 0))
+            except OSError:
+                sender.close()
+                continue
+            self.senders[address] = sender
+
+    def _close_senders(self):
+        for sender in self.senders.values():
+            sender.close()
+        self.senders.clear()
+
+    def close(self):
+        self._close_senders()
+        if self.transport:
+            self.transport.close()
+            self.transport = None
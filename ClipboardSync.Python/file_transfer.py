@@ -0,0 +1,237 @@
+"""
+文件传输通道 - 按字节范围发送复制的文件, 支持断点续传
+
+复制的文件登记后得到随机 fileId (出现在清单的 files 中), 只有登记过的文件可以被读取。
+文件通道是独立的 TCP 端口 (握手回复中的 "filePort"), 不占用剪贴板消息的连接:
+  客户端: {"type": "fileRequest", "fileId": ..., "offset": N, "length": M, "deviceId": ...}  (JSON 行)
+  服务器: {"type": "fileRange", "fileId": ..., "name": ..., "size": ..., "offset": ..., "length": ...,
+           "chunkSize": ..., "hashes": [...]}  (JSON 行), 随后是 length 字节的文件内容
+  客户端每校验完一块发送 {"type": "fileAck", "fileId": ..., "offset": 已确认的末尾位置}
+出错时 (包括字段类型不对的请求) 服务器回复 {"type": "fileError", "fileId": ..., "error": ...}。
+
+offset 会向下对齐到块边界, hashes 是范围内每块的 SHA-256; 省略 offset 时从该 deviceId
+最后确认的位置继续。文件内容用 loop.sendfile (支持时为零拷贝的 os.sendfile) 直接从磁盘发送,
+块哈希通过 mmap 计算, 都不会把文件读入 Python 内存。
+"""
+
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+import secrets
+import threading
+from collections import OrderedDict
+
+from protocol import encode_json_line
+
+FILE_CHUNK_SIZE = 4 * 1024 * 1024
+# 最多登记的文件数和记录的续传位置数
+FILE_REGISTRY_LIMIT = 256
+PROGRESS_LIMIT = 1024
+# fileRange 头中每块的哈希约 70 字节, 8 MB 足够覆盖上百 GB 的文件
+HEADER_LINE_LIMIT = 8 * 1024 * 1024
+
+
+def valid_request(request):
+    """请求的字段类型是否正确: fileId 为字符串, deviceId 为字符串或省略, offset / length 为整数或省略"""
+    if not isinstance(request.get("fileId"), str) or not isinstance(request.get("deviceId"), (str, type(None))):
+        return False
+    return all(value is None or (isinstance(value, int) and not isinstance(value, bool))
+               for value in (request.get("offset"), request.get("length")))
+
+
+class FileTransferError(Exception):
+    """文件传输失败 (文件已变化或服务器返回错误)"""
+
+
+class ChunkMismatch(FileTransferError):
+    """收到的块与哈希不符, 可以从该块重新请求"""
+
+
+class SharedFile:
+    """一个已登记的文件及其已计算的块哈希"""
+
+    def __init__(self, file_id, path):
+        self.file_id = file_id
+        self.path = path
+        self.name = os.path.basename(path)
+        stat = os.stat(path)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        # 块序号 -> SHA-256, 按需计算
+        self.hashes = {}
+        self._lock = threading.Lock()
+
+    def unchanged(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return stat.st_size == self.size and stat.st_mtime == self.mtime
+
+    def chunk_hashes(self, first, last, chunk_size=FILE_CHUNK_SIZE):
+        """第 first 到 last-1 块的哈希 (阻塞, 在线程池中调用)"""
+        with self._lock:
+            missing = [index for index in range(first, last) if index not in self.hashes]
+            if missing:
+                with open(self.path, "rb") as f, \
+                        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    view = memoryview(mapped)
+                    try:
+                        for index in missing:
+                            start = index * chunk_size
+                            self.hashes[index] = hashlib.sha256(view[start:start + chunk_size]).hexdigest()
+                    finally:
+                        view.release()
+            return [self.hashes[index] for index in range(first, last)]
+
+
+class FileTransferService:
+    """登记复制的文件并在文件通道上按范围发送"""
+
+    def __init__(self, log=print, metrics=None, chunk_size=FILE_CHUNK_SIZE):
+        self.log = log
+        self.metrics = metrics
+        self.chunk_size = chunk_size
+        self.files = OrderedDict()
+        self.paths = {}
+        # (deviceId, fileId) -> 客户端确认收到的末尾位置
+        self.progress = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, path):
+        """登记一个本地文件, 返回 fileId; 同一文件未变化时返回原来的 fileId"""
+        path = os.path.abspath(path)
+        with self._lock:
+            file_id = self.paths.get(path)
+            if file_id is not None and self.files[file_id].unchanged():
+                self.files.move_to_end(file_id)
+                return file_id
+            file_id = secrets.token_hex(8)
+            self.files[file_id] = SharedFile(file_id, path)
+            self.paths[path] = file_id
+            while len(self.files) > FILE_REGISTRY_LIMIT:
+                _, evicted = self.files.popitem(last=False)
+                if self.paths.get(evicted.path) == evicted.file_id:
+                    del self.paths[evicted.path]
+            return file_id
+
+    def confirmed_offset(self, device_id, file_id):
+        return self.progress.get((device_id, file_id), 0)
+
+    def _confirm(self, device_id, file_id, offset):
+        key = (device_id, file_id)
+        self.progress[key] = max(offset, self.progress.get(key, 0))
+        self.progress.move_to_end(key)
+        while len(self.progress) > PROGRESS_LIMIT:
+            self.progress.popitem(last=False)
+
+    async def handle_connection(self, reader, writer):
+        """文件通道上的一个连接: 依次处理范围请求和确认"""
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    break
+                if not isinstance(request, dict):
+                    break
+                if request.get("type") in ("fileAck", "fileRequest") and not valid_request(request):
+                    writer.write(encode_json_line({"type": "fileError", "error": "请求格式错误"}))
+                    await writer.drain()
+                    continue
+                if request.get("type") == "fileAck":
+                    if request.get("offset") is not None:
+                        self._confirm(request.get("deviceId"), request["fileId"], request["offset"])
+                elif request.get("type") == "fileRequest":
+                    await self._send_range(loop, writer, request)
+        except (ConnectionError, OSError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send_range(self, loop, writer, request):
+        file_id = request.get("fileId")
+        shared = self.files.get(file_id)
+        if shared is None or not shared.unchanged():
+            error = "文件不存在" if shared is None else "文件已变化"
+            writer.write(encode_json_line({"type": "fileError", "fileId": file_id, "error": error}))
+            await writer.drain()
+            return
+
+        offset = request.get("offset")
+        if offset is None:
+            offset = self.confirmed_offset(request.get("deviceId"), file_id)
+        offset = min(max(0, offset), shared.size)
+        offset -= offset % self.chunk_size
+        length = shared.size - offset
+        if request.get("length") is not None:
+            length = min(length, max(0, request["length"]))
+        first = offset // self.chunk_size
+        last = -(-(offset + length) // self.chunk_size)
+        hashes = await loop.run_in_executor(None, shared.chunk_hashes, first, last, self.chunk_size)
+
+        writer.write(encode_json_line({
+            "type": "fileRange", "fileId": file_id, "name": shared.name, "size": shared.size,
+            "offset": offset, "length": length, "chunkSize": self.chunk_size, "hashes": hashes
+        }))
+        await writer.drain()
+        if length:
+            with open(shared.path, "rb") as f:
+                # 传输层支持时由内核直接从文件发送 (os.sendfile), 否则分块读取后发送
+                await loop.sendfile(writer.transport, f, offset, length)
+        if self.metrics:
+            self.metrics.increment("fileBytesSent", length)
+
+
+async def download_file(host, port, file_id, path, device_id=None, on_progress=None, retries=3):
+    """从文件通道下载文件到 path, 已有的 path + ".part" 会从最后一个完整块继续
+
+    每块校验哈希后写入并确认, 校验失败的块重新请求; on_progress(received, size) 在每块后调用。
+    """
+    partial = path + ".part"
+    attempts = 0
+    while True:
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        reader, writer = await asyncio.open_connection(host, port, limit=HEADER_LINE_LIMIT)
+        try:
+            writer.write(encode_json_line({
+                "type": "fileRequest", "fileId": file_id, "offset": offset, "deviceId": device_id
+            }))
+            await writer.drain()
+            header = json.loads(await reader.readline() or b"{}")
+            if header.get("type") != "fileRange":
+                raise FileTransferError(header.get("error") or "服务器没有返回文件")
+
+            chunk_size = header["chunkSize"]
+            position = header["offset"]
+            end = position + header["length"]
+            with open(partial, "r+b" if os.path.exists(partial) else "wb") as f:
+                f.truncate(position)
+                f.seek(position)
+                for expected in header["hashes"]:
+                    data = await reader.readexactly(min(chunk_size, end - position))
+                    if hashlib.sha256(data).hexdigest() != expected:
+                        raise ChunkMismatch(f"第 {position // chunk_size} 块校验失败")
+                    f.write(data)
+                    position += len(data)
+                    writer.write(encode_json_line({
+                        "type": "fileAck", "fileId": file_id, "offset": position, "deviceId": device_id
+                    }))
+                    if on_progress:
+                        on_progress(position, header["size"])
+            if position >= header["size"]:
+                os.replace(partial, path)
+                return header
+        except (ChunkMismatch, asyncio.IncompleteReadError, ConnectionError):
+            # 连接中断或校验失败: 从最后一个完整写入的块继续
+            attempts += 1
+            if attempts > retries:
+                raise
+        finally:
+            writer.close()
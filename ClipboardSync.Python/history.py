@@ -0,0 +1,275 @@
+"""
+剪贴板历史 - SQLite 记录 + 磁盘图片存储
+
+每条同步过的内容记录来源设备、时间戳和内容哈希。文本按哈希去重存入 texts 表,
+并建立 FTS5 全文索引 (trigram 分词, 支持中文子串搜索); 图片等二进制内容按哈希
+存为磁盘文件, 总大小超过上限时按最近使用时间淘汰。历史只保存在磁盘上,
+查询和取回时按需读取, 不常驻内存。
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from payload_store import StoredPayload, content_hash
+from protocol import is_text_content
+
+DEFAULT_MAX_ITEMS = 100000
+DEFAULT_MAX_BLOB_BYTES = 512 * 1024 * 1024
+PREVIEW_LENGTH = 100
+QUERY_LIMIT = 200
+# trigram 分词至少需要 3 个字符, 更短的搜索词回落到 LIKE
+MIN_FTS_QUERY = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    source TEXT,
+    timestamp INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    preview TEXT
+);
+CREATE INDEX IF NOT EXISTS items_hash ON items(hash);
+CREATE TABLE IF NOT EXISTS texts (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    content TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    content_type TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs(last_used);
+"""
+
+
+def default_data_dir():
+    """历史数据目录: Windows 下为 %APPDATA%\\ClipboardSync, 其他系统为 ~/.clipboard_sync"""
+    if sys.platform == "win32" and os.environ.get("APPDATA"):
+        return os.path.join(os.environ["APPDATA"], "ClipboardSync")
+    return os.path.join(os.path.expanduser("~"), ".clipboard_sync")
+
+
+def fts_phrase(query):
+    """把用户输入转成 FTS5 短语, 避免特殊字符被当作查询语法"""
+    return '"' + query.replace('"', '""') + '"'
+
+
+def like_pattern(query):
+    return "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+class ClipboardHistory:
+    """剪贴板历史记录 (线程安全)
+
+    path: SQLite 数据库文件; 图片存放在同目录的 blobs 子目录中。
+    max_items: 最多保留的记录数, 超出时删除最旧的记录。
+    max_blob_bytes: 图片存储的总大小上限。
+    """
+
+    def __init__(self, path, max_items=DEFAULT_MAX_ITEMS, max_blob_bytes=DEFAULT_MAX_BLOB_BYTES):
+        self.path = path
+        self.blob_dir = os.path.join(os.path.dirname(os.path.abspath(path)), "blobs")
+        self.max_items = max_items
+        self.max_blob_bytes = max_blob_bytes
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self.fts_enabled = self._create_fts()
+        self._db.commit()
+        self.blob_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def _create_fts(self):
+        """创建全文索引, SQLite 不支持 FTS5 / trigram 时回落到 LIKE 搜索"""
+        try:
+            self._db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS texts_fts USING fts5("
+                "content, content='texts', content_rowid='id', tokenize='trigram')"
+            )
+            return True
+        except sqlite3.OperationalError:
+            return False
+
+    def record(self, content_type, content, source=None, timestamp=None, digest=None):
+        """记录一条同步内容, 返回记录编号"""
+        if digest is None:
+            digest = content_hash(content)
+        if timestamp is None:
+            timestamp = int(time.time() * 1000)
+
+        if is_text_content(content_type):
+            preview = content[:PREVIEW_LENGTH]
+            size = len(content.encode('utf-8'))
+        else:
+            preview = None
+            size = len(content)
+
+        with self._lock:
+            if is_text_content(content_type):
+                self._store_text(digest, content)
+            else:
+                self._store_blob(digest, content_type, content)
+            cursor = self._db.execute(
+                "INSERT INTO items (hash, content_type, source, timestamp, size, preview) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (digest, content_type, source, timestamp, size, preview)
+            )
+            item_id = cursor.lastrowid
+            if item_id > self.max_items:
+                self._prune(item_id - self.max_items + 1)
+            self._db.commit()
+        return item_id
+
+    def _store_text(self, digest, content):
+        cursor = self._db.execute("INSERT OR IGNORE INTO texts (hash, content) VALUES (?, ?)", (digest, content))
+        if cursor.rowcount and self.fts_enabled:
+            self._db.execute("INSERT INTO texts_fts (rowid, content) VALUES (?, ?)", (cursor.lastrowid, content))
+
+    def _store_blob(self, digest, content_type, data):
+        now = time.time()
+        cursor = self._db.execute("UPDATE blobs SET last_used = ? WHERE hash = ?", (now, digest))
+        if cursor.rowcount and os.path.exists(self._blob_path(digest)):
+            return
+        if len(data) > self.max_blob_bytes:
+            return
+
+        path = self._blob_path(digest)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        if not cursor.rowcount:
+            self._db.execute(
+                "INSERT INTO blobs (hash, content_type, size, last_used) VALUES (?, ?, ?, ?)",
+                (digest, content_type, len(data), now)
+            )
+            self.blob_bytes += len(data)
+        self._evict_blobs()
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest)
+
+    def _evict_blobs(self):
+        """按最近使用时间淘汰图片, 直到总大小低于上限"""
+        while self.blob_bytes > self.max_blob_bytes:
+            rows = self._db.execute("SELECT hash, size FROM blobs ORDER BY last_used LIMIT 16").fetchall()
+            if not rows:
+                break
+            for digest, size in rows:
+                self._delete_blob(digest, size)
+                if self.blob_bytes <= self.max_blob_bytes:
+                    break
+
+    def _delete_blob(self, digest, size):
+        self._db.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+        self.blob_bytes -= size
+        try:
+            os.remove(self._blob_path(digest))
+        except OSError:
+            pass
+
+    def _prune(self, oldest_kept_id):
+        """删除编号小于 oldest_kept_id 的记录, 以及不再被引用的文本和图片"""
+        digests = self._db.execute("SELECT DISTINCT hash FROM items WHERE id < ?", (oldest_kept_id,)).fetchall()
+        self._db.execute("DELETE FROM items WHERE id < ?", (oldest_kept_id,))
+        for (digest,) in digests:
+            if self._db.execute("SELECT 1 FROM items WHERE hash = ? LIMIT 1", (digest,)).fetchone():
+                continue
+            row = self._db.execute("SELECT id, content FROM texts WHERE hash = ?", (digest,)).fetchone()
+            if row is not None:
+                if self.fts_enabled:
+                    self._db.execute(
+                        "INSERT INTO texts_fts (texts_fts, rowid, content) VALUES ('delete', ?, ?)", row
+                    )
+                self._db.execute("DELETE FROM texts WHERE id = ?", (row[0],))
+            row = self._db.execute("SELECT size FROM blobs WHERE hash = ?", (digest,)).fetchone()
+            if row is not None:
+                self._delete_blob(digest, row[0])
+
+    def query(self, text=None, content_type=None, before_id=None, limit=50):
+        """按时间倒序查询历史, 可按文本内容、内容类型前缀过滤, before_id 用于翻页"""
+        limit = max(1, min(int(limit), QUERY_LIMIT))
+        conditions = []
+        params = []
+        if before_id is not None:
+            conditions.append("items.id < ?")
+            params.append(int(before_id))
+        if content_type:
+            conditions.append("items.content_type LIKE ? ESCAPE '\\'")
+            params.append(like_pattern(content_type)[1:])
+        if text:
+            if self.fts_enabled and len(text) >= MIN_FTS_QUERY:
+                conditions.append(
+                    "items.hash IN (SELECT hash FROM texts WHERE id IN "
+                    "(SELECT rowid FROM texts_fts WHERE texts_fts MATCH ?))"
+                )
+                params.append(fts_phrase(text))
+            else:
+                conditions.append("items.hash IN (SELECT hash FROM texts WHERE content LIKE ? ESCAPE '\\')")
+                params.append(like_pattern(text))
+
+        sql = (
+            "SELECT items.id, items.hash, items.content_type, items.source, items.timestamp, items.size, "
+            "items.preview, (texts.id IS NOT NULL OR blobs.hash IS NOT NULL) "
+            "FROM items LEFT JOIN texts ON texts.hash = items.hash LEFT JOIN blobs ON blobs.hash = items.hash"
+        )
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY items.id DESC LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [
+            {
+                "id": row[0],
+                "hash": row[1],
+                "contentType": row[2],
+                "source": row[3],
+                "timestamp": row[4],
+                "size": row[5],
+                "preview": row[6],
+                "available": bool(row[7]),
+            }
+            for row in rows
+        ]
+
+    def get(self, digest):
+        """按哈希取回内容, 已被淘汰或不存在时返回 None"""
+        with self._lock:
+            row = self._db.execute("SELECT content FROM texts WHERE hash = ?", (digest,)).fetchone()
+            if row is not None:
+                content_type = self._db.execute(
+                    "SELECT content_type FROM items WHERE hash = ? ORDER BY id DESC LIMIT 1", (digest,)
+                ).fetchone()
+                return StoredPayload(content_type[0] if content_type else "text/plain", row[0])
+
+            row = self._db.execute("SELECT content_type FROM blobs WHERE hash = ?", (digest,)).fetchone()
+            if row is None:
+                return None
+            try:
+                with open(self._blob_path(digest), "rb") as f:
+                    data = f.read()
+            except OSError:
+                return None
+            self._db.execute("UPDATE blobs SET last_used = ? WHERE hash = ?", (time.time(), digest))
+            self._db.commit()
+        return StoredPayload(row[0], data)
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,167 @@
+"""
+图片编码策略 - 按图片特征和客户端能力选择格式、压缩力度和分辨率
+
+截图、界面等颜色少的图片用无损 PNG; 照片类图片在客户端支持时用 WebP/JPEG。
+大图降低 PNG 压缩级别以缩短编码时间; 客户端声明屏幕尺寸时把图片缩小到屏幕大小。
+同一剪贴板图片的每种编码结果只生成一次, 供所有需要它的客户端共享。
+收到的图片用 decode_image 解码, image_to_bmp 转为写入剪贴板用的位图。
+Pillow 在第一次处理图片时才导入, 不影响启动时间。
+"""
+
+import threading
+import time
+from collections import namedtuple
+from io import BytesIO
+
+PNG = "image/png"
+WEBP = "image/webp"
+JPEG = "image/jpeg"
+BMP = "image/bmp"
+DEFAULT_IMAGE_FORMATS = (PNG,)
+
+# 缩略图中颜色数超过该值视为照片类图片
+PHOTO_COLOR_THRESHOLD = 1024
+ANALYSIS_SIZE = 96
+LOSSY_QUALITY = 85
+
+# 编码规格: max_dimension 为最长边上限 (None 表示原尺寸),
+# effort 对 PNG 是 compress_level (0-9), 对 WebP 是 method (0-6)
+EncodingSpec = namedtuple("EncodingSpec", "content_type max_dimension quality effort")
+ImageTraits = namedtuple("ImageTraits", "has_alpha photo_like pixels")
+
+
+def analyze_image(image):
+    """分析图片特征: 是否含透明度、是否为照片类、像素数"""
+    from PIL import Image
+
+    has_alpha = False
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        alpha = image.convert("RGBA").getchannel("A") if image.mode == "P" else image.getchannel("A")
+        has_alpha = alpha.getextrema()[0] < 255
+
+    # 最近邻缩小只做采样, 在大图上也很快
+    width, height = image.size
+    scale = min(1.0, ANALYSIS_SIZE / max(width, height, 1))
+    sample = image.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.Resampling.NEAREST)
+    photo_like = sample.getcolors(maxcolors=PHOTO_COLOR_THRESHOLD) is None
+
+    return ImageTraits(has_alpha, photo_like, width * height)
+
+
+def png_effort(pixels):
+    """PNG 压缩级别: 像素越多越偏向编码速度"""
+    if pixels > 8_000_000:
+        return 1
+    if pixels > 2_000_000:
+        return 3
+    return 6
+
+
+def choose_encoding(traits, image_size, accepted_formats=DEFAULT_IMAGE_FORMATS, screen_size=None):
+    """为一个客户端选择编码规格"""
+    from PIL import features
+
+    max_dimension = None
+    if screen_size:
+        limit = max(screen_size)
+        if limit and max(image_size) > limit:
+            max_dimension = limit
+
+    pixels = traits.pixels
+    if max_dimension:
+        scale = max_dimension / max(image_size)
+        pixels = int(pixels * scale * scale)
+
+    if traits.photo_like:
+        if WEBP in accepted_formats and features.check("webp"):
+            return EncodingSpec(WEBP, max_dimension, LOSSY_QUALITY, 2 if pixels > 2_000_000 else 4)
+        if JPEG in accepted_formats and not traits.has_alpha:
+            return EncodingSpec(JPEG, max_dimension, LOSSY_QUALITY, None)
+    return EncodingSpec(PNG, max_dimension, None, png_effort(pixels))
+
+
+def scaled_size(size, max_dimension):
+    """按最长边上限缩小后的尺寸"""
+    width, height = size
+    if not max_dimension:
+        return size
+    scale = max_dimension / max(width, height)
+    return (max(1, round(width * scale)), max(1, round(height * scale)))
+
+
+def encode_image(image, spec):
+    """按规格编码图片"""
+    from PIL import Image
+
+    if spec.max_dimension:
+        image = image.resize(scaled_size(image.size, spec.max_dimension), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    buffer = BytesIO()
+    if spec.content_type == JPEG:
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.save(buffer, format="JPEG", quality=spec.quality, optimize=False)
+    elif spec.content_type == WEBP:
+        image.save(buffer, format="WEBP", quality=spec.quality, method=spec.effort)
+    else:
+        image.save(buffer, format="PNG", compress_level=spec.effort)
+    return buffer.getvalue()
+
+
+def decode_image(data):
+    """解码收到的图片字节 (PNG / WebP / JPEG), 返回已载入像素的 PIL.Image"""
+    from PIL import Image
+
+    image = Image.open(BytesIO(data))
+    image.load()
+    return image
+
+
+def image_to_bmp(image):
+    """把图片转为 BMP 文件字节 (24 位, 含透明度时 32 位); 去掉 14 字节文件头即为 Windows 的 CF_DIB"""
+    if image.mode not in ("RGB", "RGBA"):
+        has_alpha = image.mode in ("LA", "PA") or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+    buffer = BytesIO()
+    image.save(buffer, format="BMP")
+    return buffer.getvalue()
+
+
+class ClipboardImage:
+    """一张剪贴板图片及其已编码的各种变体"""
+
+    def __init__(self, image, fingerprint=None):
+        self.image = image
+        self.fingerprint = fingerprint
+        self._traits = None
+        self._variants = {}
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self.image.size
+
+    @property
+    def traits(self):
+        if self._traits is None:
+            self._traits = analyze_image(self.image)
+        return self._traits
+
+    def spec_for(self, accepted_formats=DEFAULT_IMAGE_FORMATS, screen_size=None):
+        """为声明了指定格式和屏幕尺寸的客户端选择编码规格"""
+        return choose_encoding(self.traits, self.size, accepted_formats, screen_size)
+
+    def encode(self, spec, metrics=None):
+        """返回该规格的编码结果, 每种规格只编码一次 (实际编码时记入 metrics 的 encode 阶段)"""
+        with self._lock:
+            data = self._variants.get(spec)
+            if data is None:
+                started = time.perf_counter()
+                data = self._variants[spec] = encode_image(self.image, spec)
+                if metrics:
+                    metrics.observe_since("encode", started)
+            return data
+
+    def png(self):
+        """原尺寸 PNG (不支持其他格式的客户端和本地存储使用)"""
+        return self.encode(self.spec_for())
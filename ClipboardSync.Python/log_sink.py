@@ -0,0 +1,180 @@
+"""
+日志管道 - 有界环形缓冲 + 限流 + 可选的滚动日志文件
+
+任意线程都可以调用 LogSink 记录日志, 记录只追加到固定容量的 deque 中, 不会阻塞;
+图形界面在 Tk 线程中定时用 drain() 批量取走新记录。相同类型的日志在时间窗口内
+超过上限后会被省略, 窗口结束后补记一条省略数量: 由 drain() / flush_suppressed() 定时补记
+(同类日志再次出现时也会补记), close() 补记所有尚未结束的窗口。
+
+无界面模式可用 setup_file_logging() 把日志写入按大小滚动的文件 (经 QueueHandler
+转交后台线程写入, 调用方同样不会被磁盘 I/O 阻塞)。
+"""
+
+import logging
+import logging.handlers
+import queue
+import re
+import threading
+import time
+from collections import deque, namedtuple
+
+DEFAULT_CAPACITY = 1000
+# 每种日志在 RATE_INTERVAL 秒内最多记录 RATE_LIMIT 条
+RATE_LIMIT = 5
+RATE_INTERVAL = 10.0
+RATE_KEY_LENGTH = 24
+RATE_KEY_LIMIT = 1000
+
+LOG_FORMAT = "[%(asctime)s] %(levelname)s %(message)s"
+DEFAULT_LOG_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_LOG_BACKUPS = 3
+
+LogRecord = namedtuple("LogRecord", "created level message")
+
+
+def rate_key(message):
+    """日志的限流分类: 去掉数字后的前缀 (同一模板的日志归为一类)"""
+    return re.sub(r"\d+", "#", message)[:RATE_KEY_LENGTH]
+
+
+def suppressed_summary(key, count):
+    return f"(已省略 {count} 条类似日志: {key}…)"
+
+
+class LogSink:
+    """线程安全的日志接收端, 可直接作为 log(message) 回调使用
+
+    capacity: 未取走记录和最近记录的保留条数, 超出后丢弃最旧的
+    logger: 可选的 logging.Logger, 记录同时转发给它 (例如写入日志文件)
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, rate_limit=RATE_LIMIT, rate_interval=RATE_INTERVAL,
+                 logger=None):
+        self.pending = deque(maxlen=capacity)
+        self.recent = deque(maxlen=capacity)
+        self.rate_limit = rate_limit
+        self.rate_interval = rate_interval
+        self.logger = logger
+        self.suppressed_total = 0
+        # 限流状态: 分类 -> [窗口开始时间, 窗口内条数, 被省略条数]
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, message, level=logging.INFO):
+        self.log(message, level)
+
+    def log(self, message, level=logging.INFO):
+        message = str(message)
+        now = time.time()
+        allowed, summary = self._check_rate(rate_key(message), now)
+        if summary:
+            self._append(LogRecord(now, logging.INFO, summary))
+        if allowed:
+            self._append(LogRecord(now, level, message))
+
+    def warning(self, message):
+        self.log(message, logging.WARNING)
+
+    def error(self, message):
+        self.log(message, logging.ERROR)
+
+    def _check_rate(self, key, now):
+        """返回 (是否记录, 上个窗口的省略提示或 None)"""
+        if not self.rate_limit:
+            return True, None
+        with self._lock:
+            window = self._windows.get(key)
+            summary = None
+            if window is None or now - window[0] >= self.rate_interval:
+                if window is not None and window[2]:
+                    summary = suppressed_summary(key, window[2])
+                if len(self._windows) >= RATE_KEY_LIMIT:
+                    self._expire(now)
+                window = self._windows[key] = [now, 0, 0]
+            window[1] += 1
+            if window[1] > self.rate_limit:
+                window[2] += 1
+                self.suppressed_total += 1
+                return False, summary
+            return True, summary
+
+    def flush_suppressed(self, now=None, final=False):
+        """补记已结束窗口 (final 为 True 时为所有窗口) 的省略数量, 可定时调用"""
+        if not self.rate_limit:
+            return
+        if now is None:
+            now = time.time()
+        summaries = []
+        with self._lock:
+            for key, window in self._windows.items():
+                if window[2] and (final or now - window[0] >= self.rate_interval):
+                    summaries.append(suppressed_summary(key, window[2]))
+                    window[2] = 0
+        for summary in summaries:
+            self._append(LogRecord(now, logging.INFO, summary))
+
+    def close(self):
+        """补记所有省略数量 (退出前调用)"""
+        self.flush_suppressed(final=True)
+
+    def _expire(self, now):
+        for key in [k for k, w in self._windows.items() if now - w[0] >= self.rate_interval]:
+            del self._windows[key]
+        if len(self._windows) >= RATE_KEY_LIMIT:
+            self._windows.clear()
+
+    def _append(self, record):
+        # deque.append 是原子操作, 满时自动丢弃最旧的记录
+        self.pending.append(record)
+        self.recent.append(record)
+        if self.logger is not None:
+            self.logger.log(record.level, record.message)
+
+    def drain(self, max_records=None):
+        """取走尚未处理的记录 (按时间顺序); 先补记已结束窗口的省略数量"""
+        self.flush_suppressed()
+        records = []
+        while self.pending and (max_records is None or len(records) < max_records):
+            try:
+                records.append(self.pending.popleft())
+            except IndexError:
+                break
+        return records
+
+    def snapshot(self):
+        """最近的记录 (不影响 drain)"""
+        return list(self.recent)
+
+
+def format_record(record):
+    """格式化为界面显示用的一行"""
+    return f"[{time.strftime('%H:%M:%S', time.localtime(record.created))}] {record.message}"
+
+
+def setup_file_logging(path=None, level="INFO", max_bytes=DEFAULT_LOG_MAX_BYTES,
+                       backup_count=DEFAULT_LOG_BACKUPS, console=True, name="clipboard_sync"):
+    """配置 logger: 控制台和 / 或按大小滚动的日志文件, 由后台线程写入
+
+    返回 (logger, listener), 退出前调用 listener.stop() 写完剩余日志。
+    """
+    handlers = []
+    formatter = logging.Formatter(LOG_FORMAT, "%Y-%m-%d %H:%M:%S")
+    if path:
+        file_handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+        handlers.append(console_handler)
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=False)
+    logger = logging.getLogger(name)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    logger.propagate = False
+    listener.start()
+    return logger, listener
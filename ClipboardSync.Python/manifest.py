@@ -0,0 +1,129 @@
+"""
+剪贴板变化清单 - 只通告格式、大小和哈希, 客户端粘贴时再按格式取回
+
+文本类格式 (纯文本、HTML、RTF、文件列表) 在发布时存入负载存储并计算哈希;
+图片保留原图, 只有客户端取回时才按它的规格编码, 没人粘贴的图片不会被编码和发送。
+"""
+
+import os
+from urllib.parse import unquote, urlparse
+
+from image_encoding import scaled_size
+from payload_store import content_hash
+
+TEXT = "text/plain"
+HTML = "text/html"
+RTF = "text/rtf"
+URI_LIST = "text/uri-list"
+# 除纯文本和图片外, 额外读取和同步的格式
+EXTRA_FORMATS = (HTML, RTF, URI_LIST)
+
+# 不超过该字节数的文本格式直接放在清单中, 省去一次取回
+INLINE_LIMIT = 1024
+# 保留最近多少次变化的清单供取回
+MANIFEST_LIMIT = 8
+
+
+class ClipboardChange:
+    """一次剪贴板变化读到的所有格式
+
+    text: 纯文本; image: ClipboardImage; formats: {内容类型: 文本} (HTML / RTF / 文件列表)
+    """
+
+    def __init__(self, text=None, image=None, formats=None, timestamp=None):
+        self.text = text
+        self.image = image
+        self.formats = formats or {}
+        self.timestamp = timestamp
+
+    def text_formats(self):
+        """全部文本类格式 (含纯文本)"""
+        formats = dict(self.formats)
+        if self.text is not None:
+            formats[TEXT] = self.text
+        return formats
+
+    def describe(self):
+        """日志中显示的格式列表"""
+        names = []
+        if self.image is not None:
+            names.append(f"图片 {self.image.size[0]}x{self.image.size[1]}")
+        if self.text is not None:
+            names.append(f"文本 {len(self.text)} 字符")
+        names.extend({HTML: "HTML", RTF: "RTF", URI_LIST: "文件列表"}.get(name, name) for name in self.formats)
+        return ", ".join(names)
+
+
+def file_uri_paths(uri_list):
+    """text/uri-list 中的本地文件路径 (忽略注释行和非 file: 地址)"""
+    # urllib.request 会连带导入 http.client 和 email, 只在用到时导入
+    from urllib.request import url2pathname
+
+    paths = []
+    for line in uri_list.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        url = urlparse(line)
+        if url.scheme == "file":
+            location = f"//{url.netloc}{url.path}" if url.netloc else url.path
+            paths.append(url2pathname(unquote(location)))
+    return paths
+
+
+def describe_files(uri_list, file_service=None):
+    """文件列表中各文件的名称和大小 (目录或无法访问的文件大小为 None)
+
+    指定 file_service 时登记普通文件, 描述中带可在文件通道上取回的 "id"。
+    """
+    files = []
+    for path in file_uri_paths(uri_list):
+        entry = {"name": os.path.basename(path.rstrip("\\/")) or path, "size": None}
+        try:
+            if os.path.isfile(path):
+                entry["size"] = os.path.getsize(path)
+                if file_service is not None:
+                    entry["id"] = file_service.register(path)
+        except OSError:
+            pass
+        files.append(entry)
+    return files
+
+
+class Manifest:
+    """一次剪贴板变化的清单
+
+    文本类格式保留数据本身 (负载存储淘汰后仍可取回), 图片保留 ClipboardImage,
+    各规格的编码结果由 ClipboardImage 缓存, 多个客户端取回同一规格只编码一次。
+    """
+
+    def __init__(self, manifest_id, change, payload_store, file_service=None):
+        self.id = manifest_id
+        self.timestamp = change.timestamp
+        self.image = change.image
+        # 内容类型 -> (哈希, 数据, 字节数)
+        self.formats = {}
+        for content_type, data in change.text_formats().items():
+            raw = data.encode('utf-8')
+            digest = payload_store.put(content_type, data, content_hash(raw))
+            self.formats[content_type] = (digest, data, len(raw))
+        self.files = None
+        if URI_LIST in change.formats:
+            self.files = describe_files(change.formats[URI_LIST], file_service)
+
+    def entries(self, image_spec=None, accepts=None):
+        """清单中的格式描述; image_spec 为该客户端的图片编码规格, accepts 按内容类型筛选格式"""
+        entries = []
+        for content_type, (digest, data, size) in self.formats.items():
+            if accepts is not None and not accepts(content_type):
+                continue
+            entry = {"contentType": content_type, "size": size, "hash": digest}
+            if size <= INLINE_LIMIT:
+                entry["content"] = data
+            if content_type == URI_LIST:
+                entry["files"] = self.files
+            entries.append(entry)
+        if self.image is not None and image_spec is not None:
+            width, height = scaled_size(self.image.size, image_spec.max_dimension)
+            entries.append({"contentType": image_spec.content_type, "width": width, "height": height})
+        return entries
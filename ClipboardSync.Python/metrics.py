@@ -0,0 +1,160 @@
+"""
+运行指标 - 各阶段耗时直方图和计数器
+
+Histogram 使用固定的指数分桶, observe() 只做一次二分查找和几次加法,
+常开也只有微秒级开销; 分位数按分桶上界估算。
+
+阶段 (毫秒):
+  detect     剪贴板变化后读取内容 (grabclipboard / 读取文本) 和计算指纹
+  encode     图片编码 (每种规格第一次编码时记录)
+  compress   文本压缩
+  serialize  按协议构造要发送的字节 (JSON / Base64 / 二进制帧)
+  queueWait  在客户端发送队列中等待
+  send       写入套接字直到发送缓冲排空 (分块传输按整次传输计)
+  ackRtt     投递确认的往返时间 (扣除客户端处理时间)
+  syncLatency 从复制到客户端写入剪贴板的端到端延迟 (已按时钟偏差校正)
+  decode     收到的图片解码并转为位图
+  apply      收到的内容写入本机剪贴板
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# 毫秒分桶上界: 0.05 ms 起每档翻倍, 最后一档约 26 秒
+DEFAULT_BOUNDS_MS = tuple(0.05 * 2 ** i for i in range(20))
+# 字节分桶上界: 64 B 起每档 x4, 最后一档 1 GB
+SIZE_BOUNDS = tuple(64 * 4 ** i for i in range(13))
+
+
+class Histogram:
+    """固定分桶的直方图 (线程安全)"""
+
+    def __init__(self, bounds=DEFAULT_BOUNDS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def percentile(self, pct):
+        """估算分位数: 累计数达到 pct% 的分桶上界 (最后一档用最大值)"""
+        if not self.count:
+            return None
+        target = pct / 100.0 * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                bound = self.bounds[index] if index < len(self.bounds) else self.max
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        with self._lock:
+            if not self.count:
+                return {"count": 0}
+            return {
+                "count": self.count,
+                "avg": round(self.total / self.count, 3),
+                "min": round(self.min, 3),
+                "max": round(self.max, 3),
+                "p50": round(self.percentile(50), 3),
+                "p90": round(self.percentile(90), 3),
+                "p99": round(self.percentile(99), 3),
+            }
+
+
+class Metrics:
+    """直方图和计数器的集合"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, bounds=DEFAULT_BOUNDS_MS):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, Histogram(bounds))
+        return histogram
+
+    def observe(self, name, value):
+        self.histogram(name).observe(value)
+
+    def observe_since(self, name, started):
+        """记录从 time.perf_counter() 值 started 到现在的毫秒数"""
+        self.histogram(name).observe((time.perf_counter() - started) * 1000)
+
+    @contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_since(name, started)
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            histograms = dict(self._histograms)
+            counters = dict(self._counters)
+        return {
+            "uptimeSeconds": round(time.time() - self.started_at, 1),
+            "stages": {name: histogram.snapshot() for name, histogram in sorted(histograms.items())},
+            "counters": counters,
+        }
+
+
+def format_stats(stats):
+    """把 SyncServer.get_stats() 的结果格式化为多行文本 (界面显示用)"""
+    lines = [f"运行时间: {stats.get('uptimeSeconds', 0):.0f} s    端口: {stats.get('port')}", ""]
+    lines.append(f"{'阶段':<12}{'次数':>8}{'平均':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'最大':>10}")
+    for name, stage in stats.get("stages", {}).items():
+        if not stage.get("count"):
+            continue
+        lines.append(
+            f"{name:<12}{stage['count']:>8}{stage['avg']:>10.2f}{stage['p50']:>10.2f}"
+            f"{stage['p90']:>10.2f}{stage['p99']:>10.2f}{stage['max']:>10.2f}"
+        )
+    lines.append("")
+
+    counters = stats.get("counters", {})
+    if counters:
+        lines.append("    ".join(f"{name}: {value}" for name, value in sorted(counters.items())))
+        lines.append("")
+
+    for client in stats.get("clients", []):
+        lines.append(
+            f"{'🔗' if client.get('peerId') else '📱'} {client['address']}  队列 {client['queueDepth']}/{client['maxQueue']} (最高 {client['maxQueueDepth']})  "
+            f"发送 {client['itemsSent']} 条 / {client['bytesSent']} B  接收 {client['itemsReceived']} 条 / "
+            f"{client['bytesReceived']} B  丢弃 {client['itemsDropped']}  延迟 {client['avgLatencyMs']} ms"
+            + (f"  🔒 {client['encryption']}" if client.get("encryption") else "")
+        )
+        if client.get("acksEnabled"):
+            lines.append(
+                f"     确认 {client['acksReceived']} 条  未确认 {client['unacked']}  RTT {client['rttMs']} ms  "
+                f"时钟偏差 {client['clockOffsetMs']} ms  端到端 {client['syncLatencyMs']} ms"
+            )
+    if not stats.get("clients"):
+        lines.append("没有已连接的设备")
+    return "\n".join(lines)
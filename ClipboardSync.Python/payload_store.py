@@ -0,0 +1,71 @@
+"""
+负载存储 - 按内容哈希寻址的有界 LRU 缓存
+
+剪贴板内容以 SHA-256 (文本按 UTF-8 编码) 作为标识。服务器保留最近的负载,
+客户端可以用哈希取回; 总大小超过上限时淘汰最久未使用的项。
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def content_hash(data):
+    """计算负载的内容哈希"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+class StoredPayload:
+    """存储中的一项"""
+
+    def __init__(self, content_type, data):
+        self.content_type = content_type
+        self.data = data
+
+    @property
+    def size(self):
+        return len(self.data)
+
+
+class PayloadStore:
+    """按总字节数限制的 LRU 负载存储 (线程安全)"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, content_type, data, digest=None):
+        """存入负载, 返回内容哈希; 单项超过上限时不存储"""
+        if digest is None:
+            digest = content_hash(data)
+        with self._lock:
+            if digest in self._items:
+                self._items.move_to_end(digest)
+                return digest
+            item = StoredPayload(content_type, data)
+            if item.size > self.max_bytes:
+                return digest
+            self._items[digest] = item
+            self.total_bytes += item.size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.total_bytes -= evicted.size
+        return digest
+
+    def get(self, digest):
+        """按哈希取出负载 (并标记为最近使用), 不存在返回 None"""
+        with self._lock:
+            item = self._items.get(digest)
+            if item is not None:
+                self._items.move_to_end(digest)
+            return item
+
+    def __contains__(self, digest):
+        return digest in self._items
+
+    def __len__(self):
+        return len(self._items)
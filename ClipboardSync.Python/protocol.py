@@ -0,0 +1,690 @@
+"""
+同步协议 - 消息编码与解析
+
+支持两种线上格式:
+  - 协议 0 (JSON 行): 每条消息一行 JSON, 图片以 Base64 放在 content 中。
+    这是未协商时的默认格式, 兼容现有 Android 客户端。
+  - 协议 1 (二进制帧): 固定 18 字节帧头 + 原始负载, 图片无需 Base64。
+
+握手: 客户端连接后发送 {"type": "hello", "protocolVersions": [1]},
+服务器回复 {"type": "hello", "protocolVersion": N} (均为 JSON 行),
+之后服务器按协商的版本发送消息。客户端收到回复后才能切换到二进制帧。
+握手中还可声明 "imageFormats" (如 ["image/webp", "image/png"]) 和 "screenSize" ([宽, 高]),
+服务器据此为该客户端选择图片格式并缩小超出屏幕的图片; 未声明时只发送原尺寸 PNG。
+"accept"、"maxSize" 和 "imageSize" 声明订阅, 只接收需要的内容 (见 subscription.py)。
+
+二进制帧头 (大端):
+  magic(2s) = b"CS" | version(B) | frameType(B) | contentType(B) | flags(B) | length(I) | timestamp(Q)
+
+超过 CHUNK_THRESHOLD 的剪贴板内容以分块帧 (FRAME_CHUNK) 发送, 负载前带
+transferId(I) | chunkIndex(I) | totalLength(Q), 最后一块设置 FLAG_LAST_CHUNK。
+发送方可用 {"type": "cancel", "transferId": N} 取消未完成的传输。
+
+内容去重: 剪贴板内容以 SHA-256 标识 (JSON 消息带 "hash" 字段, 二进制帧由接收方自行计算)。
+客户端发送 {"type": "cache", "hashes": [...], "evicted": [...]} 声明本地已缓存的内容后,
+服务器对这些内容只发送 {"type": "clipboardRef", "contentType": ..., "hash": ...};
+客户端缓存丢失时可发送 {"type": "fetch", "hash": ...} 重新取回完整内容。
+
+压缩: 客户端在握手中声明 "compression": ["zstd", "zlib"], 服务器在回复中给出选定的算法。
+超过阈值的文本压缩后发送: 二进制帧设置 FLAG_ZLIB / FLAG_ZSTD 标志,
+JSON 行带 "contentEncoding" 字段且 content 为压缩数据的 Base64。双方都可以发送压缩内容。
+
+历史: 客户端发送 {"type": "historyQuery", "requestId": N, "query": "关键词", "contentType": "image/",
+"beforeId": M, "limit": 50} (字段均可省略) 查询服务器记录的历史, 服务器回复
+{"type": "historyResult", "requestId": N, "items": [...]}, 每项带 id / hash / contentType / source /
+timestamp / size / preview / available; 之后可用 fetch 按 hash 取回完整内容。
+
+投递确认: 握手中声明 "acks": true (可选 "deviceId": "稳定的设备标识") 的客户端,
+每收到一条剪贴板内容或 clipboardRef 后回复 {"type": "ack", "hash": ..., "receivedAt": 毫秒,
+"appliedAt": 毫秒}。服务器据此计算往返时间、时钟偏差和端到端延迟, 未确认的内容在同一
+deviceId 重连时重新发送 (见 delivery.py)。
+
+按需取回: 握手中声明 "manifest": true 的客户端不再收到完整内容, 每次剪贴板变化只收到
+{"type": "manifest", "id": N, "timestamp": ..., "formats": [{"contentType": ..., "size": ..., "hash": ...}, ...]},
+格式包括 text/plain、text/html、text/rtf、text/uri-list (文件列表, 带 "files": [{"name", "size"}])
+和图片 (只有 width / height, 取回时才编码); 不超过 1 KB 的文本格式直接带 "content"。
+粘贴时发送 {"type": "fetch", "manifestId": N, "contentType": ...} 取回该格式的完整内容,
+清单已过期时服务器回复 {"type": "fetchFailed", "manifestId": N, "contentType": ...}。
+文件列表中的每个文件带 "id", 文件内容通过独立的文件通道按范围取回 (端口见握手回复的 "filePort",
+协议见 file_transfer.py), 支持断点续传和按块校验。
+
+中继: 服务器之间的连接在握手中带 "peer": true 和 "nodeId", 每条剪贴板内容前紧跟一条
+{"type": "relay", "origin": ..., "seq": N, "hops": N} (见 relay.py)。
+
+会话: 发给设备的剪贴板内容带单调递增的 "seq" (补发的内容另带 "replayed": true), 客户端重连时
+在握手中带 "epoch" 和 "lastSeq" 取回错过的内容; "keepalive": true 启用 ping / pong 保活 (见 session.py)。
+二进制帧没有位置存放这些字段, 它们放在紧挨着内容帧之前的 JSON 帧 {"type": "item", "seq": N} 中,
+分块传输则在第一块之前; 接收方把它合并回随后的剪贴板消息。
+
+接收方按字节增量切分消息 (StreamFramer): 只解码完整的 JSON 行和帧, 多字节字符跨越两次
+读取也不会出错; 单条消息 (包括分块重组后的内容) 超过 MAX_MESSAGE_SIZE 时抛出 MessageTooLarge。
+以 type / contentType / content 开头的大图片 JSON 行边接收边解码 Base64, 不保留整行文本。
+收到的图片内容统一还原为字节 (JSON 行中的 Base64 会被解码)。
+"""
+
+import base64
+import binascii
+import json
+import re
+import struct
+import time
+
+from compression import ZLIB, ZSTD, timed_decompress
+
+PROTOCOL_JSON = 0
+PROTOCOL_BINARY = 1
+SUPPORTED_PROTOCOL_VERSIONS = (PROTOCOL_BINARY,)
+
+FRAME_MAGIC = b"CS"
+FRAME_HEADER = struct.Struct(">2sBBBBIQ")
+
+# 帧类型
+FRAME_JSON = 0        # 负载为 UTF-8 JSON 控制消息
+FRAME_CLIPBOARD = 1   # 负载为剪贴板内容原始字节
+FRAME_CHUNK = 2       # 负载为分块头 + 剪贴板内容的一段
+
+# 帧标志
+FLAG_LAST_CHUNK = 0x01
+FLAG_ZLIB = 0x02
+FLAG_ZSTD = 0x04
+COMPRESSION_FLAGS = {ZLIB: FLAG_ZLIB, ZSTD: FLAG_ZSTD}
+
+CHUNK_HEADER = struct.Struct(">IIQ")
+CHUNK_SIZE = 64 * 1024
+CHUNK_THRESHOLD = 256 * 1024
+# 接收方允许的单条消息大小上限 (同时进行的分块传输合计也不能超过)
+MAX_MESSAGE_SIZE = 256 * 1024 * 1024
+# 接收方同时进行的分块传输数上限
+MAX_OPEN_TRANSFERS = 4
+# 未完成的 JSON 行超过此长度且是图片消息时, 改为边接收边解码
+STREAM_LINE_THRESHOLD = 64 * 1024
+STREAM_LINE_PREFIX = re.compile(
+    rb'\{\s*"type"\s*:\s*"clipboard"\s*,\s*"contentType"\s*:\s*"(image\\?/[\w.+-]+)"\s*,\s*"content"\s*:\s*"'
+)
+# content 字段之后 (timestamp 等) 允许的最大长度
+STREAM_TAIL_LIMIT = 64 * 1024
+
+# 二进制帧中的内容类型编号
+CONTENT_TYPE_IDS = {
+    "text/plain": 1,
+    "image/png": 2,
+    "image/webp": 3,
+    "image/jpeg": 4,
+    "text/html": 5,
+    "text/rtf": 6,
+    "text/uri-list": 7,
+}
+CONTENT_TYPE_NAMES = {v: k for k, v in CONTENT_TYPE_IDS.items()}
+# 二进制帧中放在内容帧之前的 item 帧里的字段
+ITEM_FIELDS = ("seq", "replayed")
+
+
+class ProtocolError(Exception):
+    """无法解析的协议数据"""
+
+
+class MessageTooLarge(ProtocolError):
+    """消息超过接收方的大小上限 (之后的数据无法再可靠切分, 应断开连接)"""
+
+
+def is_text_content(content_type):
+    return content_type.startswith("text/")
+
+
+def content_matches(content_type, content):
+    """内容与类型相符: 文本类为 str, 其余为 bytes"""
+    return isinstance(content_type, str) and \
+        isinstance(content, str if is_text_content(content_type) else (bytes, bytearray))
+
+
+def message_timestamp(message):
+    """对方消息中的时间戳 (毫秒); 不是数字时为 None (按当前时间处理)"""
+    timestamp = message.get("timestamp")
+    if isinstance(timestamp, bool) or not isinstance(timestamp, int) or timestamp < 0:
+        return None
+    return timestamp
+
+
+def make_clipboard_message(content_type, content, timestamp=None):
+    """构造剪贴板消息
+
+    content: 文本为 str, 图片等二进制内容为 bytes (编码时按协议决定是否 Base64)
+    """
+    if timestamp is None:
+        timestamp = int(time.time() * 1000)
+    return {
+        "type": "clipboard",
+        "contentType": content_type,
+        "content": content,
+        "timestamp": timestamp
+    }
+
+
+def negotiate_protocol(client_versions):
+    """从客户端声明的版本中选出双方都支持的最高版本, 没有则回落到 JSON 行"""
+    if not isinstance(client_versions, list):
+        return PROTOCOL_JSON
+    common = [v for v in client_versions
+              if isinstance(v, int) and not isinstance(v, bool) and v in SUPPORTED_PROTOCOL_VERSIONS]
+    return max(common) if common else PROTOCOL_JSON
+
+
+def make_clipboard_ref(content_type, digest, timestamp=None):
+    """构造缓存引用消息: 客户端已有该内容, 只需按哈希取用"""
+    if timestamp is None:
+        timestamp = int(time.time() * 1000)
+    return {
+        "type": "clipboardRef",
+        "contentType": content_type,
+        "hash": digest,
+        "timestamp": timestamp
+    }
+
+
+def make_history_result(request_id, items):
+    """构造历史查询结果消息"""
+    return {"type": "historyResult", "requestId": request_id, "items": items}
+
+
+def make_ack(digest, received_at, applied_at=None):
+    """构造投递确认消息 (客户端发送, 时间为客户端时钟的毫秒数)"""
+    message = {"type": "ack", "hash": digest, "receivedAt": received_at}
+    if applied_at is not None:
+        message["appliedAt"] = applied_at
+    return message
+
+
+def make_manifest(manifest_id, formats, timestamp):
+    """构造剪贴板变化清单: formats 为各格式的描述 (contentType / size / hash 等)"""
+    return {"type": "manifest", "id": manifest_id, "timestamp": timestamp, "formats": formats}
+
+
+def make_fetch_failed(manifest_id, content_type):
+    """构造取回失败消息 (清单已过期或没有该格式)"""
+    return {"type": "fetchFailed", "manifestId": manifest_id, "contentType": content_type}
+
+
+def make_ping(timestamp=None):
+    """构造保活消息 (对方回复带相同 time 的 pong)"""
+    return {"type": "ping", "time": int(time.time() * 1000) if timestamp is None else timestamp}
+
+
+def make_pong(ping):
+    return {"type": "pong", "time": ping.get("time")}
+
+
+def item_info(message):
+    """剪贴板消息中的会话字段 (seq / replayed)"""
+    return {name: message[name] for name in ITEM_FIELDS if name in message}
+
+
+def make_cancel(transfer_id):
+    """构造取消传输消息"""
+    return {"type": "cancel", "transferId": transfer_id}
+
+
+def make_hello(protocol_version=None, compression=None, file_port=None):
+    """构造握手消息 (服务器回复带 protocolVersion, 客户端请求带 protocolVersions)"""
+    if protocol_version is None:
+        return {"type": "hello", "protocolVersions": list(SUPPORTED_PROTOCOL_VERSIONS)}
+    message = {"type": "hello", "protocolVersion": protocol_version}
+    if compression:
+        message["compression"] = compression
+    if file_port:
+        message["filePort"] = file_port
+    return message
+
+
+def encode_json_line(message):
+    """编码为 JSON 行, bytes 内容转为 Base64"""
+    content = message.get("content")
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        message = dict(message, content=base64.b64encode(content).decode('utf-8'))
+        json_data = json.dumps(message) + "\n"
+    else:
+        json_data = json.dumps(message, ensure_ascii=False) + "\n"
+    return json_data.encode('utf-8')
+
+
+def encode_frame(frame_type, payload, content_type_id=0, flags=0, timestamp=0):
+    """编码一个二进制帧"""
+    header = FRAME_HEADER.pack(
+        FRAME_MAGIC, PROTOCOL_BINARY, frame_type, content_type_id, flags, len(payload), timestamp
+    )
+    return header + payload
+
+
+def encode_binary(message):
+    """编码为二进制帧, 剪贴板内容直接作为负载, 其他消息作为 JSON 帧"""
+    content_type_id = CONTENT_TYPE_IDS.get(message.get("contentType"))
+    if message.get("type") == "clipboard" and content_type_id:
+        content = message["content"]
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        flags = COMPRESSION_FLAGS.get(message.get("contentEncoding"), 0)
+        frame = encode_frame(
+            FRAME_CLIPBOARD, bytes(content), content_type_id, flags, message.get("timestamp", 0)
+        )
+        return encode_item_frame(message) + frame
+
+    payload = encode_json_line(message)[:-1]
+    return encode_frame(FRAME_JSON, payload)
+
+
+def encode_item_frame(message):
+    """内容帧之前的 item 帧 (消息没有会话字段时为空)"""
+    info = item_info(message)
+    if not info:
+        return b""
+    return encode_frame(FRAME_JSON, json.dumps(dict(info, type="item")).encode('utf-8'))
+
+
+def clipboard_payload(message):
+    """返回剪贴板消息的原始负载字节"""
+    content = message["content"]
+    if isinstance(content, str):
+        return content.encode('utf-8')
+    return bytes(content)
+
+
+def should_chunk(message, protocol_version):
+    """二进制协议下的大剪贴板内容需要分块发送"""
+    if protocol_version != PROTOCOL_BINARY or message.get("type") != "clipboard":
+        return False
+    if message.get("contentType") not in CONTENT_TYPE_IDS:
+        return False
+    content = message["content"]
+    # 文本按字符数粗略估计, 避免为判断大小先编码一遍
+    return len(content) > CHUNK_THRESHOLD
+
+
+class OutgoingTransfer:
+    """分块发送的剪贴板内容
+
+    所有二进制客户端共享同一份负载和分块帧, 各自的发送进度由发送方记录;
+    更新的剪贴板内容到来时调用 cancel(), 发送方在块与块之间检查 cancelled 并停止。
+    """
+
+    def __init__(self, transfer_id, message, chunk_size=CHUNK_SIZE):
+        self.transfer_id = transfer_id
+        self.message = message
+        self.chunk_size = chunk_size
+        self.payload = memoryview(clipboard_payload(message))
+        self.content_type_id = CONTENT_TYPE_IDS[message["contentType"]]
+        self.timestamp = message.get("timestamp", 0)
+        self.flags = COMPRESSION_FLAGS.get(message.get("contentEncoding"), 0)
+        self.item_frame = encode_item_frame(message)
+        self.cancelled = False
+
+    @property
+    def total_bytes(self):
+        return len(self.payload)
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-len(self.payload) // self.chunk_size))
+
+    def cancel(self):
+        self.cancelled = True
+
+    def encode_chunk(self, index):
+        """编码第 index 块"""
+        start = index * self.chunk_size
+        data = self.payload[start:start + self.chunk_size]
+        flags = self.flags | (FLAG_LAST_CHUNK if index == self.chunk_count - 1 else 0)
+        chunk_header = CHUNK_HEADER.pack(self.transfer_id, index, len(self.payload))
+        frame = encode_frame(
+            FRAME_CHUNK, chunk_header + data, self.content_type_id, flags, self.timestamp
+        )
+        return self.item_frame + frame if index == 0 else frame
+
+
+def encode_message(message, protocol_version):
+    """按协商的协议版本编码消息"""
+    if protocol_version == PROTOCOL_BINARY:
+        return encode_binary(message)
+    return encode_json_line(message)
+
+
+def compression_codec(flags):
+    """帧标志中的压缩算法, 未压缩返回 None"""
+    for codec, flag in COMPRESSION_FLAGS.items():
+        if flags & flag:
+            return codec
+    return None
+
+
+def decode_frame(header_fields, payload, compression_stats=None):
+    """把二进制帧还原为消息字典 (压缩的内容会被解压)"""
+    magic, version, frame_type, content_type_id, flags, length, timestamp = header_fields
+    if frame_type == FRAME_JSON:
+        return json.loads(bytes(payload).decode('utf-8'))
+    if frame_type == FRAME_CLIPBOARD:
+        content_type = CONTENT_TYPE_NAMES.get(content_type_id)
+        if content_type is None:
+            raise ProtocolError(f"未知内容类型: {content_type_id}")
+        # 分块重组的 bytearray 直接使用, 不再复制一份
+        content = payload if isinstance(payload, (bytes, bytearray)) else bytes(payload)
+        codec = compression_codec(flags)
+        if codec:
+            content = timed_decompress(codec, content, compression_stats)
+        if is_text_content(content_type):
+            content = content.decode('utf-8')
+        return make_clipboard_message(content_type, content, timestamp)
+    raise ProtocolError(f"未知帧类型: {frame_type}")
+
+
+def decode_json_content(message, compression_stats=None):
+    """还原 JSON 行中带 contentEncoding 的压缩内容"""
+    codec = message.pop("contentEncoding")
+    if not isinstance(message.get("content") or "", str):
+        raise ProtocolError("压缩内容不是 Base64 字符串")
+    content = timed_decompress(codec, base64.b64decode(message.get("content") or ""), compression_stats)
+    if is_text_content(message.get("contentType") or ""):
+        content = content.decode('utf-8')
+    message["content"] = content
+    return message
+
+
+class IncomingTransfer:
+    """正在接收的分块传输"""
+
+    def __init__(self, transfer_id, total_bytes):
+        self.transfer_id = transfer_id
+        self.total_bytes = total_bytes
+        self.data = bytearray()
+        self.next_index = 0
+
+    @property
+    def progress(self):
+        return len(self.data) / self.total_bytes if self.total_bytes else 1.0
+
+
+class Base64LineDecoder:
+    """边接收边解码大 JSON 行中 content 字段的 Base64
+
+    只处理 type / contentType / content 依次排在最前面的图片消息 (Android 客户端和本程序发送的格式),
+    content 之后的字段 (timestamp 等) 收齐一行后再按 JSON 解析。
+    """
+
+    def __init__(self, content_type, max_size=MAX_MESSAGE_SIZE):
+        self.content_type = content_type
+        self.max_size = max_size
+        self.data = bytearray()
+        # 不足 4 个字符的 Base64 或被读取边界截断的转义, 留到下一段
+        self.pending = b""
+        self.content_done = False
+        self.tail = bytearray()
+        self.failed = False
+
+    def consume(self, buffer, pos, end):
+        """解析 buffer[pos:end], 返回 (新位置, 是否已到行尾, 完整消息)
+
+        到行尾时返回的位置越过换行; 内容无法解码时消息为 None。
+        """
+        if not self.content_done:
+            quote = buffer.find(b'"', pos, end)
+            stop = end if quote < 0 else quote
+            if not self.failed:
+                self._decode(buffer[pos:stop], final=quote >= 0)
+            if quote < 0:
+                return end, False, None
+            self.content_done = True
+            pos = quote + 1
+
+        newline = buffer.find(b"\n", pos, end)
+        self.tail += buffer[pos:end if newline < 0 else newline]
+        if len(self.tail) > STREAM_TAIL_LIMIT:
+            raise MessageTooLarge("图片消息的附加字段过长")
+        if newline < 0:
+            return end, False, None
+        return newline + 1, True, self._finish()
+
+    def _decode(self, segment, final):
+        text = self.pending + segment
+        if not final and text.endswith(b"\\"):
+            text, self.pending = text[:-1], b"\\"
+        else:
+            self.pending = b""
+        if b"\\" in text:
+            # Base64 中可能出现的 JSON 转义只有 "\/" 和换行
+            text = text.replace(b"\\/", b"/").replace(b"\\n", b"").replace(b"\\r", b"")
+        usable = len(text) if final else len(text) - len(text) % 4
+        self.pending = bytes(text[usable:]) + self.pending
+        try:
+            self.data += binascii.a2b_base64(text[:usable])
+        except binascii.Error:
+            self.failed = True
+            self.data = bytearray()
+            return
+        if len(self.data) > self.max_size:
+            raise MessageTooLarge(f"图片内容超过 {self.max_size} 字节")
+
+    def _finish(self):
+        if self.failed:
+            return None
+        tail = bytes(self.tail).strip()
+        try:
+            if tail.startswith(b","):
+                fields = json.loads(b"{" + tail[1:])
+            elif tail == b"}":
+                fields = {}
+            else:
+                return None
+        except ValueError:
+            return None
+        message = {"type": "clipboard", "contentType": self.content_type, "content": self.data}
+        message.update((key, value) for key, value in fields.items() if key not in message)
+        return message
+
+
+class StreamFramer:
+    """按字节增量切分 JSON 行和二进制帧, 不做解码
+
+    收到的数据追加到一个 bytearray 中, 已切出的部分在每次 feed() 结束时一次性删除;
+    查找换行时记住已扫描到的位置, 大 JSON 行分多次到达也只扫描一遍。
+    超过 stream_threshold 的图片 JSON 行交给 Base64LineDecoder 边收边解码 (None 表示不启用)。
+    """
+
+    def __init__(self, max_message_size=MAX_MESSAGE_SIZE, stream_threshold=STREAM_LINE_THRESHOLD):
+        self.buffer = bytearray()
+        self.max_message_size = max_message_size
+        self.stream_threshold = stream_threshold
+        # 当前未完成的 JSON 行已扫描过的字节数, 以及是否已检查过能否流式解码
+        self.scanned = 0
+        self.stream_checked = False
+        self.decoder = None
+
+    def feed(self, data):
+        """追加数据, 返回完整消息的列表: 每项为 (帧头字段, 负载)
+
+        JSON 行的帧头字段为 None, 负载为该行的 bytes; 流式解码的图片行负载为已解析的消息字典。
+        """
+        buffer = self.buffer
+        buffer += data
+        items = []
+        pos = 0
+        size = len(buffer)
+        view = memoryview(buffer)
+        try:
+            while pos < size:
+                if self.decoder is not None:
+                    pos, finished, message = self.decoder.consume(buffer, pos, size)
+                    if not finished:
+                        break
+                    self.decoder = None
+                    self._line_done()
+                    if message is not None:
+                        items.append((None, message))
+                    continue
+                if buffer[pos] == FRAME_MAGIC[0]:
+                    if size - pos < FRAME_HEADER.size:
+                        break
+                    header_fields = FRAME_HEADER.unpack_from(buffer, pos)
+                    if header_fields[0] != FRAME_MAGIC:
+                        raise ProtocolError("帧头校验失败")
+                    length = header_fields[5]
+                    if length > self.max_message_size:
+                        raise MessageTooLarge(f"帧长度 {length} 超过上限")
+                    end = pos + FRAME_HEADER.size + length
+                    if size < end:
+                        break
+                    items.append((header_fields, bytes(view[pos + FRAME_HEADER.size:end])))
+                    pos = end
+                else:
+                    newline = buffer.find(b"\n", pos + self.scanned)
+                    if newline < 0:
+                        self.scanned = size - pos
+                        start = self._start_stream(buffer, pos)
+                        if start is not None:
+                            pos = start
+                            continue
+                        if self.scanned > self.max_message_size:
+                            raise MessageTooLarge(f"JSON 行超过 {self.max_message_size} 字节")
+                        break
+                    if newline - pos > self.max_message_size:
+                        raise MessageTooLarge(f"JSON 行超过 {self.max_message_size} 字节")
+                    items.append((None, bytes(view[pos:newline])))
+                    pos = newline + 1
+                    self._line_done()
+        finally:
+            view.release()
+            if pos:
+                del buffer[:pos]
+        return items
+
+    def _start_stream(self, buffer, pos):
+        """未完成的 JSON 行足够大时, 检查一次是否为可以流式解码的图片消息, 是则返回 content 值开始的位置"""
+        if self.stream_threshold is None or self.stream_checked or self.scanned < self.stream_threshold:
+            return None
+        self.stream_checked = True
+        match = STREAM_LINE_PREFIX.match(buffer, pos)
+        if match is None:
+            return None
+        content_type = match.group(1).replace(b"\\", b"").decode('ascii')
+        self.decoder = Base64LineDecoder(content_type, self.max_message_size)
+        return match.end()
+
+    def _line_done(self):
+        self.scanned = 0
+        self.stream_checked = False
+
+    @property
+    def pending_bytes(self):
+        return len(self.buffer)
+
+
+class MessageReader:
+    """增量解析收到的字节流
+
+    每条消息按首字节区分格式: 以 b"CS" 开头的是二进制帧, 否则是 JSON 行,
+    因此握手前后无需切换状态。分块帧在这里重组, 取消消息会丢弃未完成的传输。
+    on_progress(transfer) 在每收到一块后调用; 压缩内容在这里解压, 耗时记入 compression_stats。
+    超过 max_message_size 的消息抛出 MessageTooLarge; 超过声明长度、超过同时进行的传输数或
+    合计大小上限的分块传输被丢弃。
+    item 帧的字段合并到随后的剪贴板消息中。
+    """
+
+    def __init__(self, on_progress=None, compression_stats=None, max_message_size=MAX_MESSAGE_SIZE):
+        self.framer = StreamFramer(max_message_size)
+        self.transfers = {}
+        self.pending_item = None
+        self.on_progress = on_progress
+        self.compression_stats = compression_stats
+        self.max_message_size = max_message_size
+
+    def feed(self, data):
+        """追加数据, 返回已完整接收的消息列表"""
+        messages = []
+        for header_fields, payload in self.framer.feed(data):
+            try:
+                if header_fields is None:
+                    if isinstance(payload, dict):
+                        message = self._filter(payload)
+                    elif not payload.strip():
+                        continue
+                    else:
+                        message = self._filter(json.loads(payload.decode('utf-8')))
+                elif header_fields[2] == FRAME_CHUNK:
+                    message = self._feed_chunk(header_fields, payload)
+                else:
+                    message = self._filter(decode_frame(header_fields, payload, self.compression_stats))
+                if message is None:
+                    continue
+                if message.get("type") == "item":
+                    self.pending_item = item_info(message)
+                    continue
+                if message.get("type") == "clipboard" and self.pending_item:
+                    message.update(self.pending_item)
+                    self.pending_item = None
+                messages.append(message)
+            except (ValueError, ProtocolError):
+                pass
+        return messages
+
+    def idle(self):
+        """没有收到一半的消息 (缓冲为空, 没有进行中的流式解码、分块传输或 item 帧)"""
+        framer = self.framer
+        return not framer.buffer and framer.decoder is None and not self.transfers and self.pending_item is None
+
+    def _filter(self, message):
+        """处理传输控制消息, 其余消息原样返回; 不是 JSON 对象的消息 (如 [1, 2]、5) 丢弃"""
+        if not isinstance(message, dict):
+            return None
+        if message.get("type") == "cancel":
+            if isinstance(message.get("transferId"), int):
+                self.transfers.pop(message["transferId"], None)
+            return None
+        if message.get("type") != "clipboard":
+            return message
+        # 内容类型或内容的类型不对的剪贴板消息丢弃 (边接收边解码的图片内容已是 bytes)
+        content = message.get("content")
+        if not isinstance(message.get("contentType") or "text/plain", str) \
+                or not isinstance(content, (str, bytes, bytearray, type(None))):
+            return None
+        if message.get("contentEncoding"):
+            return decode_json_content(message, self.compression_stats)
+        if isinstance(content, str) and not is_text_content(message.get("contentType") or "text/plain"):
+            # JSON 行中的图片等二进制内容为 Base64
+            message["content"] = base64.b64decode(message["content"])
+        return message
+
+    def _feed_chunk(self, header_fields, payload):
+        """追加一块数据, 传输完成时返回完整的剪贴板消息"""
+        if len(payload) < CHUNK_HEADER.size:
+            raise ProtocolError("分块帧长度不足")
+        transfer_id, index, total_bytes = CHUNK_HEADER.unpack_from(payload)
+        transfer = self.transfers.get(transfer_id)
+        if transfer is None:
+            if index != 0:
+                # 开头已被取消、丢失或超过大小上限, 忽略剩余分块
+                return None
+            if len(self.transfers) >= MAX_OPEN_TRANSFERS:
+                raise ProtocolError(f"同时进行的传输超过 {MAX_OPEN_TRANSFERS} 个, 丢弃传输 {transfer_id}")
+            # 每个传输的数据不会超过声明的长度, 声明长度之和即为缓冲的上限
+            buffered = sum(t.total_bytes for t in self.transfers.values())
+            if buffered + total_bytes > self.max_message_size:
+                raise MessageTooLarge(f"传输 {transfer_id} 长度 {total_bytes} 超过上限")
+            transfer = self.transfers[transfer_id] = IncomingTransfer(transfer_id, total_bytes)
+        if index != transfer.next_index:
+            del self.transfers[transfer_id]
+            raise ProtocolError(f"传输 {transfer_id} 分块乱序")
+
+        chunk = payload[CHUNK_HEADER.size:]
+        if len(transfer.data) + len(chunk) > transfer.total_bytes:
+            del self.transfers[transfer_id]
+            raise MessageTooLarge(f"传输 {transfer_id} 超过声明的长度 {transfer.total_bytes}")
+        transfer.data += chunk
+        transfer.next_index += 1
+        if self.on_progress:
+            self.on_progress(transfer)
+
+        flags = header_fields[4]
+        if not flags & FLAG_LAST_CHUNK:
+            return None
+
+        del self.transfers[transfer_id]
+        if len(transfer.data) != transfer.total_bytes:
+            raise ProtocolError(f"传输 {transfer_id} 长度不符")
+        header_fields = header_fields[:2] + (FRAME_CLIPBOARD,) + header_fields[3:]
+        return decode_frame(header_fields, transfer.data, self.compression_stats)
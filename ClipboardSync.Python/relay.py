@@ -0,0 +1,85 @@
+"""
+多机中继 - 服务器之间互相连接, 把剪贴板内容转发到整个网络
+
+每个服务器有一个节点标识 (nodeId)。服务器主动连接配置的其他服务器 (--peer HOST:PORT),
+握手中声明 {"type": "hello", "peer": true, "nodeId": ...}, 对方回复中也带 nodeId。
+中继连接上的剪贴板内容前面总是紧跟一条 {"type": "relay", "origin": 来源节点, "seq": 序号,
+"hops": 已转发次数}; 来源节点每次产生新内容 (本机复制或本机设备发来) 时序号加一。
+
+收到内容时按 (origin, seq) 判断: 自己产生的 (回声)、已见过的或比已见过的更旧的内容都丢弃,
+新内容写入本机剪贴板、原样转发给除来源连接外的其他中继连接和本机设备。
+网络中有环时同一内容会从多条路径到达, 只有第一次被处理, 不会无限转发。
+"""
+
+import itertools
+import secrets
+from collections import OrderedDict
+
+from compression import available_codecs
+from protocol import make_hello
+
+# 最多记录多少个来源节点的最新序号
+ORIGIN_LIMIT = 256
+# 转发次数上限 (防御异常节点)
+MAX_HOPS = 16
+# 中继连接断开后重连的间隔 (秒)
+PEER_RETRY_INTERVAL = 5
+
+
+def new_node_id():
+    return secrets.token_hex(8)
+
+
+def parse_peer(address, default_port=5150):
+    """解析 "host:port" (端口可省略), 返回 (host, port)"""
+    host, sep, port = address.strip().rpartition(":")
+    if not sep:
+        return address.strip(), default_port
+    return host.strip("[]"), int(port)
+
+
+def make_peer_hello(node_id):
+    """构造中继连接的握手请求"""
+    message = make_hello()
+    message.update(compression=list(available_codecs()), peer=True, nodeId=node_id, keepalive=True)
+    return message
+
+
+def valid_relay(relay):
+    """中继头的字段类型是否正确: origin 为字符串, seq / hops 为非负整数"""
+    return isinstance(relay.get("origin"), str) and all(
+        isinstance(relay.get(name), int) and not isinstance(relay.get(name), bool) and relay.get(name) >= 0
+        for name in ("seq", "hops"))
+
+
+def make_relay(origin, seq, hops=0):
+    """构造中继头 (紧接着发送的剪贴板内容来自 origin 的第 seq 条)"""
+    return {"type": "relay", "origin": origin, "seq": seq, "hops": hops}
+
+
+class OriginTracker:
+    """本节点的序号和各来源节点已见过的最新序号
+
+    next_seq() 可从任意线程调用, accept() 只在事件循环线程中调用。
+    """
+
+    def __init__(self, node_id=None, limit=ORIGIN_LIMIT):
+        self.node_id = node_id or new_node_id()
+        self.limit = limit
+        self.seqs = itertools.count(1)
+        self.latest = OrderedDict()
+
+    def next_seq(self):
+        return next(self.seqs)
+
+    def accept(self, origin, seq):
+        """(origin, seq) 是否为需要处理的新内容; 是则记录为该来源的最新序号"""
+        if origin == self.node_id or not isinstance(origin, str) or not isinstance(seq, int):
+            return False
+        if seq <= self.latest.get(origin, 0):
+            return False
+        self.latest[origin] = seq
+        self.latest.move_to_end(origin)
+        while len(self.latest) > self.limit:
+            self.latest.popitem(last=False)
+        return True
@@ -0,0 +1,441 @@
+"""
+加密通道 - 基于配对密钥的认证加密, 重连时用会话票据跳过密钥交换
+
+配对: 服务器为每台设备生成一个随机的 32 字节配对密钥, 以配对码 "clipsync:<配对ID>:<密钥>"
+的形式交给设备 (只显示一次), 保存在数据目录的 pairings.json 中。
+
+握手仍是一次 JSON 行往返, 客户端在 hello 中带 "secure":
+  - 完整握手: {"pairId", "ciphers", "nonce", "key": X25519 临时公钥}
+  - 恢复会话: {"pairId", "ciphers", "nonce", "ticket": 上次握手得到的票据}, 不做密钥交换
+服务器回复的 hello 中带 "secure": {"cipher", "nonce", "key" (仅完整握手), "resumed",
+"ticket", "ticketLifetime", "proof"}。密钥由 HKDF-SHA256 从 (密钥交换结果或票据密钥, 配对密钥,
+双方随机数) 派生, 不知道配对密钥就无法得到; "proof" 让客户端确认服务器持有同一配对密钥。
+票据只能使用一次, 每次握手都会发放新票据; 服务器不认识的票据回复 {"error": "unknownTicket"},
+连接保持明文状态, 客户端可在同一连接上重新发起完整握手。其他错误回复后断开连接。
+
+回复之后双方的所有数据都以记录发送: 4 字节大端密文长度 + AEAD 密文
+(aes-256-gcm 或 chacha20-poly1305, 每个方向独立密钥, 随机数为记录序号), 内层仍是 JSON 行或二进制帧。
+认证失败的记录导致断开连接。
+
+需要可选依赖 cryptography (首次握手时才导入), 未安装时服务器不接受加密握手。
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import struct
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+AES_GCM = "aes-256-gcm"
+CHACHA20_POLY1305 = "chacha20-poly1305"
+
+PAIRING_PREFIX = "clipsync"
+KEY_SIZE = 32
+NONCE_SIZE = 16
+TAG_SIZE = 16
+RECORD_HEADER = struct.Struct(">I")
+# 单条记录的明文上限, 更长的写入拆成多条记录
+MAX_RECORD_SIZE = 256 * 1024
+# 票据有效期 (秒) 和服务器最多保留的票据数
+TICKET_LIFETIME = 24 * 3600
+TICKET_LIMIT = 256
+
+# 握手错误码
+UNSUPPORTED = "unsupported"
+UNKNOWN_PAIRING = "unknownPairing"
+UNKNOWN_TICKET = "unknownTicket"
+BAD_OFFER = "badOffer"
+
+
+class SecureChannelError(ValueError):
+    """握手失败或收到无法认证的数据; code 为回复给对方的错误码"""
+
+    def __init__(self, message, code=BAD_OFFER):
+        super().__init__(message)
+        self.code = code
+
+
+_crypto = None
+
+
+def _load_crypto():
+    """首次用到时才导入 cryptography (约 18 ms), 不使用加密时启动不受影响; 未安装时返回 None"""
+    global _crypto
+    if _crypto is None:
+        try:
+            from cryptography.exceptions import InvalidTag
+            from cryptography.hazmat.primitives import hashes, serialization
+            from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+            from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+            from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+        except ImportError:
+            _crypto = False
+        else:
+            _crypto = SimpleNamespace(
+                InvalidTag=InvalidTag, hashes=hashes, serialization=serialization, X25519PrivateKey=X25519PrivateKey,
+                X25519PublicKey=X25519PublicKey, AESGCM=AESGCM, ChaCha20Poly1305=ChaCha20Poly1305, HKDF=HKDF)
+    return _crypto or None
+
+
+def available_ciphers():
+    """本机支持的 AEAD 算法, 按优先级排列"""
+    if _load_crypto() is None:
+        return ()
+    return (AES_GCM, CHACHA20_POLY1305)
+
+
+def negotiate_cipher(client_ciphers):
+    """选出双方都支持的最优算法, 没有则返回 None"""
+    if not isinstance(client_ciphers, list):
+        return None
+    for cipher in available_ciphers():
+        if cipher in client_ciphers:
+            return cipher
+    return None
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode('ascii')
+
+
+def _b64decode(text, size=None):
+    """解码无填充的 URL 安全 Base64; 长度不符时抛出 SecureChannelError"""
+    if not isinstance(text, str):
+        raise SecureChannelError("Base64 格式错误")
+    try:
+        data = base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+    except ValueError:
+        raise SecureChannelError("Base64 格式错误")
+    if size is not None and len(data) != size:
+        raise SecureChannelError("长度不符")
+    return data
+
+
+class Pairing:
+    """一台设备 (或另一个服务器) 的配对: 配对 ID、名称和 32 字节密钥"""
+
+    def __init__(self, pair_id, key, name="", created=None):
+        self.id = pair_id
+        self.key = key
+        self.name = name
+        self.created = created or int(time.time() * 1000)
+
+    @classmethod
+    def generate(cls, name=""):
+        return cls(secrets.token_hex(4), secrets.token_bytes(KEY_SIZE), name)
+
+    @property
+    def code(self):
+        """交给设备的配对码"""
+        return f"{PAIRING_PREFIX}:{self.id}:{_b64encode(self.key)}"
+
+    @classmethod
+    def parse(cls, code):
+        """解析配对码, 格式错误时抛出 SecureChannelError"""
+        prefix, _, rest = code.strip().partition(":")
+        pair_id, _, key = rest.partition(":")
+        if prefix != PAIRING_PREFIX or not pair_id or not key:
+            raise SecureChannelError(f"配对码格式错误: {code}")
+        return cls(pair_id, _b64decode(key, KEY_SIZE))
+
+    def to_dict(self):
+        return {"id": self.id, "name": self.name, "key": _b64encode(self.key), "created": self.created}
+
+
+class PairingStore:
+    """已配对的设备 (线程安全); 指定 path 时保存到 JSON 文件"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.pairings = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for entry in json.load(f).get("pairings", []):
+                    pairing = Pairing(entry["id"], _b64decode(entry["key"], KEY_SIZE),
+                                      entry.get("name", ""), entry.get("created"))
+                    self.pairings[pairing.id] = pairing
+
+    def __len__(self):
+        return len(self.pairings)
+
+    def get(self, pair_id):
+        return self.pairings.get(pair_id)
+
+    def list(self):
+        return list(self.pairings.values())
+
+    def create(self, name=""):
+        """生成并保存一个新配对"""
+        pairing = Pairing.generate(name)
+        with self._lock:
+            self.pairings[pairing.id] = pairing
+            self._save()
+        return pairing
+
+    def remove(self, pair_id):
+        """取消配对, 该设备的票据随之失效; 返回是否存在"""
+        with self._lock:
+            removed = self.pairings.pop(pair_id, None) is not None
+            if removed:
+                self._save()
+        return removed
+
+    def _save(self):
+        if not self.path:
+            return
+        temp_path = self.path + ".tmp"
+        data = {"pairings": [pairing.to_dict() for pairing in self.pairings.values()]}
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        try:
+            os.chmod(temp_path, 0o600)
+        except OSError:
+            pass
+        os.replace(temp_path, self.path)
+
+
+class Ticket:
+    """会话票据: 票据 ID、所属配对和恢复密钥"""
+
+    def __init__(self, ticket_id, pair_id, secret, expires):
+        self.id = ticket_id
+        self.pair_id = pair_id
+        self.secret = secret
+        self.expires = expires
+
+
+class TicketStore:
+    """服务器发放的票据, 每张只能使用一次, 过期或超出数量时淘汰最旧的"""
+
+    def __init__(self, lifetime=TICKET_LIFETIME, limit=TICKET_LIMIT):
+        self.lifetime = lifetime
+        self.limit = limit
+        self.tickets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def issue(self, pair_id, secret):
+        ticket = Ticket(secrets.token_hex(12), pair_id, secret, time.monotonic() + self.lifetime)
+        with self._lock:
+            self.tickets[ticket.id] = ticket
+            while len(self.tickets) > self.limit:
+                self.tickets.popitem(last=False)
+        return ticket
+
+    def redeem(self, ticket_id, pair_id):
+        """取出并作废票据; 不存在、已过期或不属于该配对时返回 None"""
+        with self._lock:
+            ticket = self.tickets.pop(ticket_id, None)
+        if ticket is None or ticket.pair_id != pair_id or ticket.expires < time.monotonic():
+            return None
+        return ticket
+
+
+class RecordSealer:
+    """发送方向: 把任意长度的数据加密为记录"""
+
+    def __init__(self, cipher, key, max_record_size=MAX_RECORD_SIZE):
+        self.aead = _make_aead(cipher, key)
+        self.max_record_size = max_record_size
+        self.counter = 0
+
+    def seal(self, data):
+        """返回要依次写出的字节片段 (记录头和密文交替)"""
+        pieces = []
+        view = memoryview(data)
+        for start in range(0, len(view), self.max_record_size):
+            ciphertext = self.aead.encrypt(_record_nonce(self.counter), view[start:start + self.max_record_size], None)
+            self.counter += 1
+            pieces.append(RECORD_HEADER.pack(len(ciphertext)))
+            pieces.append(ciphertext)
+        return pieces
+
+
+class RecordOpener:
+    """接收方向: 从字节流中切出记录并解密"""
+
+    def __init__(self, cipher, key, max_record_size=MAX_RECORD_SIZE):
+        self.aead = _make_aead(cipher, key)
+        self.max_record_size = max_record_size
+        self.counter = 0
+        self.buffer = bytearray()
+
+    def open(self, data):
+        """追加收到的数据, 返回已完整收到的记录的明文 (可能为空); 认证失败时抛出 SecureChannelError"""
+        buffer = self.buffer
+        buffer += data
+        plaintext = []
+        pos = 0
+        view = memoryview(buffer)
+        try:
+            while len(buffer) - pos >= RECORD_HEADER.size:
+                (length,) = RECORD_HEADER.unpack_from(buffer, pos)
+                if length < TAG_SIZE or length > self.max_record_size + TAG_SIZE:
+                    raise SecureChannelError(f"记录长度 {length} 不合法")
+                end = pos + RECORD_HEADER.size + length
+                if end > len(buffer):
+                    break
+                try:
+                    plaintext.append(self.aead.decrypt(_record_nonce(self.counter),
+                                                       view[pos + RECORD_HEADER.size:end], None))
+                except _crypto.InvalidTag:
+                    raise SecureChannelError("记录认证失败")
+                self.counter += 1
+                pos = end
+        finally:
+            view.release()
+            del buffer[:pos]
+        return b"".join(plaintext)
+
+
+def _make_aead(cipher, key):
+    crypto = _load_crypto()
+    if cipher == AES_GCM and crypto is not None:
+        return crypto.AESGCM(key)
+    if cipher == CHACHA20_POLY1305 and crypto is not None:
+        return crypto.ChaCha20Poly1305(key)
+    raise SecureChannelError(f"不支持的加密算法: {cipher}", UNSUPPORTED)
+
+
+def _record_nonce(counter):
+    # 每个方向独立密钥, 记录序号即可保证随机数不重复
+    return b"\0\0\0\0" + counter.to_bytes(8, "big")
+
+
+def _derive(pairing_key, secret, label, transcript):
+    """派生 (客户端发送密钥, 服务器发送密钥, 下一张票据的恢复密钥, 确认密钥)"""
+    hkdf = _crypto.HKDF(algorithm=_crypto.hashes.SHA256(), length=KEY_SIZE * 4, salt=pairing_key,
+                info=b"clipsync " + label + b" " + hashlib.sha256(b"".join(transcript)).digest())
+    material = hkdf.derive(secret)
+    return [material[i:i + KEY_SIZE] for i in range(0, len(material), KEY_SIZE)]
+
+
+def _proof(finished_key):
+    return _b64encode(hmac.new(finished_key, b"server finished", hashlib.sha256).digest())
+
+
+def _public_bytes(private_key):
+    serialization = _crypto.serialization
+    return private_key.public_key().public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+
+
+class SecureSession:
+    """握手完成后的一条加密连接; ticket 为客户端下次恢复会话用的票据 (ID, 恢复密钥)"""
+
+    def __init__(self, pairing, cipher, sealer, opener, resumed, ticket=None):
+        self.pairing = pairing
+        self.cipher = cipher
+        self.sealer = sealer
+        self.opener = opener
+        self.resumed = resumed
+        self.ticket = ticket
+        # 服务器一侧: 放入 hello 回复的 "secure" 字段
+        self.reply = None
+
+
+def accept_offer(offer, pairings, tickets):
+    """服务器处理客户端 hello 中的 "secure", 返回 SecureSession; 失败时抛出 SecureChannelError"""
+    if not available_ciphers():
+        raise SecureChannelError("未安装 cryptography, 不支持加密连接", UNSUPPORTED)
+    # 对方发来的标识都用作字典的键, 不是字符串时 (如列表) 无法查找
+    if not isinstance(offer, dict) or not isinstance(offer.get("pairId"), str) \
+            or not isinstance(offer.get("ticket") or "", str):
+        raise SecureChannelError("握手格式错误")
+    pairing = pairings.get(offer.get("pairId"))
+    if pairing is None:
+        raise SecureChannelError(f"未配对的设备: {offer.get('pairId')}", UNKNOWN_PAIRING)
+    cipher = negotiate_cipher(offer.get("ciphers"))
+    if cipher is None:
+        raise SecureChannelError("没有双方都支持的加密算法", UNSUPPORTED)
+    client_nonce = _b64decode(offer.get("nonce") or "", NONCE_SIZE)
+    server_nonce = secrets.token_bytes(NONCE_SIZE)
+    reply = {"cipher": cipher, "nonce": _b64encode(server_nonce)}
+
+    ticket_id = offer.get("ticket")
+    if ticket_id:
+        ticket = tickets.redeem(ticket_id, pairing.id)
+        if ticket is None:
+            raise SecureChannelError("票据无效或已过期", UNKNOWN_TICKET)
+        keys = _derive(pairing.key, ticket.secret, b"resume",
+                       [cipher.encode(), ticket.id.encode(), client_nonce, server_nonce])
+    else:
+        client_key = _b64decode(offer.get("key") or "", KEY_SIZE)
+        private_key = _crypto.X25519PrivateKey.generate()
+        try:
+            shared = private_key.exchange(_crypto.X25519PublicKey.from_public_bytes(client_key))
+        except ValueError:
+            raise SecureChannelError("密钥交换失败")
+        server_key = _public_bytes(private_key)
+        reply["key"] = _b64encode(server_key)
+        keys = _derive(pairing.key, shared, b"full", [cipher.encode(), client_nonce, server_nonce, client_key, server_key])
+
+    client_write, server_write, resume_secret, finished = keys
+    ticket = tickets.issue(pairing.id, resume_secret)
+    reply.update(resumed=bool(ticket_id), ticket=ticket.id, ticketLifetime=tickets.lifetime,
+                 proof=_proof(finished))
+    session = SecureSession(pairing, cipher, RecordSealer(cipher, server_write),
+                            RecordOpener(cipher, client_write), bool(ticket_id))
+    session.reply = reply
+    return session
+
+
+class ClientHandshake:
+    """客户端一侧的握手 (中继连接和测试客户端使用)
+
+    ticket 为上次握手得到的 (票据 ID, 恢复密钥), 有票据时发起恢复会话, 不做密钥交换。
+    """
+
+    def __init__(self, pairing, ticket=None, ciphers=None):
+        if not available_ciphers():
+            raise SecureChannelError("未安装 cryptography, 不支持加密连接", UNSUPPORTED)
+        self.pairing = pairing
+        self.ticket = ticket
+        self.ciphers = list(ciphers or available_ciphers())
+        self.nonce = secrets.token_bytes(NONCE_SIZE)
+        self.private_key = None if ticket else _crypto.X25519PrivateKey.generate()
+
+    def offer(self):
+        """放入 hello 的 "secure" 字段"""
+        offer = {"pairId": self.pairing.id, "ciphers": self.ciphers, "nonce": _b64encode(self.nonce)}
+        if self.ticket:
+            offer["ticket"] = self.ticket[0]
+        else:
+            offer["key"] = _b64encode(_public_bytes(self.private_key))
+        return offer
+
+    def finish(self, reply):
+        """处理服务器回复的 "secure", 返回 SecureSession; 失败时抛出 SecureChannelError"""
+        if not isinstance(reply, dict):
+            raise SecureChannelError("服务器没有接受加密握手")
+        if reply.get("error"):
+            raise SecureChannelError(f"服务器拒绝加密握手: {reply['error']}", reply["error"])
+        cipher = reply.get("cipher")
+        if cipher not in self.ciphers:
+            raise SecureChannelError(f"服务器选择了未提供的加密算法: {cipher}", UNSUPPORTED)
+        server_nonce = _b64decode(reply.get("nonce") or "", NONCE_SIZE)
+        if self.ticket:
+            if not reply.get("resumed"):
+                raise SecureChannelError("服务器没有恢复会话")
+            keys = _derive(self.pairing.key, self.ticket[1], b"resume",
+                           [cipher.encode(), self.ticket[0].encode(), self.nonce, server_nonce])
+        else:
+            server_key = _b64decode(reply.get("key") or "", KEY_SIZE)
+            try:
+                shared = self.private_key.exchange(_crypto.X25519PublicKey.from_public_bytes(server_key))
+            except ValueError:
+                raise SecureChannelError("密钥交换失败")
+            keys = _derive(self.pairing.key, shared, b"full",
+                           [cipher.encode(), self.nonce, server_nonce, _public_bytes(self.private_key), server_key])
+
+        client_write, server_write, resume_secret, finished = keys
+        if not hmac.compare_digest(str(reply.get("proof")), _proof(finished)):
+            raise SecureChannelError("服务器未能证明持有配对密钥")
+        ticket = (reply["ticket"], resume_secret) if reply.get("ticket") else None
+        return SecureSession(self.pairing, cipher, RecordSealer(cipher, client_write),
+                             RecordOpener(cipher, server_write), bool(self.ticket), ticket)
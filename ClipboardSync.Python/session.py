@@ -0,0 +1,85 @@
+"""
+会话恢复与保活 - 设备短暂断线后补发错过的内容, 及时发现已失联的连接
+
+服务器发给设备的每条剪贴板内容 (完整内容、clipboardRef 或清单) 都带单调递增的 "seq",
+最近的内容保存在有界的 Backlog 中。握手中声明 "session": true 的客户端会在回复中收到
+"epoch" (服务器本次运行的标识) 和当前的 "seq"; 重连时在握手中带上 "epoch" 和最后收到的
+"lastSeq", 服务器只补发之后的内容 (带 "replayed": true), epoch 不同 (服务器已重启) 时不补发。
+
+握手中声明 "keepalive": true 的连接, 服务器每隔 KEEPALIVE_INTERVAL 秒发送
+{"type": "ping", "time": 毫秒}, 客户端应回复 {"type": "pong", "time": 原值};
+超过 KEEPALIVE_TIMEOUT 秒既没有收到任何数据、发送缓冲也没有排出数据时断开连接。
+客户端发送的 ping 同样会立即收到 pong。
+"""
+
+import itertools
+import secrets
+import threading
+from collections import deque
+
+# 最多保留的内容条数和字节数 (图片按解码后的像素估算)
+BACKLOG_LIMIT = 64
+BACKLOG_BYTES = 64 * 1024 * 1024
+# 保活间隔和判定失联的时长 (秒)
+KEEPALIVE_INTERVAL = 5
+KEEPALIVE_TIMEOUT = 15
+
+
+def new_epoch():
+    return secrets.token_hex(4)
+
+
+class BacklogItem:
+    """一条发给设备的内容
+
+    content: 文本为 str, 收到的图片等为 bytes, 本机复制的图片为 ClipboardImage (补发时按客户端规格编码)
+    """
+
+    def __init__(self, seq, content_type, content, timestamp):
+        self.seq = seq
+        self.content_type = content_type
+        self.content = content
+        self.timestamp = timestamp
+
+    @property
+    def size(self):
+        if isinstance(self.content, str):
+            return len(self.content) * 2
+        if isinstance(self.content, (bytes, bytearray)):
+            return len(self.content)
+        width, height = self.content.size
+        return width * height * 4
+
+
+class Backlog:
+    """最近发给设备的内容 (线程安全), 按条数和字节数淘汰最旧的"""
+
+    def __init__(self, limit=BACKLOG_LIMIT, max_bytes=BACKLOG_BYTES):
+        self.limit = limit
+        self.max_bytes = max_bytes
+        self.epoch = new_epoch()
+        self.items = deque()
+        self.total_bytes = 0
+        self.seqs = itertools.count(1)
+        self.latest_seq = 0
+        self._lock = threading.Lock()
+
+    def add(self, content_type, content, timestamp):
+        """记录一条新内容, 返回分配的序号"""
+        with self._lock:
+            item = BacklogItem(next(self.seqs), content_type, content, timestamp)
+            self.latest_seq = item.seq
+            self.items.append(item)
+            self.total_bytes += item.size
+            while self.items and (len(self.items) > self.limit or self.total_bytes > self.max_bytes):
+                self.total_bytes -= self.items.popleft().size
+            return item.seq
+
+    def since(self, epoch, last_seq):
+        """返回 (序号大于 last_seq 的内容, 已被淘汰而无法补发的条数); epoch 不符时不补发"""
+        with self._lock:
+            if epoch != self.epoch or not isinstance(last_seq, int) or last_seq >= self.latest_seq:
+                return [], 0
+            items = [item for item in self.items if item.seq > last_seq]
+            first = items[0].seq if items else self.latest_seq + 1
+        return items, max(0, first - last_seq - 1)
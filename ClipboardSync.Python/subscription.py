@@ -0,0 +1,91 @@
+"""
+订阅过滤 - 每个客户端只接收自己声明需要的内容
+
+客户端在 hello 中 (或之后随时发送 {"type": "subscribe", ...}) 声明:
+  - "accept": 接收的内容类型, 可用 "image/*"、"text/*" 通配, 省略表示全部接收, 空列表表示都不接收
+  - "maxSize": 单条内容的字节数上限 (图片按该客户端的编码结果计算), 省略表示不限
+  - "imageSize": 希望收到的图片尺寸 [宽, 高] 或最长边, 省略时使用 "screenSize"
+subscribe 消息整体替换之前的订阅, 省略的字段恢复为不限制。握手回复中的 "subscription" 为生效的订阅。
+
+不符合订阅的实时内容和补发内容不会发给该客户端; 客户端按哈希或清单主动取回的内容不受限制。
+订阅相同的客户端共享同一份图片编码和消息编码。
+"""
+
+WILDCARD = "*/*"
+
+
+def payload_size(content):
+    """内容的字节数 (文本按 UTF-8 计算)"""
+    if isinstance(content, str):
+        return len(content.encode('utf-8'))
+    return len(content)
+
+
+def _positive_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
+
+
+def _image_size(value):
+    if _positive_number(value):
+        return (int(value), int(value))
+    if isinstance(value, list) and len(value) == 2 and all(_positive_number(v) for v in value):
+        return (int(value[0]), int(value[1]))
+    return None
+
+
+class Subscription:
+    """一个客户端的订阅: 接收的内容类型、大小上限和希望的图片尺寸"""
+
+    def __init__(self, content_types=None, max_size=None, image_size=None):
+        # None 表示全部接收, 空元组表示都不接收
+        self.content_types = tuple(content_types) if content_types is not None else None
+        self.max_size = max_size
+        self.image_size = image_size
+
+    @classmethod
+    def from_message(cls, message):
+        """从 hello / subscribe 消息中读取订阅, 格式不对的字段视为不限制
+
+        "accept" 为列表时只保留其中的字符串; 空列表或没有有效元素的列表表示都不接收。
+        """
+        accept = message.get("accept")
+        content_types = [t for t in accept if isinstance(t, str)] if isinstance(accept, list) else None
+        max_size = message.get("maxSize")
+        if not isinstance(max_size, int) or isinstance(max_size, bool) or max_size <= 0:
+            max_size = None
+        return cls(content_types, max_size, _image_size(message.get("imageSize")))
+
+    @property
+    def key(self):
+        return self.content_types, self.max_size, self.image_size
+
+    @property
+    def unrestricted(self):
+        return self.key == (None, None, None)
+
+    def accepts_type(self, content_type):
+        if self.content_types is None:
+            return True
+        major = content_type.split("/", 1)[0]
+        return any(t in (content_type, WILDCARD, f"{major}/*") for t in self.content_types)
+
+    def accepts(self, content_type, size=None):
+        """是否接收该类型、该大小的内容 (size 为 None 时只检查类型)"""
+        if not self.accepts_type(content_type):
+            return False
+        return self.max_size is None or size is None or size <= self.max_size
+
+    def image_spec(self, image, image_formats, screen_size=None):
+        """该订阅下 ClipboardImage 的编码规格; 不接收图片 (或选出的格式不在订阅中) 时返回 None"""
+        formats = tuple(f for f in image_formats if self.accepts_type(f))
+        if not formats:
+            return None
+        spec = image.spec_for(formats, self.image_size or screen_size)
+        return spec if self.accepts_type(spec.content_type) else None
+
+    def to_dict(self):
+        return {
+            "accept": list(self.content_types) if self.content_types is not None else None,
+            "maxSize": self.max_size,
+            "imageSize": list(self.image_size) if self.image_size else None,
+        }
@@ -0,0 +1,105 @@
+"""
+剪贴板同步工具 - 无界面模式
+
+只启动同步引擎, 不导入 tkinter / pystray, 适合不显示窗口的机器:
+    python sync_daemon.py [--no-history] [--log-file sync.log] [--log-level INFO] [--peer HOST:PORT ...]
+                          [--require-encryption] [--quiet-window 50]
+日志输出到控制台, 指定 --log-file 时同时写入按大小滚动的日志文件。
+--peer 可重复指定, 与其他电脑上的服务器组成中继网络, 共享同一个剪贴板;
+写成 配对码@HOST:PORT 时与该服务器建立加密连接。
+--quiet-window 为剪贴板连续变化时等待安静的毫秒数, 只发送最终状态 (0 表示每次变化都立即发送)。
+
+配对管理 (执行后退出):
+    python sync_daemon.py --pair 手机     生成新配对, 打印要在设备上输入的配对码 (只显示一次)
+    python sync_daemon.py --list-pairings
+    python sync_daemon.py --unpair 配对ID
+按 Ctrl+C 或发送 SIGTERM 退出。
+"""
+
+import argparse
+import signal
+import sys
+import threading
+
+from clipboard_backend import QUIET_WINDOW
+from log_sink import DEFAULT_LOG_BACKUPS, DEFAULT_LOG_MAX_BYTES, LogSink, setup_file_logging
+from sync_engine import SyncEngine, open_default_history, open_default_pairings
+from sync_server import STATS_PORT, get_local_ip
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="剪贴板同步工具 (无界面模式)")
+    parser.add_argument("--no-history", action="store_true", help="不记录剪贴板历史")
+    parser.add_argument("--stats-port", type=int, default=STATS_PORT, help="本机统计接口端口, 0 表示不启用")
+    parser.add_argument("--peer", action="append", default=[], metavar="HOST:PORT",
+                        help="要连接的其他电脑上的同步服务器 (可重复指定)")
+    parser.add_argument("--require-encryption", action="store_true",
+                        help="只同步到完成加密握手的设备, 断开明文连接")
+    parser.add_argument("--quiet-window", type=float, default=QUIET_WINDOW * 1000, metavar="MS",
+                        help="剪贴板连续变化时等待安静的毫秒数, 只发送最终状态")
+    parser.add_argument("--pair", metavar="NAME", help="生成新的设备配对并打印配对码")
+    parser.add_argument("--unpair", metavar="ID", help="取消配对")
+    parser.add_argument("--list-pairings", action="store_true", help="列出已配对的设备")
+    parser.add_argument("--log-file", help="日志文件路径 (按大小滚动)")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="日志级别")
+    parser.add_argument("--log-max-bytes", type=int, default=DEFAULT_LOG_MAX_BYTES, help="单个日志文件的大小上限")
+    parser.add_argument("--log-backups", type=int, default=DEFAULT_LOG_BACKUPS, help="保留的旧日志文件数")
+    args = parser.parse_args(argv)
+
+    if args.pair or args.unpair or args.list_pairings:
+        return manage_pairings(args)
+
+    logger, listener = setup_file_logging(args.log_file, args.log_level, args.log_max_bytes, args.log_backups)
+    log = LogSink(logger=logger)
+
+    history = None if args.no_history else open_default_history(log)
+    engine = SyncEngine(history=history, log=log, stats_port=args.stats_port or None, peers=args.peer,
+                        pairings=open_default_pairings(log), require_encryption=args.require_encryption,
+                        quiet_window=args.quiet_window / 1000,
+                        on_clients_changed=lambda count: log(f"📱 已连接设备: {count}"))
+
+    stop_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop_event.set())
+
+    try:
+        port = engine.start()
+    except OSError as e:
+        log.error(f"服务器启动失败: {e}")
+        engine.close()
+        listener.stop()
+        return 1
+    log(f"✅ 服务已启动  🌐 IP地址: {get_local_ip()}:{port}")
+
+    # 带超时等待, 使 Windows 上的 Ctrl+C 也能及时响应
+    # 同时定期补记被限流省略的日志数量
+    while not stop_event.wait(1.0):
+        log.flush_suppressed()
+
+    engine.close()
+    log("⛔ 服务已停止")
+    log.close()
+    listener.stop()
+    return 0
+
+
+def manage_pairings(args):
+    pairings = open_default_pairings()
+    if args.pair:
+        pairing = pairings.create(args.pair)
+        print(f"已配对 {pairing.name} (ID {pairing.id}), 在设备上输入配对码:")
+        print(pairing.code)
+    if args.unpair:
+        if not pairings.remove(args.unpair):
+            print(f"没有 ID 为 {args.unpair} 的配对")
+            return 1
+        print(f"已取消配对 {args.unpair}")
+    if args.list_pairings:
+        for pairing in pairings.list():
+            print(f"{pairing.id}  {pairing.name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
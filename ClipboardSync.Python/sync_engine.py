@@ -0,0 +1,185 @@
+"""
+同步引擎 - 剪贴板监听 + 同步服务器 + 剪贴板历史
+
+不依赖 tkinter、pystray 等界面库, 可作为库使用, 也是无界面模式 (sync_daemon.py)
+和图形界面 (clipboard_sync.py) 共用的核心。
+"""
+
+import os
+import time
+
+from clipboard_backend import (
+    QUIET_WINDOW, ClipboardMonitor, create_clipboard_backend, html_to_text, image_clipboard_contents
+)
+from manifest import HTML, RTF, TEXT
+from sync_server import OVERFLOW_DROP_OLDEST, STATS_PORT, SyncServer
+
+
+def open_default_history(log=print):
+    """打开默认数据目录下的历史数据库, 失败时返回 None (不记录历史)"""
+    try:
+        from history import ClipboardHistory, default_data_dir
+        data_dir = default_data_dir()
+        os.makedirs(data_dir, exist_ok=True)
+        return ClipboardHistory(os.path.join(data_dir, "history.db"))
+    except Exception as e:
+        log(f"打开剪贴板历史失败: {e}")
+        return None
+
+
+def open_default_pairings(log=print):
+    """打开默认数据目录下的配对列表, 失败时返回空列表 (不接受加密连接)"""
+    from secure_channel import PairingStore
+    try:
+        from history import default_data_dir
+        data_dir = default_data_dir()
+        os.makedirs(data_dir, exist_ok=True)
+        return PairingStore(os.path.join(data_dir, "pairings.json"))
+    except Exception as e:
+        log(f"读取配对列表失败: {e}")
+        return PairingStore()
+
+
+class SyncEngine:
+    """剪贴板同步引擎
+
+    clipboard: 剪贴板后端, 默认按平台创建
+    history: 可选的 ClipboardHistory
+    log(message): 日志回调, 可能在任意线程中调用
+    on_clients_changed(count): 连接数变化 (在事件循环线程中调用)
+    stats_port: 本机 HTTP 统计接口端口, None 表示不启用
+    peers: 组成中继网络的其他电脑 ("[配对码@]host:port"), 见 relay.py; node_id: 本机的节点标识, 默认随机生成
+    pairings: 已配对设备的 PairingStore; require_encryption: 只同步到完成加密握手的设备, 见 secure_channel.py
+    quiet_window: 剪贴板连续变化时等安静多少秒再发送最终状态, 0 表示每次变化都立即发送
+    """
+
+    def __init__(self, clipboard=None, history=None, log=print, on_clients_changed=None,
+                 send_queue_size=8, overflow_policy=OVERFLOW_DROP_OLDEST, stats_port=STATS_PORT,
+                 peers=(), node_id=None, pairings=None, require_encryption=False, quiet_window=QUIET_WINDOW):
+        self.log = log
+        self.history = history
+        self.is_running = False
+
+        # 网络层 (asyncio); 每个客户端的发送队列长度与队列满时的处理策略
+        self.server = SyncServer(
+            on_message=self.handle_received_message,
+            on_clients_changed=on_clients_changed,
+            log=log,
+            send_queue_size=send_queue_size,
+            overflow_policy=overflow_policy,
+            history=history,
+            stats_port=stats_port,
+            peers=peers,
+            node_id=node_id,
+            pairings=pairings,
+            require_encryption=require_encryption
+        )
+
+        # 剪贴板后端与监听器 (只在剪贴板变化时读取)
+        self.clipboard = clipboard or create_clipboard_backend()
+        self.clipboard_monitor = ClipboardMonitor(
+            self.clipboard,
+            log=log,
+            metrics=self.server.metrics,
+            on_change=self.send_change_to_clients,
+            quiet_window=quiet_window
+        )
+
+    def start(self):
+        """启动同步服务器和剪贴板监听, 返回端口号; 端口绑定失败时抛出 OSError"""
+        port = self.server.start()
+        self.clipboard_monitor.start()
+        self.is_running = True
+        return port
+
+    def stop(self):
+        """停止剪贴板监听, 关闭服务器和所有客户端连接"""
+        self.is_running = False
+        self.clipboard_monitor.stop()
+        self.server.stop()
+
+    def close(self):
+        """停止服务并释放剪贴板后端和历史数据库"""
+        if self.is_running:
+            self.stop()
+        self.clipboard.close()
+        if self.history:
+            self.history.close()
+
+    def handle_received_message(self, message, address):
+        """处理接收到的消息"""
+        try:
+            msg_type = message.get("type")
+            content_type = message.get("contentType")
+            content = message.get("content")
+
+            if msg_type == "clipboard" and content_type == "text/plain":
+                # 接收到文本,写入系统剪贴板
+                self.set_clipboard_text(content)
+                preview = content[:30] + "..." if len(content) > 30 else content
+                self.log(f"收到来自 {address[0]} 的文本: {preview}")
+            elif msg_type == "clipboard" and content_type and content_type.startswith("image/") \
+                    and isinstance(content, (bytes, bytearray)):
+                # 接收到图片 (已从 Base64 或分块中还原为字节), 以位图写入系统剪贴板
+                if self.set_clipboard_image(content_type, content):
+                    self.log(f"收到来自 {address[0]} 的图片 ({len(content) // 1024} KB)")
+            elif msg_type == "clipboard" and content_type == HTML and isinstance(content, str):
+                # HTML 同时写入纯文本, 不支持 HTML 的程序也能粘贴
+                if self.set_clipboard_contents({HTML: content, TEXT: html_to_text(content)}):
+                    self.log(f"收到来自 {address[0]} 的 HTML ({len(content)} 字符)")
+            elif msg_type == "clipboard" and content_type == RTF and isinstance(content, str):
+                if self.set_clipboard_contents({RTF: content}):
+                    self.log(f"收到来自 {address[0]} 的 RTF ({len(content)} 字符)")
+        except Exception as e:
+            self.log(f"处理消息失败: {e}")
+
+    def set_clipboard_contents(self, contents):
+        """一次写入多种格式 ({内容类型: 数据}), 成功返回 True
+
+        本程序写入的内容不会被剪贴板监听再发回给设备。
+        """
+        started = time.perf_counter()
+        try:
+            if self.clipboard.set_contents(contents):
+                self.server.metrics.observe_since("apply", started)
+                return True
+            self.log(f"设置剪贴板失败")
+        except Exception as e:
+            self.log(f"设置剪贴板失败: {e}")
+        return False
+
+    def set_clipboard_text(self, text):
+        """设置系统剪贴板文本"""
+        if self.set_clipboard_contents({TEXT: text}):
+            # 更新最后的文本,避免重复发送
+            self.clipboard_monitor.last_clipboard_text = text
+
+    def set_clipboard_image(self, content_type, data):
+        """把收到的图片写入系统剪贴板 (位图, PNG 同时保留原始数据), 成功返回 True"""
+        started = time.perf_counter()
+        try:
+            contents = image_clipboard_contents(content_type, data)
+        except Exception as e:
+            self.log(f"解码图片失败: {e}")
+            return False
+        self.server.metrics.observe_since("decode", started)
+        return self.set_clipboard_contents(contents)
+
+    def get_client_stats(self):
+        """各客户端的发送队列深度和延迟"""
+        return self.server.get_client_stats()
+
+    def get_stats(self):
+        """各阶段耗时、计数器和客户端统计"""
+        return self.server.get_stats()
+
+    def send_change_to_clients(self, change):
+        """发布一次剪贴板变化 (ClipboardChange): 支持清单的设备按需取回, 其余设备收到文本或图片
+
+        没有设备在线时也要发布, 内容会保留在 Backlog 中, 设备重连后补发。
+        """
+        sent_count = self.server.publish(change)
+        if not sent_count:
+            self.log(f"没有已连接的设备, 设备重连后补发: {change.describe()}")
+            return
+        self.log(f"已发送到 {sent_count} 个设备: {change.describe()}")
@@ -0,0 +1,1381 @@
+"""
+同步服务器 - 基于 asyncio 的网络层
+
+一个事件循环 (运行在后台线程中) 负责接受连接、读取客户端消息、向客户端发送
+和设备发现广播, 不依赖 tkinter。start()/stop() 可从任意线程调用,
+stop() 会立即关闭监听端口和所有连接, 不再等待轮询超时。
+
+指定 stats_port 时在 127.0.0.1 上提供 HTTP 统计接口: GET /stats 返回 get_stats() 的 JSON。
+
+剪贴板变化通过 publish() 发布: 声明了 "manifest" 的客户端只收到清单 (见 manifest.py),
+粘贴时再按格式取回; 其余客户端照旧收到完整的文本或图片。
+清单中的文件通过独立的文件通道 (随机端口, 在握手回复中告知) 按范围发送, 见 file_transfer.py。
+
+配置了 peers 时主动连接其他服务器组成中继网络 (见 relay.py): 中继连接和设备连接一样是
+ClientConnection, 只是收发的剪贴板内容前带来源节点和序号, 收到的新内容会原样转发。
+
+发给设备的内容带序号并保存在有界的 Backlog 中, 设备重连后补发错过的内容; 启用保活的连接
+定期收到 ping, 失联时及时断开 (见 session.py)。
+
+握手中带 "secure" 的连接使用配对密钥建立加密通道 (见 secure_channel.py): 握手回复之后的数据
+都以 AEAD 记录收发, 重连时凭票据恢复会话。require_encryption 为 True 时只有完成加密握手的设备
+和中继节点才会收到内容, 明文连接发来的消息会导致断开。
+
+设备可以订阅只接收部分内容 (类型、大小上限、图片尺寸, 见 subscription.py), 发送时按订阅过滤。
+"""
+
+import asyncio
+import itertools
+import json
+import socket
+import threading
+import time
+from collections import OrderedDict, deque
+
+from compression import COMPRESSION_THRESHOLD, CompressionStats, negotiate_compression, timed_compress
+from delivery import ClockEstimator, DeliveryTracker, PendingItem, now_ms
+from discovery import DiscoveryService, get_local_ip
+from file_transfer import FileTransferService
+from image_encoding import DEFAULT_IMAGE_FORMATS
+from manifest import MANIFEST_LIMIT, TEXT, Manifest
+from metrics import SIZE_BOUNDS, Metrics
+from payload_store import PayloadStore
+from protocol import (
+    CONTENT_TYPE_IDS, MAX_MESSAGE_SIZE, PROTOCOL_BINARY, PROTOCOL_JSON, MessageReader, MessageTooLarge,
+    OutgoingTransfer, ProtocolError,
+    content_matches, encode_json_line, encode_message, make_cancel, make_clipboard_message, make_fetch_failed,
+    make_manifest, is_text_content, item_info, make_clipboard_ref, make_hello, make_history_result, make_ping,
+    make_pong, message_timestamp, negotiate_protocol, should_chunk
+)
+from relay import MAX_HOPS, PEER_RETRY_INTERVAL, OriginTracker, make_peer_hello, make_relay, parse_peer, valid_relay
+from secure_channel import (
+    UNKNOWN_TICKET, ClientHandshake, Pairing, PairingStore, SecureChannelError, TicketStore, accept_offer
+)
+from session import KEEPALIVE_INTERVAL, KEEPALIVE_TIMEOUT, Backlog
+from subscription import Subscription, payload_size
+
+SERVER_PORTS = range(5150, 5170)
+# 每次从套接字读取的最大字节数 (也作为 StreamReader 的缓冲上限)
+RECEIVE_BUFFER_SIZE = 256 * 1024
+# 每个客户端最多记录的已缓存内容哈希数
+KNOWN_HASH_LIMIT = 256
+# 本机统计接口端口 (只监听 127.0.0.1)
+STATS_PORT = 5170
+STATS_REQUEST_LIMIT = 8192
+# 最多为多少个设备保留未确认的内容
+DEVICE_TRACKER_LIMIT = 64
+
+# 发送队列满时的处理策略
+OVERFLOW_DROP_OLDEST = "drop_oldest"   # 丢弃最旧的剪贴板消息
+OVERFLOW_COALESCE = "coalesce"         # 丢弃所有排队的剪贴板消息, 只保留最新一条
+OVERFLOW_DISCONNECT = "disconnect"     # 断开该设备
+
+
+class OutboundItem:
+    """发送队列中的一项: 已编码的字节或分块传输"""
+
+    def __init__(self, payload, droppable=True, content_hash=None, pending=None, prefix=None, sealer=None,
+                 supersede=False):
+        self.payload = payload
+        # 紧接着在负载之前发送的字节 (中继头), 与负载一起入队和丢弃
+        self.prefix = prefix
+        # 握手回复等控制消息不能被丢弃
+        self.droppable = droppable
+        # 实时的剪贴板变化: 还没开始发送时, 被之后入队的实时变化取代 (补发、取回的内容不会被取代)
+        self.supersede = supersede
+        # 完整发送剪贴板内容后记为客户端已缓存
+        self.content_hash = content_hash
+        # 需要客户端确认的内容 (PendingItem)
+        self.pending = pending
+        # 加密握手的回复: 以明文发送, 之后的数据改用 sealer 加密
+        self.sealer = sealer
+        self.enqueued_at = time.monotonic()
+
+
+def string_list(value):
+    """客户端发来的字符串列表; 不是列表时为空, 其中不是字符串的元素忽略"""
+    if not isinstance(value, list):
+        return []
+    return [item for item in value if isinstance(item, str)]
+
+
+class ClientConnection:
+    """已连接的客户端
+
+    每个客户端有一个有界发送队列和独立的发送协程, 慢设备只会拖慢自己的队列,
+    不影响其他设备和剪贴板监听。除 stats() 外, 所有方法只能在事件循环线程中调用。
+    """
+
+    def __init__(self, reader, writer, max_queue=8, overflow_policy=OVERFLOW_DROP_OLDEST,
+                 on_disconnect=None, log=print, metrics=None):
+        self.reader = reader
+        self.writer = writer
+        self.address = writer.get_extra_info("peername")[:2]
+        # 未握手的客户端使用 JSON 行协议
+        self.protocol_version = PROTOCOL_JSON
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.on_disconnect = on_disconnect
+        self.log = log
+        self.metrics = metrics
+
+        # 握手时声明的图片格式和屏幕尺寸
+        self.image_formats = DEFAULT_IMAGE_FORMATS
+        self.screen_size = None
+        # 订阅: 接收的内容类型、大小上限和希望的图片尺寸 (见 subscription.py)
+        self.subscription = Subscription()
+        # 协商的压缩算法, None 表示不压缩
+        self.compression = None
+        # 只接收清单, 需要时再按格式取回
+        self.manifest = False
+        # 中继连接: 对方是另一个服务器 (outbound 表示由本机主动连接), peer_id 为对方的节点标识
+        self.peer = False
+        self.peer_id = None
+        self.outbound = False
+        # 收到的中继头, 属于紧接着的下一条剪贴板内容
+        self.pending_relay = None
+        # 保活: 最后收到数据的时间, 以及发送缓冲最后一次排出数据的时间
+        self.keepalive = False
+        self.last_received = time.monotonic()
+        self.last_progress = self.last_received
+        self.last_buffered = 0
+        # 加密通道: 发送和接收方向的记录加解密, 完成加密握手后 secure 为 True;
+        # 本机主动建立的加密中继连接在收到回复前保存 handshake, 完成后保存下次恢复会话用的 ticket
+        self.sealer = None
+        self.opener = None
+        self.secure = False
+        self.cipher = None
+        self.pairing_name = None
+        self.handshake = None
+        self.ticket = None
+        # 客户端声明支持缓存后, 记录它已持有的内容哈希
+        self.cache_enabled = False
+        self.known_hashes = OrderedDict()
+        # 投递确认: 启用后跟踪未确认的内容, 并估算往返时间和时钟偏差
+        self.device_id = None
+        self.tracker = None
+        self.clock = ClockEstimator()
+        self.sync_latency = None
+        self.acks_received = 0
+
+        self.queue = deque()
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.writer_task = None
+
+        # 统计信息
+        self.bytes_sent = 0
+        self.items_sent = 0
+        self.items_dropped = 0
+        self.items_superseded = 0
+        self.items_filtered = 0
+        self.bytes_received = 0
+        self.items_received = 0
+        self.max_queue_depth = 0
+        self.last_latency = 0.0
+        self.avg_latency = 0.0
+        self.current_transfer = None
+        self.transfer_sent_bytes = 0
+
+    def start(self):
+        self.writer_task = asyncio.ensure_future(self.writer_loop())
+
+    def image_spec(self, image):
+        """按该客户端的格式、屏幕尺寸和订阅选择图片编码规格; 不接收该图片时返回 None"""
+        return self.subscription.image_spec(image, self.image_formats, self.screen_size)
+
+    def has_cached(self, digest):
+        return self.cache_enabled and digest in self.known_hashes
+
+    def remember_hashes(self, digests):
+        for digest in digests:
+            self.known_hashes[digest] = True
+            self.known_hashes.move_to_end(digest)
+        while len(self.known_hashes) > KNOWN_HASH_LIMIT:
+            self.known_hashes.popitem(last=False)
+
+    def forget_hashes(self, digests):
+        for digest in digests:
+            self.known_hashes.pop(digest, None)
+
+    def enqueue(self, payload, droppable=True, content_hash=None, track=None, prefix=None, sealer=None,
+                supersede=False):
+        """放入发送队列, 队列满时按策略处理; 返回是否入队
+
+        track: (内容哈希, 内容类型, 时间戳), 启用投递确认时跟踪这条内容直到客户端确认
+        prefix: 在负载之前发送的字节 (中继头)
+        sealer: 发送完这一项后启用的加密 (加密握手的回复)
+        supersede: 实时的剪贴板变化, 丢弃排队中尚未发送的旧变化
+        """
+        if self.closed:
+            return False
+        if supersede:
+            self.drop_superseded()
+        if droppable and len(self.queue) >= self.max_queue:
+            if self.overflow_policy == OVERFLOW_DISCONNECT:
+                self.log(f"设备 {self.address[0]} 发送队列已满, 断开连接")
+                self.close()
+                return False
+            self.make_room()
+        pending = None
+        if track and self.tracker is not None:
+            pending = PendingItem(*track)
+            self.tracker.add(pending)
+        self.queue.append(OutboundItem(payload, droppable, content_hash, pending, prefix, sealer, supersede))
+        self.max_queue_depth = max(self.max_queue_depth, len(self.queue))
+        self.wakeup.set()
+        return True
+
+    def make_room(self):
+        """按策略丢弃排队中的剪贴板消息"""
+        if self.overflow_policy == OVERFLOW_COALESCE:
+            kept = [item for item in self.queue if not item.droppable]
+            for item in self.queue:
+                if item.droppable:
+                    self.discard_pending(item)
+            self.items_dropped += len(self.queue) - len(kept)
+            self.queue = deque(kept)
+            return
+        oldest = next((item for item in self.queue if item.droppable), None)
+        if oldest is not None:
+            self.queue.remove(oldest)
+            self.discard_pending(oldest)
+            self.items_dropped += 1
+
+    def drop_superseded(self):
+        """丢弃排队中已被新变化取代的内容 (正在发送的分块传输由 SyncServer 取消)"""
+        stale = [item for item in self.queue if item.supersede]
+        if not stale:
+            return
+        for item in stale:
+            self.discard_pending(item)
+        self.queue = deque(item for item in self.queue if not item.supersede)
+        self.items_superseded += len(stale)
+        if self.metrics:
+            self.metrics.increment("itemsSuperseded", len(stale))
+
+    def discard_pending(self, item):
+        """被丢弃或取消的内容不需要确认, 也不在重连时重发"""
+        if item.pending is not None and self.tracker is not None:
+            self.tracker.discard(item.pending.digest)
+
+    async def writer_loop(self):
+        """发送协程: 依次发送队列中的消息"""
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                item = self.queue.popleft()
+
+                started = time.perf_counter()
+                if self.metrics:
+                    self.metrics.observe("queueWait", (time.monotonic() - item.enqueued_at) * 1000)
+                if item.prefix:
+                    await self.send(item.prefix)
+                if isinstance(item.payload, OutgoingTransfer):
+                    delivered = await self.send_transfer(item.payload)
+                else:
+                    await self.send(item.payload)
+                    delivered = True
+                if item.sealer is not None:
+                    self.sealer = item.sealer
+                if self.metrics:
+                    self.metrics.observe_since("send", started)
+                if delivered and item.content_hash and self.cache_enabled:
+                    self.remember_hashes([item.content_hash])
+                if item.pending is not None:
+                    if delivered:
+                        item.pending.sent_at = now_ms()
+                    else:
+                        self.discard_pending(item)
+
+                self.items_sent += 1
+                self.last_latency = time.monotonic() - item.enqueued_at
+                self.avg_latency = self.last_latency if self.items_sent == 1 else \
+                    0.8 * self.avg_latency + 0.2 * self.last_latency
+        except (ConnectionError, OSError):
+            self.close()
+
+    async def send(self, data):
+        self.write(data)
+        await self.writer.drain()
+
+    def write(self, data):
+        """写出数据, 加密连接上先封装为记录"""
+        if self.sealer is not None:
+            pieces = self.sealer.seal(data)
+            self.writer.writelines(pieces)
+            self.bytes_sent += sum(len(piece) for piece in pieces)
+        else:
+            self.writer.write(data)
+            self.bytes_sent += len(data)
+
+    def send_control(self, message):
+        """立即写出一条短控制消息 (ping / pong), 不排在发送队列之后
+
+        每次写入都是完整的一行或一帧, 只会插在两条消息 (或两块) 之间。
+        """
+        if self.closed:
+            return
+        self.write(encode_message(message, self.protocol_version))
+
+    def is_alive(self, now, timeout=KEEPALIVE_TIMEOUT):
+        """超过 timeout 秒没有收到数据、发送缓冲也没有排出数据时认为对方已失联"""
+        buffered = self.writer.transport.get_write_buffer_size()
+        if buffered < self.last_buffered:
+            self.last_progress = now
+        self.last_buffered = buffered
+        return now - max(self.last_received, self.last_progress) <= timeout
+
+    async def send_transfer(self, transfer):
+        """逐块发送, 每块之间检查传输是否已被新内容取代; 完整发送返回 True"""
+        self.current_transfer = transfer
+        self.transfer_sent_bytes = 0
+        try:
+            for index in range(transfer.chunk_count):
+                if transfer.cancelled:
+                    if index > 0:
+                        await self.send(encode_message(make_cancel(transfer.transfer_id), PROTOCOL_BINARY))
+                    return False
+                await self.send(transfer.encode_chunk(index))
+                self.transfer_sent_bytes = min(transfer.total_bytes, (index + 1) * transfer.chunk_size)
+            return True
+        finally:
+            self.current_transfer = None
+
+    @property
+    def queue_depth(self):
+        return len(self.queue)
+
+    def stats(self):
+        """发送队列与延迟统计, 用于找出慢设备"""
+        transfer = self.current_transfer
+        return {
+            "address": f"{self.address[0]}:{self.address[1]}",
+            "protocolVersion": self.protocol_version,
+            "compression": self.compression,
+            "encryption": self.cipher,
+            "pairing": self.pairing_name,
+            "queueDepth": self.queue_depth,
+            "maxQueue": self.max_queue,
+            "lastLatencyMs": round(self.last_latency * 1000, 1),
+            "avgLatencyMs": round(self.avg_latency * 1000, 1),
+            "bytesSent": self.bytes_sent,
+            "itemsSent": self.items_sent,
+            "itemsDropped": self.items_dropped,
+            "itemsSuperseded": self.items_superseded,
+            "itemsFiltered": self.items_filtered,
+            "subscription": None if self.subscription.unrestricted else self.subscription.to_dict(),
+            "bytesReceived": self.bytes_received,
+            "itemsReceived": self.items_received,
+            "maxQueueDepth": self.max_queue_depth,
+            "deviceId": self.device_id,
+            "peerId": self.peer_id if self.peer else None,
+            "acksEnabled": self.tracker is not None,
+            "acksReceived": self.acks_received,
+            "unacked": len(self.tracker) if self.tracker is not None else None,
+            "rttMs": round(self.clock.rtt, 1) if self.clock.rtt is not None else None,
+            "clockOffsetMs": round(self.clock.offset, 1) if self.clock.offset is not None else None,
+            "syncLatencyMs": round(self.sync_latency, 1) if self.sync_latency is not None else None,
+            "cachedItems": len(self.known_hashes),
+            "transferId": transfer.transfer_id if transfer else None,
+            "transferProgress": round(self.transfer_sent_bytes / transfer.total_bytes, 3)
+            if transfer and transfer.total_bytes else None,
+        }
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self.wakeup.set()
+        try:
+            self.writer.close()
+        except:
+            pass
+        if self.on_disconnect:
+            self.on_disconnect(self)
+
+
+class SyncServer:
+    """剪贴板同步服务器
+
+    on_message(message, address): 收到客户端剪贴板消息 (在线程池中调用, 可以阻塞)
+    on_clients_changed(count): 连接数变化 (在事件循环线程中调用)
+    history: 可选的 ClipboardHistory, 记录收发的内容并响应客户端的历史查询
+    stats_port: 本机统计接口端口, None 表示不启用
+    max_message_size: 客户端单条消息的大小上限, 超过时断开该客户端
+    node_id: 中继网络中的节点标识, 默认随机生成
+    peers: 要主动连接的其他服务器 ("host:port" 或 (host, port)); 写成 "配对码@host:port" 时建立加密连接
+    pairings: 已配对设备的 PairingStore, 接受加密握手时使用
+    require_encryption: 只向完成加密握手的连接发送内容, 断开发来明文消息的连接
+    """
+
+    def __init__(self, on_message=None, on_clients_changed=None, log=print,
+                 send_queue_size=8, overflow_policy=OVERFLOW_DROP_OLDEST,
+                 payload_store_bytes=64 * 1024 * 1024, history=None, stats_port=None,
+                 max_message_size=MAX_MESSAGE_SIZE, node_id=None, peers=(), pairings=None,
+                 require_encryption=False):
+        self.on_message = on_message
+        self.history = history
+        self.device_name = socket.gethostname()
+        self.on_clients_changed = on_clients_changed
+        self.log = log
+        self.send_queue_size = send_queue_size
+        self.overflow_policy = overflow_policy
+        self.max_message_size = max_message_size
+
+        self.loop = None
+        self.thread = None
+        self.server = None
+        self.discovery_task = None
+        self.handler_tasks = set()
+        self.clients = []
+        self.port = None
+        self.is_running = False
+
+        # 分块传输: 同一时间只保留最新内容的传输 (每种图片规格各一个);
+        # 剪贴板监听线程和事件循环线程都会发送内容, 列表的修改需持有 transfer_lock
+        self.transfer_ids = itertools.count(1)
+        self.current_transfers = []
+        self.transfer_lock = threading.Lock()
+
+        # 最近几次变化的清单, 供只接收清单的客户端取回
+        self.manifest_ids = itertools.count(1)
+        self.manifests = OrderedDict()
+
+        # 最近发送过的内容, 按哈希去重和供客户端取回
+        self.payload_store = PayloadStore(payload_store_bytes)
+        # 按 deviceId 保留的未确认内容, 设备重连后重发
+        self.trackers = OrderedDict()
+        # 收发两个方向的压缩率和耗时
+        self.compression_stats = CompressionStats()
+        # 各阶段耗时直方图和计数器
+        self.metrics = Metrics()
+        self.stats_port = stats_port
+        self.stats_server = None
+        # 清单中文件的传输通道
+        self.files = FileTransferService(log, self.metrics)
+        self.file_server = None
+        self.file_port = None
+        self.discovery = DiscoveryService(lambda: self.port, log, self.metrics)
+        # 发给设备的最近内容, 设备重连后补发
+        self.backlog = Backlog()
+        self.keepalive_task = None
+        # 加密通道: 已配对的设备和发放给它们的会话票据
+        self.pairings = pairings if pairings is not None else PairingStore()
+        self.tickets = TicketStore()
+        self.require_encryption = require_encryption
+        # 中继网络: 本节点的序号和各来源已见过的最新序号, 以及要保持连接的其他服务器 (及其配对码)
+        self.relay = OriginTracker(node_id)
+        self.peer_pairings = {}
+        self.peers = [self._parse_peer(peer) for peer in peers]
+        self.peer_tasks = []
+
+    def start(self, timeout=5.0):
+        """在后台线程中启动事件循环, 绑定端口后返回端口号; 失败时抛出 OSError"""
+        if self.is_running:
+            return self.port
+
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+        errors = []
+        self.thread = threading.Thread(target=self._run_loop, args=(started, errors), daemon=True)
+        self.thread.start()
+        started.wait(timeout)
+        if errors:
+            raise errors[0]
+        self.is_running = True
+        return self.port
+
+    def stop(self, timeout=5.0):
+        """关闭所有连接并停止事件循环"""
+        loop = self.loop
+        if loop is None or not self.thread.is_alive():
+            return
+        self.is_running = False
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result(timeout)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        self.thread.join(timeout)
+
+    def add_peer(self, peer):
+        """添加一个要保持连接的中继节点 ("[配对码@]host:port" 或 (host, port)), 可从任意线程调用"""
+        host, port = self._parse_peer(peer)
+        self.peers.append((host, port))
+        if self.is_running:
+            self.loop.call_soon_threadsafe(self._start_peer, host, port)
+
+    def _parse_peer(self, peer):
+        """解析中继节点地址, 记录其中的配对码"""
+        if not isinstance(peer, str):
+            return tuple(peer)
+        code, _, address = peer.rpartition("@")
+        host, port = parse_peer(address)
+        if code:
+            self.peer_pairings[(host, port)] = Pairing.parse(code)
+        return host, port
+
+    def _start_peer(self, host, port):
+        if self.require_encryption and (host, port) not in self.peer_pairings:
+            self.log(f"⚠️ 中继节点 {host}:{port} 没有配对码, 要求加密时不会向它发送内容")
+        self.peer_tasks.append(asyncio.ensure_future(self._peer_loop(host, port)))
+
+    def broadcast(self, message):
+        """把消息放入各客户端的发送队列 (可从任意线程调用), 返回目标设备数
+
+        编码在调用线程中完成, 每种协议只编码一次, 不占用事件循环;
+        新消息会取消仍在进行的分块传输, 由各客户端的发送协程在块之间停止。
+        已缓存该内容的客户端只会收到一条按哈希引用的短消息。
+        """
+        self._cancel_transfers()
+        clients, peers = self._split_clients()
+        seq = self.backlog.add(message["contentType"], message["content"], message["timestamp"])
+        digest = self._broadcast_to(dict(message, seq=seq), clients)
+        self._relay_local(message, peers)
+        self._record_history(message["contentType"], message["content"], self.device_name,
+                             message["timestamp"], digest)
+        return len(clients) + len(peers)
+
+    def broadcast_image(self, image, timestamp=None):
+        """按各客户端声明的格式和屏幕尺寸发送剪贴板图片 (ClipboardImage)
+
+        规格相同的客户端共享同一份编码结果, 每种规格只编码一次。
+        """
+        self._cancel_transfers()
+        if timestamp is None:
+            timestamp = int(time.time() * 1000)
+        clients, peers = self._split_clients()
+        seq = self.backlog.add("image/png", image, timestamp)
+        self._broadcast_image_to(image, clients, timestamp, seq)
+        # 中继节点和历史中都是原尺寸无损 PNG
+        if peers:
+            self._relay_local(make_clipboard_message("image/png", image.png(), timestamp), peers)
+        if self.history is not None:
+            self._record_history("image/png", image.png(), self.device_name, timestamp)
+        return len(clients) + len(peers)
+
+    def publish(self, change):
+        """发布一次剪贴板变化 (ClipboardChange, 可从任意线程调用), 返回目标设备数
+
+        只接收清单的客户端收到各格式的大小和哈希, 其余客户端照旧收到完整的图片或文本。
+        """
+        self._cancel_transfers()
+        timestamp = change.timestamp or int(time.time() * 1000)
+        clients, peers = self._split_clients()
+        eager = [client for client in clients if not client.manifest]
+        lazy = [client for client in clients if client.manifest]
+
+        seq = None
+        if change.image is not None:
+            seq = self.backlog.add("image/png", change.image, timestamp)
+            self._broadcast_image_to(change.image, eager, timestamp, seq)
+        elif change.text is not None:
+            seq = self.backlog.add(TEXT, change.text, timestamp)
+            if eager:
+                self._broadcast_to(dict(make_clipboard_message(TEXT, change.text, timestamp), seq=seq), eager)
+        if lazy:
+            self._send_manifest(change, lazy, timestamp, seq)
+        # 中继节点收到主要内容 (原尺寸 PNG 或纯文本), 各跳之间不再重新编码
+        if peers and change.image is not None:
+            self._relay_local(make_clipboard_message("image/png", change.image.png(), timestamp), peers)
+        elif peers and change.text is not None:
+            self._relay_local(make_clipboard_message(TEXT, change.text, timestamp), peers)
+
+        if change.image is not None:
+            if self.history is not None:
+                self._record_history("image/png", change.image.png(), self.device_name, timestamp)
+        elif change.text is not None:
+            self._record_history(TEXT, change.text, self.device_name, timestamp)
+        return len(clients) + len(peers)
+
+    def _split_clients(self):
+        """可以接收内容的 (设备连接, 中继连接)
+
+        要求加密时跳过未完成加密握手的连接; 加密中继连接在握手完成前也不接收内容。
+        """
+        clients = [client for client in list(self.clients) if self._may_receive(client)]
+        return [client for client in clients if not client.peer], [client for client in clients if client.peer]
+
+    def _may_receive(self, client):
+        return client.secure or not (self.require_encryption or client.handshake is not None)
+
+    def _relay_local(self, message, peers):
+        """本节点产生的新内容: 分配序号后发给中继节点"""
+        seq = self.relay.next_seq()
+        if peers:
+            self._broadcast_to(message, peers, make_relay(self.relay.node_id, seq))
+
+    def _broadcast_image_to(self, image, clients, timestamp, seq=None):
+        groups = {}
+        rejected = []
+        for client in clients:
+            spec = client.image_spec(image)
+            if spec is None:
+                rejected.append(client)
+            else:
+                groups.setdefault(spec, []).append(client)
+        self._count_filtered(rejected)
+
+        for spec, group in groups.items():
+            message = make_clipboard_message(spec.content_type, image.encode(spec, self.metrics), timestamp)
+            if seq is not None:
+                message["seq"] = seq
+            self._broadcast_to(message, group)
+
+    def _send_manifest(self, change, clients, timestamp, seq=None):
+        """发送清单: 同一协议、图片规格和订阅类型的客户端共享同一份编码; 没有可接收格式的客户端不发送"""
+        change.timestamp = timestamp
+        with self.metrics.timer("serialize"):
+            manifest = Manifest(next(self.manifest_ids), change, self.payload_store,
+                                self.files if self.file_port else None)
+        self.manifests[manifest.id] = manifest
+        while len(self.manifests) > MANIFEST_LIMIT:
+            self.manifests.popitem(last=False)
+
+        encoded = {}
+        batch = []
+        rejected = []
+        for client in clients:
+            subscription = client.subscription
+            spec = client.image_spec(manifest.image) if manifest.image else None
+            key = (client.protocol_version, spec, subscription.content_types)
+            if key not in encoded:
+                entries = manifest.entries(spec, subscription.accepts_type)
+                message = make_manifest(manifest.id, entries, timestamp) if entries else None
+                if message is not None and seq is not None:
+                    message["seq"] = seq
+                encoded[key] = encode_message(message, client.protocol_version) if message else None
+            if encoded[key] is None:
+                rejected.append(client)
+            else:
+                batch.append((client, encoded[key], None, None, None))
+        self._count_filtered(rejected)
+        self.metrics.increment("manifestsSent", len(batch))
+        if self.is_running:
+            self.loop.call_soon_threadsafe(self._enqueue_batch, batch)
+
+    def _record_history(self, content_type, content, source, timestamp, digest=None):
+        if self.history is None:
+            return
+        try:
+            self.history.record(content_type, content, source, timestamp, digest)
+        except Exception as e:
+            self.log(f"记录历史失败: {e}")
+
+    def _cancel_transfers(self):
+        with self.transfer_lock:
+            transfers, self.current_transfers = self.current_transfers, []
+        for transfer in transfers:
+            transfer.cancel()
+
+    def _broadcast_to(self, message, clients, relay=None):
+        """发给一组连接: 相同的 (协议, 压缩) 只编码一次; relay 为中继头, 在内容之前发送
+
+        不接收该内容类型或超出大小上限的客户端按订阅跳过。
+        """
+        clients = self._subscribed(clients, message["contentType"], message["content"])
+        digest = self.payload_store.put(message["contentType"], message["content"])
+        message = dict(message, hash=digest)
+        self.metrics.increment("itemsRelayed" if relay else "itemsBroadcast")
+        self.metrics.histogram("payloadBytes", SIZE_BOUNDS).observe(len(message["content"]))
+
+        # 每种压缩算法只压缩一次, 每种 (协议, 压缩) 组合只编码一次
+        variants = {None: message}
+        transfers = {}
+        encoded = {}
+        encoded_refs = {}
+        prefixes = {}
+        batch = []
+        track = (digest, message["contentType"], message["timestamp"])
+        for client in clients:
+            version = client.protocol_version
+            prefix = None
+            if relay is not None:
+                if version not in prefixes:
+                    prefixes[version] = encode_message(relay, version)
+                prefix = prefixes[version]
+            if client.has_cached(digest):
+                if version not in encoded_refs:
+                    ref = make_clipboard_ref(message["contentType"], digest, message["timestamp"])
+                    ref.update(item_info(message))
+                    encoded_refs[version] = encode_message(ref, version)
+                batch.append((client, encoded_refs[version], None, track, prefix))
+                continue
+
+            codec = client.compression if self._should_compress(message) else None
+            if codec not in variants:
+                variants[codec] = self._compress_message(message, codec)
+            variant = variants[codec]
+            if should_chunk(variant, version):
+                if codec not in transfers:
+                    with self.metrics.timer("serialize"):
+                        transfers[codec] = OutgoingTransfer(next(self.transfer_ids), variant)
+                    with self.transfer_lock:
+                        self.current_transfers.append(transfers[codec])
+                batch.append((client, transfers[codec], digest, track, prefix))
+            else:
+                key = (version, codec)
+                if key not in encoded:
+                    with self.metrics.timer("serialize"):
+                        encoded[key] = encode_message(variant, version)
+                batch.append((client, encoded[key], digest, track, prefix))
+
+        if batch and self.is_running:
+            self.loop.call_soon_threadsafe(self._enqueue_batch, batch)
+        return digest
+
+    def _subscribed(self, clients, content_type, content):
+        """按订阅过滤连接; 只在有客户端设置了大小上限时才计算内容大小"""
+        size = None
+        accepted = []
+        rejected = []
+        for client in clients:
+            if size is None and client.subscription.max_size is not None:
+                size = payload_size(content)
+            (accepted if client.subscription.accepts(content_type, size) else rejected).append(client)
+        self._count_filtered(rejected)
+        return accepted
+
+    def _count_filtered(self, clients):
+        for client in clients:
+            client.items_filtered += 1
+        if clients:
+            self.metrics.increment("itemsFiltered", len(clients))
+
+    def _should_compress(self, message):
+        return is_text_content(message["contentType"]) and len(message["content"]) >= COMPRESSION_THRESHOLD
+
+    def _compress_message(self, message, codec):
+        """返回压缩后的消息副本; 不压缩或压缩无收益时返回原消息"""
+        if codec is None:
+            return message
+        raw = message["content"].encode('utf-8')
+        with self.metrics.timer("compress"):
+            compressed = timed_compress(codec, raw, self.compression_stats)
+        if len(compressed) >= len(raw):
+            return message
+        return dict(message, content=compressed, contentEncoding=codec)
+
+    def get_compression_stats(self):
+        """收发两个方向的压缩统计"""
+        return self.compression_stats.snapshot()
+
+    def get_client_stats(self):
+        """各客户端的发送队列深度和延迟"""
+        return [client.stats() for client in list(self.clients)]
+
+    def get_stats(self):
+        """全部运行统计: 各阶段直方图、计数器、各客户端统计和压缩统计"""
+        stats = self.metrics.snapshot()
+        stats["port"] = self.port
+        stats["nodeId"] = self.relay.node_id
+        stats["clients"] = self.get_client_stats()
+        stats["compression"] = self.get_compression_stats()
+        return stats
+
+    def _enqueue_batch(self, batch):
+        for client, payload, digest, track, prefix in batch:
+            client.enqueue(payload, content_hash=digest, track=track, prefix=prefix, supersede=True)
+
+    def _run_loop(self, started, errors):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._start())
+        except OSError as e:
+            errors.append(e)
+            started.set()
+            self.loop.close()
+            return
+
+        started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            pending = [task for task in asyncio.all_tasks(self.loop) if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self.loop.close()
+
+    async def _start(self):
+        """绑定 5150-5169 中第一个可用端口并启动设备发现"""
+        for port in SERVER_PORTS:
+            try:
+                self.server = await asyncio.start_server(
+                    self._handle_client, "0.0.0.0", port, limit=RECEIVE_BUFFER_SIZE
+                )
+                self.port = port
+                break
+            except OSError:
+                continue
+        if self.server is None:
+            raise OSError(f"端口 {SERVER_PORTS[0]}-{SERVER_PORTS[-1]} 均被占用")
+
+        self.log(f"🚀 Socket 服务器已启动，端口: {self.port}")
+        # 文件通道是明文且不验证身份的, 要求加密时不启动 (清单中的文件不带可取回的 id)
+        if self.require_encryption:
+            self.log("要求加密, 不启动文件通道")
+        else:
+            try:
+                self.file_server = await asyncio.start_server(self.files.handle_connection, "0.0.0.0", 0)
+                self.file_port = self.file_server.sockets[0].getsockname()[1]
+            except OSError as e:
+                self.log(f"文件通道启动失败: {e}")
+        self.discovery_task = asyncio.ensure_future(self.discovery.run(self.loop))
+        self.keepalive_task = asyncio.ensure_future(self._keepalive_loop())
+        for host, port in self.peers:
+            self._start_peer(host, port)
+
+        if self.stats_port:
+            try:
+                self.stats_server = await asyncio.start_server(self._handle_stats_request, "127.0.0.1", self.stats_port)
+                self.log(f"统计接口: http://127.0.0.1:{self.stats_port}/stats")
+            except OSError as e:
+                self.log(f"统计接口启动失败: {e}")
+
+    async def _shutdown(self):
+        if self.discovery_task:
+            self.discovery_task.cancel()
+        if self.keepalive_task:
+            self.keepalive_task.cancel()
+        for task in self.peer_tasks:
+            task.cancel()
+        self.peer_tasks = []
+        if self.server:
+            self.server.close()
+        if self.stats_server:
+            self.stats_server.close()
+            self.stats_server = None
+        if self.file_server:
+            self.file_server.close()
+            self.file_server = None
+            self.file_port = None
+        for client in list(self.clients):
+            client.close()
+        self.clients.clear()
+        self.server = None
+        # 连接关闭后接收协程会读到 EOF 并退出, 等它们结束以免被强制取消
+        if self.handler_tasks:
+            await asyncio.wait(list(self.handler_tasks), timeout=1.0)
+
+    async def _handle_client(self, reader, writer):
+        """处理客户端连接"""
+        client = self._add_client(reader, writer)
+        await self._serve(client)
+
+    async def _peer_loop(self, host, port):
+        """保持到另一个服务器的中继连接, 断开后定期重连; 有配对码时加密, 重连时凭票据恢复会话"""
+        pairing = self.peer_pairings.get((host, port))
+        ticket = None
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(host, port, limit=RECEIVE_BUFFER_SIZE)
+            except OSError:
+                await asyncio.sleep(PEER_RETRY_INTERVAL)
+                continue
+            client = self._add_client(reader, writer, outbound=True)
+            if pairing is not None:
+                client.handshake = ClientHandshake(pairing, ticket)
+            self._send_peer_hello(client)
+            await self._serve(client)
+            ticket = client.ticket
+            await asyncio.sleep(PEER_RETRY_INTERVAL)
+
+    def _send_peer_hello(self, client):
+        hello = make_peer_hello(self.relay.node_id)
+        if client.handshake is not None:
+            hello["secure"] = client.handshake.offer()
+        client.enqueue(encode_json_line(hello), droppable=False)
+
+    def _add_client(self, reader, writer, outbound=False):
+        client = ClientConnection(
+            reader, writer,
+            max_queue=self.send_queue_size,
+            overflow_policy=self.overflow_policy,
+            on_disconnect=self._on_client_closed,
+            log=self.log,
+            metrics=self.metrics
+        )
+        # 主动建立的中继连接总是启用保活 (握手请求中也声明了 keepalive)
+        client.peer = client.outbound = client.keepalive = outbound
+        self.clients.append(client)
+        client.start()
+        self._clients_changed()
+        if outbound:
+            self.log(f"🔗 已连接到中继节点: {client.address[0]}:{client.address[1]}")
+        else:
+            self.log(f"✅ 设备已连接: {client.address[0]}:{client.address[1]}")
+        return client
+
+    async def _serve(self, client):
+        """接收并处理一个连接上的消息, 直到连接断开"""
+        task = asyncio.current_task()
+        self.handler_tasks.add(task)
+        message_reader = MessageReader(
+            compression_stats=self.compression_stats, max_message_size=self.max_message_size
+        )
+        try:
+            while not client.closed:
+                data = await client.reader.read(RECEIVE_BUFFER_SIZE)
+                if not data:
+                    break
+                client.bytes_received += len(data)
+                client.last_received = time.monotonic()
+                self.metrics.increment("bytesReceived", len(data))
+
+                while data and not client.closed:
+                    if client.opener is not None:
+                        plain, data = client.opener.open(data), b""
+                    elif client.handshake is not None:
+                        # 本机发起的加密握手: 对方的回复之后紧跟密文, 每次只把一行交给明文解析
+                        end = data.find(b"\n") + 1 or len(data)
+                        plain, data = data[:end], data[end:]
+                    else:
+                        plain, data = data, b""
+                    await self._handle_data(client, message_reader, plain)
+        except MessageTooLarge as e:
+            self.metrics.increment("oversizedMessages")
+            self.log(f"⚠️ {client.address[0]} {e}, 断开连接")
+        except SecureChannelError as e:
+            self.metrics.increment("decryptFailures")
+            self.log(f"⚠️ {client.address[0]} {e}, 断开连接")
+        except (ConnectionError, OSError, ProtocolError):
+            pass
+        finally:
+            client.close()
+            self.handler_tasks.discard(task)
+
+    async def _handle_data(self, client, message_reader, data):
+        """解析一段明文数据 (JSON 行或二进制帧) 并依次处理其中的消息"""
+        messages = message_reader.feed(data)
+        for index, message in enumerate(messages):
+            client.items_received += 1
+            msg_type = message.get("type")
+            if msg_type == "hello":
+                was_secure = client.secure
+                if client.outbound:
+                    self._handle_peer_hello(client, message)
+                else:
+                    self._handle_hello(client, message)
+                # 对方收到握手回复之前不可能发出密文, 同一批数据中握手之后的内容只能是伪造的明文
+                if client.secure and not was_secure and (index + 1 < len(messages) or not message_reader.idle()):
+                    raise ProtocolError("加密握手之后收到明文数据")
+            elif self.require_encryption and not client.secure:
+                self.log(f"⚠️ {client.address[0]} 没有建立加密连接, 断开连接")
+                client.close()
+                break
+            elif msg_type == "cache":
+                self._handle_cache(client, message)
+            elif msg_type == "subscribe":
+                self._handle_subscribe(client, message)
+            elif msg_type == "fetch":
+                await self._handle_fetch(client, message)
+            elif msg_type == "ack":
+                self._handle_ack(client, message)
+            elif msg_type == "historyQuery":
+                await self._handle_history_query(client, message)
+            elif msg_type == "ping":
+                client.send_control(make_pong(message))
+            elif msg_type == "pong":
+                pass
+            elif msg_type == "relay":
+                client.pending_relay = message if client.peer else None
+            elif client.peer:
+                await self._handle_relayed(client, message)
+            else:
+                if msg_type == "clipboard":
+                    self._originate(message)
+                # 写剪贴板、记录历史等操作可能阻塞, 放到线程池中执行, 按顺序等待
+                await self.loop.run_in_executor(None, self._on_client_message, message, client.address)
+
+    def _handle_hello(self, client, message):
+        """处理握手消息, 协商该连接使用的协议版本"""
+        secure = None
+        if message.get("secure") is not None:
+            secure = self._accept_secure(client, message["secure"])
+            if secure is None:
+                return
+        version = negotiate_protocol(message.get("protocolVersions"))
+        compression = negotiate_compression(message.get("compression"))
+        # 回复始终为 JSON 行 (加密握手的回复为明文), 入队后才切换协议, 保证之后的消息排在回复之后
+        reply = make_hello(version, compression, self.file_port)
+        if message.get("peer"):
+            reply["nodeId"] = self.relay.node_id
+        if message.get("session"):
+            reply.update(epoch=self.backlog.epoch, seq=self.backlog.latest_seq)
+        subscription = Subscription.from_message(message)
+        if not subscription.unrestricted:
+            reply["subscription"] = subscription.to_dict()
+        if secure is not None:
+            reply["secure"] = secure.reply
+            client.enqueue(encode_json_line(reply), droppable=False, sealer=secure.sealer)
+            self._start_secure(client, secure)
+        else:
+            client.enqueue(encode_json_line(reply), droppable=False)
+        client.protocol_version = version
+        client.compression = compression
+        if message.get("peer"):
+            self._accept_peer(client, message.get("nodeId"))
+
+        # 格式不对的 imageFormats / screenSize 忽略, 按未声明处理
+        image_formats = message.get("imageFormats")
+        if isinstance(image_formats, list):
+            client.image_formats = tuple(f for f in image_formats if isinstance(f, str) and f in CONTENT_TYPE_IDS)
+            if not client.image_formats:
+                client.image_formats = DEFAULT_IMAGE_FORMATS
+        screen_size = message.get("screenSize")
+        if isinstance(screen_size, (list, tuple)) and len(screen_size) == 2 \
+                and all(isinstance(v, int) and not isinstance(v, bool) and v > 0 for v in screen_size):
+            client.screen_size = (screen_size[0], screen_size[1])
+        client.subscription = subscription
+
+        # 会话恢复时由补发代替重发未确认的内容, 避免同一内容发两次
+        resuming = bool(message.get("session")) and message.get("lastSeq") is not None
+        if message.get("acks"):
+            self._enable_acks(client, message.get("deviceId"), retransmit=not resuming)
+        client.manifest = bool(message.get("manifest"))
+        client.keepalive = client.keepalive or bool(message.get("keepalive"))
+        if resuming:
+            self._resume_session(client, message.get("epoch"), message.get("lastSeq"))
+
+        if version == PROTOCOL_BINARY:
+            self.log(f"设备 {client.address[0]} 已启用二进制协议")
+        if compression:
+            self.log(f"设备 {client.address[0]} 已启用 {compression} 压缩")
+
+    def _accept_secure(self, client, offer):
+        """处理加密握手请求, 返回 SecureSession; 失败时回复错误码, 票据无效以外的错误断开连接"""
+        if client.secure:
+            self.log(f"⚠️ {client.address[0]} 在加密连接上再次发起加密握手, 断开连接")
+            client.close()
+            return None
+        try:
+            with self.metrics.timer("handshake"):
+                session = accept_offer(offer, self.pairings, self.tickets)
+        except SecureChannelError as e:
+            self.metrics.increment("handshakeFailures")
+            reply = make_hello()
+            reply["secure"] = {"error": e.code}
+            client.send_control(reply)
+            if e.code != UNKNOWN_TICKET:
+                self.log(f"⚠️ {client.address[0]} 加密握手失败: {e}")
+                client.close()
+            return None
+        self.metrics.increment("handshakesResumed" if session.resumed else "handshakesFull")
+        return session
+
+    def _start_secure(self, client, session):
+        """之后收到的数据都是密文; 发送方向在握手回复发出后 (或立即, 本机发起时) 切换"""
+        client.opener = session.opener
+        client.secure = True
+        client.cipher = session.cipher
+        client.pairing_name = session.pairing.name or session.pairing.id
+        client.ticket = session.ticket
+        self.log(f"🔒 {client.address[0]} 已建立加密连接 ({client.pairing_name}, {session.cipher}, "
+                 f"{'恢复会话' if session.resumed else '完整握手'})")
+
+    def _handle_peer_hello(self, client, message):
+        """本机主动建立的中继连接收到对方的握手回复"""
+        if client.handshake is not None and not client.secure:
+            try:
+                session = client.handshake.finish(message.get("secure"))
+            except SecureChannelError as e:
+                if e.code == UNKNOWN_TICKET:
+                    # 对方已重启, 票据失效: 在同一连接上重新完整握手
+                    client.handshake = ClientHandshake(client.handshake.pairing)
+                    self._send_peer_hello(client)
+                else:
+                    self.log(f"⚠️ 中继节点 {client.address[0]}:{client.address[1]} 加密握手失败: {e}")
+                    client.close()
+                return
+            client.sealer = session.sealer
+            self._start_secure(client, session)
+        client.protocol_version = message.get("protocolVersion", PROTOCOL_JSON)
+        client.compression = message.get("compression")
+        self._accept_peer(client, message.get("nodeId"))
+
+    def _accept_peer(self, client, node_id):
+        if node_id == self.relay.node_id:
+            self.log(f"忽略连接到本节点自身的中继连接: {client.address[0]}:{client.address[1]}")
+            client.close()
+            return
+        client.peer = True
+        client.peer_id = node_id
+        self.log(f"🔗 中继节点 {node_id} 已加入 ({client.address[0]}:{client.address[1]})")
+
+    def _originate(self, message):
+        """本机设备发来的剪贴板内容作为本节点的新内容转发给中继节点"""
+        content_type = message.get("contentType") or TEXT
+        content = message.get("content")
+        if not content_matches(content_type, content):
+            return
+        _, peers = self._split_clients()
+        self._relay_local(make_clipboard_message(content_type, content, message_timestamp(message)), peers)
+
+    async def _handle_relayed(self, client, message):
+        """中继连接上收到的内容: 新内容先原样转发给其他中继节点和本机设备, 再写入本机剪贴板"""
+        relay = client.pending_relay
+        client.pending_relay = None
+        if relay is None or message.get("type") != "clipboard" or not valid_relay(relay):
+            return
+        if not content_matches(message.get("contentType") or TEXT, message.get("content")):
+            return
+        origin = relay["origin"]
+        if not self.relay.accept(origin, relay.get("seq")):
+            self.metrics.increment("relayDuplicates")
+            return
+        self.metrics.increment("relayReceived")
+
+        message = make_clipboard_message(message.get("contentType") or TEXT, message["content"],
+                                         message_timestamp(message))
+        # 新内容取代仍在进行的分块传输, 与本机复制的内容相同
+        self._cancel_transfers()
+        hops = relay["hops"] + 1
+        clients, peers = self._split_clients()
+        peers = [peer for peer in peers if peer is not client and peer.peer_id != origin]
+        if peers and hops < MAX_HOPS:
+            self._broadcast_to(message, peers, make_relay(origin, relay["seq"], hops))
+        # 本机设备即使都不在线也记入 Backlog, 重连后补发
+        seq = self.backlog.add(message["contentType"], message["content"], message["timestamp"])
+        if clients:
+            self._broadcast_to(dict(message, seq=seq), clients)
+        await self.loop.run_in_executor(None, self._on_client_message, message, client.address)
+
+    def _handle_cache(self, client, message):
+        """客户端声明已缓存 / 已淘汰的内容哈希"""
+        client.cache_enabled = True
+        client.remember_hashes(string_list(message.get("hashes")))
+        client.forget_hashes(string_list(message.get("evicted")))
+
+    def _handle_subscribe(self, client, message):
+        """客户端更新订阅 (整体替换), 之后发出的内容按新订阅过滤"""
+        client.subscription = Subscription.from_message(message)
+        self.log(f"设备 {client.device_id or client.address[0]} 更新订阅: {client.subscription.to_dict()}")
+
+    def _on_client_message(self, message, address):
+        """处理客户端发来的剪贴板等消息 (在线程池中执行)"""
+        content_type = message.get("contentType") or "text/plain"
+        content = message.get("content")
+        if message.get("type") == "clipboard" and \
+                isinstance(content, str if is_text_content(content_type) else (bytes, bytearray)):
+            self._record_history(content_type, content, address[0], message.get("timestamp"))
+        if self.on_message:
+            self.on_message(message, address)
+
+    async def _handle_history_query(self, client, message):
+        """按关键词 / 类型 / 翻页位置查询历史, 数据库查询在线程池中执行"""
+        items = []
+        if self.history is not None:
+            try:
+                items = await self.loop.run_in_executor(
+                    None, lambda: self.history.query(
+                        message.get("query"), message.get("contentType"),
+                        message.get("beforeId"), message.get("limit") or 50
+                    )
+                )
+            except Exception as e:
+                self.log(f"查询历史失败: {e}")
+        result = make_history_result(message.get("requestId"), items)
+        client.enqueue(encode_message(result, client.protocol_version), droppable=False)
+
+    def _enable_acks(self, client, device_id, retransmit=True):
+        """启用投递确认; 同一 deviceId 之前未确认的内容在握手回复之后重发"""
+        client.device_id = device_id
+        if not device_id:
+            client.tracker = DeliveryTracker()
+            return
+        tracker = self.trackers.pop(device_id, None) or DeliveryTracker()
+        self.trackers[device_id] = tracker
+        while len(self.trackers) > DEVICE_TRACKER_LIMIT:
+            self.trackers.popitem(last=False)
+        client.tracker = tracker
+
+        unacked = tracker.unacked()
+        if unacked and not retransmit:
+            for pending in unacked:
+                tracker.discard(pending.digest)
+        elif unacked:
+            self.log(f"设备 {device_id} 重连, 重发 {len(unacked)} 条未确认的内容")
+            asyncio.ensure_future(self._retransmit(client, unacked))
+
+    def _resume_session(self, client, epoch, last_seq):
+        """补发 last_seq 之后发出的内容"""
+        items, missed = self.backlog.since(epoch, last_seq)
+        name = client.device_id or client.address[0]
+        if missed:
+            self.log(f"设备 {name} 错过的内容中有 {missed} 条已超出保留范围")
+        if items:
+            self.log(f"设备 {name} 恢复会话, 补发 {len(items)} 条错过的内容")
+            asyncio.ensure_future(self._replay(client, items))
+
+    async def _replay(self, client, items):
+        """按顺序补发; 本机复制的图片按该设备的规格编码 (在线程池中执行), 不符合订阅的内容跳过"""
+        for item in items:
+            if client.closed:
+                return
+            content_type, data = item.content_type, item.content
+            if not isinstance(data, (str, bytes, bytearray)):
+                spec = client.image_spec(data)
+                if spec is None:
+                    self._count_filtered([client])
+                    continue
+                content_type = spec.content_type
+                data = await self.loop.run_in_executor(None, data.encode, spec, self.metrics)
+            if not self._subscribed([client], content_type, data):
+                continue
+            digest = self.payload_store.put(content_type, data)
+            extra = {"seq": item.seq, "replayed": True}
+            if client.has_cached(digest):
+                ref = make_clipboard_ref(content_type, digest, item.timestamp)
+                payload = encode_message(dict(ref, **extra), client.protocol_version)
+            else:
+                payload = self._encode_for_client(client, content_type, data, digest, item.timestamp, extra)
+            client.enqueue(payload, content_hash=digest, track=(digest, content_type, item.timestamp))
+            self.metrics.increment("itemsReplayed")
+
+    async def _keepalive_loop(self):
+        """定期向启用保活的连接发送 ping, 断开失联的连接"""
+        while True:
+            await asyncio.sleep(KEEPALIVE_INTERVAL)
+            now = time.monotonic()
+            for client in list(self.clients):
+                if not client.keepalive or client.closed:
+                    continue
+                if not client.is_alive(now, KEEPALIVE_TIMEOUT):
+                    self.metrics.increment("keepaliveTimeouts")
+                    self.log(f"⚠️ {client.address[0]}:{client.address[1]} {KEEPALIVE_TIMEOUT} 秒无响应, 断开连接")
+                    client.close()
+                else:
+                    client.send_control(make_ping())
+
+    async def _retransmit(self, client, items):
+        for pending in items:
+            item = await self._load_payload(pending.digest)
+            if item is None or client.closed:
+                client.tracker.discard(pending.digest)
+                continue
+            payload = self._encode_for_client(client, item.content_type, item.data, pending.digest, pending.timestamp)
+            client.enqueue(payload, content_hash=pending.digest,
+                           track=(pending.digest, pending.content_type, pending.timestamp))
+
+    def _handle_ack(self, client, message):
+        """客户端确认收到内容: 更新往返时间、时钟偏差和端到端延迟"""
+        acked_at = now_ms()
+        if client.tracker is None:
+            return
+        pending = client.tracker.ack(message.get("hash"))
+        if pending is None or pending.sent_at is None:
+            return
+        try:
+            received_at = float(message["receivedAt"])
+            applied_at = float(message.get("appliedAt", received_at))
+        except (KeyError, TypeError, ValueError):
+            return
+
+        client.acks_received += 1
+        rtt, _ = client.clock.add_sample(pending.sent_at, received_at, applied_at, acked_at)
+        client.sync_latency = max(0.0, client.clock.to_server_time(applied_at) - pending.timestamp)
+        self.metrics.observe("ackRtt", rtt)
+        self.metrics.observe("syncLatency", client.sync_latency)
+
+    async def _load_payload(self, digest):
+        """从负载存储或历史中取出内容"""
+        item = self.payload_store.get(digest)
+        if item is None and self.history is not None:
+            item = await self.loop.run_in_executor(None, self.history.get, digest)
+        return item
+
+    def _encode_for_client(self, client, content_type, data, digest, timestamp=None, extra=None):
+        """按客户端协商的压缩和协议编码一条完整内容; extra 为附加字段 (如 seq)"""
+        message = make_clipboard_message(content_type, data, timestamp)
+        message["hash"] = digest
+        if extra:
+            message.update(extra)
+        if client.compression and self._should_compress(message):
+            message = self._compress_message(message, client.compression)
+        if should_chunk(message, client.protocol_version):
+            return OutgoingTransfer(next(self.transfer_ids), message)
+        return encode_message(message, client.protocol_version)
+
+    async def _handle_fetch(self, client, message):
+        """客户端按哈希取回完整内容 (例如本地缓存已丢失或查询到的历史记录)"""
+        if "manifestId" in message:
+            await self._handle_manifest_fetch(client, message)
+            return
+        digest = message.get("hash")
+        if not isinstance(digest, str):
+            return
+        client.forget_hashes([digest])
+        item = await self._load_payload(digest)
+        if item is None:
+            return
+        payload = self._encode_for_client(client, item.content_type, item.data, digest)
+        client.enqueue(payload, droppable=False, content_hash=digest)
+
+    async def _handle_manifest_fetch(self, client, message):
+        """按清单取回一种格式; 图片在这里才按客户端的规格编码 (在线程池中执行)"""
+        manifest_id = message.get("manifestId")
+        content_type = message.get("contentType") or TEXT
+        # 清单编号为整数; 字段类型不对时直接回复取回失败
+        valid = isinstance(manifest_id, int) and not isinstance(manifest_id, bool) and isinstance(content_type, str)
+        manifest = self.manifests.get(manifest_id) if valid else None
+        payload = None
+        if manifest is not None and content_type in manifest.formats:
+            digest, data, _ = manifest.formats[content_type]
+            payload = self._encode_for_client(client, content_type, data, digest, manifest.timestamp)
+        elif manifest is not None and manifest.image is not None and content_type.startswith("image/"):
+            # 主动取回不受订阅限制, 订阅中没有可用的图片格式时按客户端声明的格式编码
+            spec = client.image_spec(manifest.image) or manifest.image.spec_for(client.image_formats, client.screen_size)
+            data = await self.loop.run_in_executor(None, manifest.image.encode, spec, self.metrics)
+            digest = self.payload_store.put(spec.content_type, data)
+            payload = self._encode_for_client(client, spec.content_type, data, digest, manifest.timestamp)
+
+        if payload is None:
+            failed = make_fetch_failed(manifest_id, content_type)
+            client.enqueue(encode_message(failed, client.protocol_version), droppable=False)
+            return
+        self.metrics.increment("manifestFetches")
+        client.enqueue(payload, droppable=False, content_hash=digest)
+
+    async def _handle_stats_request(self, reader, writer):
+        """极简 HTTP: GET /stats 返回 JSON 统计"""
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5.0)
+            if len(request) > STATS_REQUEST_LIMIT:
+                raise ValueError("请求过大")
+            path = request.split(b" ", 2)[1].split(b"?")[0] if request.startswith(b"GET ") else None
+            if path in (b"/", b"/stats"):
+                body = json.dumps(self.get_stats(), ensure_ascii=False).encode('utf-8')
+                status = b"200 OK"
+            else:
+                body = b'{"error": "not found"}'
+                status = b"404 Not Found"
+            writer.write(
+                b"HTTP/1.1 " + status + b"\r\nContent-Type: application/json; charset=utf-8\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionError, OSError, ValueError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+    def _on_client_closed(self, client):
+        if client in self.clients:
+            self.clients.remove(client)
+            self._clients_changed()
+            if client.peer:
+                self.log(f"🔗 中继连接已断开: {client.address[0]}:{client.address[1]}")
+            else:
+                self.log(f"设备已断开: {client.address[0]}:{client.address[1]}")
+
+    def _clients_changed(self):
+        if self.on_clients_changed:
+            self.on_clients_changed(len(self.clients))